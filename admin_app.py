@@ -2,12 +2,29 @@
 独立的Flask后台管理应用
 运行在7860端口，替代Gradio后台管理界面
 """
+import sys
+
+# 启动耗时分析需在其他模块导入前安装钩子
+if '--profile-startup' in sys.argv:
+    from backend.startup_profile import startup_profiler
+    startup_profiler.install()
+
 from flask import Flask, render_template, request, jsonify, session, redirect, url_for, flash, send_from_directory
 import os
 from datetime import datetime
 from backend.database import DatabaseManager, init_database
 from backend.auth import AuthManager
 from backend.permissions import PermissionManager
+from backend.template_cache import init_template_cache
+from backend.metrics import init_metrics
+from backend.request_timing import init_request_timing, timing_span
+from backend.query_profiler import install_query_profiler
+from backend.access_log_archive import init_access_log_retention
+from backend.session_registry import live_session_count
+from backend.storage_reaper import init_storage_reaper
+from backend.pattern_hash import init_pattern_hash_index
+from backend.pattern_colors import init_pattern_color_index
+from backend.startup_profile import startup_profiler, startup_phase
 from routes.admin import register_admin_blueprints
 
 # 创建独立的Flask应用
@@ -32,7 +49,40 @@ os.makedirs(os.path.join(UPLOAD_FOLDER, 'products'), exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_FOLDER, 'depth_maps'), exist_ok=True)
 
 # 初始化数据库
-init_database()
+with startup_phase('init_database'):
+    init_database()
+
+# 启用模板字节码缓存和片段缓存（与前台共享缓存目录）
+with startup_phase('init_template_cache'):
+    init_template_cache(app)
+
+# 启用请求耗时分解（Server-Timing 响应头），需在其他请求钩子之前注册
+with startup_phase('init_request_timing'):
+    init_request_timing(app)
+
+# 启用运行指标（/metrics，多进程合并）
+with startup_phase('init_metrics'):
+    init_metrics(app, 'admin')
+
+# 注册SQL语句分析（默认关闭，在后台系统设置中开启）
+with startup_phase('install_query_profiler'):
+    install_query_profiler('admin')
+
+# 定期归档过期的访问记录（保留天数 ACCESS_LOG_RETENTION_DAYS，默认30天）
+with startup_phase('init_access_log_retention'):
+    init_access_log_retention(app)
+
+# 定期扫描没有数据库记录引用的上传文件（默认只记录报告，STORAGE_RECLAIM_ORPHANS 开启后直接删除）
+with startup_phase('init_storage_reaper'):
+    init_storage_reaper(app)
+
+# 后台补算已有印花的感知哈希并预建近似图案索引
+with startup_phase('init_pattern_hash_index'):
+    init_pattern_hash_index(app)
+
+# 后台补算已有印花的主色（也可运行 python -m backend.pattern_colors）
+with startup_phase('init_pattern_color_index'):
+    init_pattern_color_index(app)
 
 # 注册模板全局函数
 @app.context_processor
@@ -45,7 +95,8 @@ def inject_permissions():
     }
 
 # 注册所有管理员蓝图
-register_admin_blueprints(app)
+with startup_phase('register_admin_blueprints'):
+    register_admin_blueprints(app)
 
 # 登录检查装饰器
 def login_required(f):
@@ -85,7 +136,8 @@ def index():
             'products_count': len(products),
             'categories_count': len(categories),
             'access_codes_count': len(access_codes),
-            'users_count': len(users)
+            'users_count': len(users),
+            'online_sessions': live_session_count()
         }
     except Exception as e:
         print(f"获取统计数据失败: {e}")
@@ -94,7 +146,8 @@ def index():
             'products_count': 0,
             'categories_count': 0,
             'access_codes_count': 0,
-            'users_count': 0
+            'users_count': 0,
+            'online_sessions': 0
         }
     
     return render_template('admin/dashboard.html', stats=stats)
@@ -149,12 +202,14 @@ def logout():
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     """提供上传文件的访问"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    with timing_span('file'):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 @app.route('/static/<path:filename>')
 def static_files(filename):
     """提供静态文件访问"""
-    return send_from_directory('static', filename)
+    with timing_span('file'):
+        return send_from_directory('static', filename)
 
 def initialize_default_data():
     """初始化默认数据"""
@@ -170,6 +225,9 @@ def initialize_default_data():
             '''
             DatabaseManager.execute_insert(query, ('admin', password_hash, datetime.now()))
             print("✓ 默认管理员账户已创建")
+        elif AuthManager.is_valid_password_hash(existing_admin[0]['password_hash']):
+            # 哈希格式正确时无需重新计算PBKDF2
+            print("✓ 管理员账户已存在")
         else:
             # 更新现有管理员密码为正确的哈希值
             password_hash = AuthManager.hash_password('admin123')
@@ -204,7 +262,13 @@ def initialize_default_data():
 
 if __name__ == '__main__':
     # 初始化默认数据
-    temp_access_code = initialize_default_data()
+    with startup_phase('initialize_default_data'):
+        temp_access_code = initialize_default_data()
+    
+    if '--profile-startup' in sys.argv:
+        # 只输出启动耗时报告，不启动服务
+        print(startup_profiler.report())
+        sys.exit(0)
     
     print("=" * 60)
     print("🎨 产品印花平台后台管理系统启动成功！")
@@ -2,15 +2,29 @@
 产品印花平台主应用入口
 支持前台印花设计和后台管理功能
 """
+import sys
+
+# 启动耗时分析需在其他模块导入前安装钩子
+if '--profile-startup' in sys.argv:
+    from backend.startup_profile import startup_profiler
+    startup_profiler.install()
+
 from flask import Flask, render_template, request, jsonify, send_from_directory, session, redirect, url_for
 import os
 import threading
 import subprocess
 import time
-import requests
 from backend.database import init_database
 from frontend.api import create_api_blueprint
 from backend.auth import init_auth
+from backend.template_cache import init_template_cache
+from backend.metrics import init_metrics
+from backend.request_timing import init_request_timing, timing_span
+from backend.query_profiler import install_query_profiler
+from backend.access_events import publish_access_event
+from backend.session_registry import init_session_registry, live_sessions
+from backend.catalog_snapshot import init_catalog_snapshot
+from backend.startup_profile import startup_profiler, startup_phase
 
 app = Flask(__name__)
 app.secret_key = 'frontend-secret-key-change-in-production'
@@ -34,10 +48,36 @@ os.makedirs(os.path.join(UPLOAD_FOLDER, 'depth_maps'), exist_ok=True)
 os.makedirs(os.path.join(UPLOAD_FOLDER, 'archives'), exist_ok=True)
 
 # 初始化数据库
-init_database()
+with startup_phase('init_database'):
+    init_database()
 
 # 初始化认证系统
-init_auth(app)
+with startup_phase('init_auth'):
+    init_auth(app)
+
+# 启用模板字节码缓存（与后台共享缓存目录）
+with startup_phase('init_template_cache'):
+    init_template_cache(app)
+
+# 启用请求耗时分解（Server-Timing 响应头），需在其他请求钩子之前注册
+with startup_phase('init_request_timing'):
+    init_request_timing(app)
+
+# 启用运行指标（/metrics，多进程合并）
+with startup_phase('init_metrics'):
+    init_metrics(app, 'frontend')
+
+# 在线会话登记（会话检查走内存，活动时间定期批量写回）
+with startup_phase('init_session_registry'):
+    init_session_registry(app)
+
+# 预建前台目录快照（目录数据变化后在下次请求时重建）
+with startup_phase('init_catalog_snapshot'):
+    init_catalog_snapshot(app)
+
+# 注册SQL语句分析（默认关闭，在后台系统设置中开启）
+with startup_phase('install_query_profiler'):
+    install_query_profiler('frontend')
 
 # 注册API蓝图
 try:
@@ -49,53 +89,33 @@ except Exception as e:
     import traceback
     traceback.print_exc()
 
+# 外部分享模式（--share）下才向页面注入ngrok跳转脚本
+app.config['NGROK_SHARE_MODE'] = False
+
+@app.context_processor
+def inject_ngrok_share_mode():
+    """向模板注入分享模式标记，由模板在<head>中按需引入跳转脚本片段"""
+    return {'ngrok_share_mode': app.config['NGROK_SHARE_MODE']}
+
 # 添加中间件来跳过ngrok警告页面
 @app.after_request
 def add_ngrok_skip_header(response):
     """添加ngrok跳过浏览器警告的头部"""
-    # 为所有响应添加跳过ngrok警告的头部
-    response.headers['ngrok-skip-browser-warning'] = 'true'
-    response.headers['X-Custom-User-Agent'] = 'AutoDecal-App/1.0'
-    
-    # 如果是HTML响应，注入JavaScript自动跳转脚本
-    if response.content_type and 'text/html' in response.content_type:
-        bypass_script = '''
-        <script>
-        // 自动跳过ngrok警告页面
-        (function() {
-            if (window.location.hostname.includes('ngrok') && document.title.includes('ngrok')) {
-                const visitButton = document.querySelector('button[onclick*="visit"]') || 
-                                  document.querySelector('a[href*="visit"]') ||
-                                  document.querySelector('.visit-site');
-                if (visitButton) {
-                    visitButton.click();
-                }
-            }
-        })();
-        </script>
-        '''
-        
-        # 将脚本注入到HTML中
-        if hasattr(response, 'data'):
-            html_content = response.get_data(as_text=True)
-            if '</head>' in html_content:
-                html_content = html_content.replace('</head>', bypass_script + '</head>')
-                response.set_data(html_content)
-    
+    # 只添加响应头，不再读取和改写响应体，流式响应保持不变
+    if app.config['NGROK_SHARE_MODE']:
+        response.headers['ngrok-skip-browser-warning'] = 'true'
+        response.headers['X-Custom-User-Agent'] = 'AutoDecal-App/1.0'
     return response
 
 # 添加中间件来更新用户活动时间和检查会话状态
 @app.before_request
+@timing_span('session')
 def update_user_activity():
     """更新用户活动时间并检查会话状态"""
     if 'session_id' in session and 'access_code_validated' in session:
-        from backend.database import DatabaseManager
         try:
             # 检查会话是否仍然有效（未被强制退出）
-            query = "SELECT is_active FROM access_logs WHERE session_id = ?"
-            results = DatabaseManager.execute_query(query, (session['session_id'],))
-            
-            if not results or not results[0]['is_active']:
+            if not live_sessions.is_active(session['session_id']):
                 # 会话已被强制退出，清除本地会话
                 session.clear()
                 # 如果是API请求，返回JSON错误
@@ -110,8 +130,9 @@ def update_user_activity():
                 elif request.path not in ['/access-login', '/verify-access-code', '/']:
                     return redirect(url_for('access_code_login'))
             else:
-                # 会话有效，更新活动时间
-                DatabaseManager.update_access_log_activity(session['session_id'])
+                # 会话有效，更新活动时间（定期写回数据库）
+                live_sessions.touch(session['session_id'])
+                publish_access_event('activity', {'session_id': session['session_id']})
         except Exception as e:
             print(f"检查会话状态失败: {e}")
 
@@ -120,9 +141,9 @@ def update_user_activity():
 def logout():
     """用户登出"""
     if 'session_id' in session:
-        from backend.database import DatabaseManager
         try:
-            DatabaseManager.logout_access_log(session['session_id'])
+            if live_sessions.logout(session['session_id']):
+                publish_access_event('logout', {'session_id': session['session_id']})
         except Exception as e:
             print(f"记录登出时间失败: {e}")
     
@@ -162,8 +183,8 @@ def verify_access_code():
     """验证授权码"""
     from backend.auth import AccessCodeManager
     from backend.database import DatabaseManager
+    from backend.user_agent_cache import parse_user_agent
     import uuid
-    import user_agents
     
     access_code = request.form.get('access_code', '').strip()
     redirect_to = request.form.get('redirect_to', 'pattern_editor')
@@ -194,23 +215,32 @@ def verify_access_code():
             # 获取用户信息
             ip_address = request.environ.get('HTTP_X_FORWARDED_FOR', request.environ.get('REMOTE_ADDR', ''))
             user_agent = request.headers.get('User-Agent', '')
-            ua = user_agents.parse(user_agent)
-            
-            browser = f"{ua.browser.family} {ua.browser.version_string}" if ua.browser.family else "Unknown"
-            operating_system = f"{ua.os.family} {ua.os.version_string}" if ua.os.family else "Unknown"
+            # 相同UA只解析一次，展会现场设备UA高度重复
+            browser, operating_system = parse_user_agent(user_agent)
             
             # 简单的地理位置信息（这里可以集成IP地理位置API）
             location = "未知地区"  # 可以后续集成IP地理位置服务
             
             # 记录访问日志
-            DatabaseManager.add_access_log(
+            log_id = DatabaseManager.add_access_log(
                 session_id=session_id,
                 access_code=access_code,
                 ip_address=ip_address,
                 location=location,
                 browser=browser,
-                operating_system=operating_system
+                operating_system=operating_system,
+                user_agent=user_agent
             )
+            live_sessions.register(session_id, log_id, access_code)
+            publish_access_event('login', {
+                'id': log_id,
+                'session_id': session_id,
+                'access_code': access_code,
+                'ip_address': ip_address,
+                'location': location,
+                'browser': browser,
+                'operating_system': operating_system
+            })
             
             # 设置会话信息
             session['access_code_validated'] = True
@@ -228,10 +258,13 @@ def verify_access_code():
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
     """提供上传文件的访问"""
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
+    with timing_span('file'):
+        return send_from_directory(app.config['UPLOAD_FOLDER'], filename)
 
 def get_ngrok_public_url():
     """获取ngrok公网链接"""
+    # 仅分享模式需要，延迟导入以加快启动
+    import requests
     try:
         response = requests.get('http://localhost:4040/api/tunnels', timeout=5)
         if response.status_code == 200:
@@ -344,6 +377,7 @@ def start_flask_with_share(share=False, port=5000):
     public_url = None
     
     if share:
+        app.config['NGROK_SHARE_MODE'] = True
         result = setup_ngrok_tunnel(port)
         if result:
             public_url, ngrok_process = result
@@ -395,6 +429,9 @@ def initialize_default_data():
                 permissions={'all': True}
             )
             print("✓ 默认管理员账户已创建")
+        elif AuthManager.is_valid_password_hash(existing_admin[0]['password_hash']):
+            # 哈希格式正确时无需重新计算PBKDF2
+            print("✓ 管理员账户已存在")
         else:
             # 更新现有管理员密码为正确的哈希值
             password_hash = AuthManager.hash_password('admin123')
@@ -429,7 +466,13 @@ def initialize_default_data():
 
 if __name__ == '__main__':
     # 初始化默认数据
-    temp_access_code = initialize_default_data()
+    with startup_phase('initialize_default_data'):
+        temp_access_code = initialize_default_data()
+    
+    if '--profile-startup' in sys.argv:
+        # 只输出启动耗时报告，不启动服务
+        print(startup_profiler.report())
+        sys.exit(0)
     
     print("=" * 60)
     print("🎨 产品印花平台前台启动成功！")
@@ -442,7 +485,6 @@ if __name__ == '__main__':
     print("-" * 60)
     
     # 检查是否启用外部分享
-    import sys
     share_enabled = '--share' in sys.argv or '-s' in sys.argv
     
     if share_enabled:
@@ -0,0 +1,182 @@
+"""
+访问记录实时事件
+前台和后台进程把登录、登出、活动和强制登出事件追加到 instance/access_events/events.ndjson，
+后台进程在有页面订阅时启动转发线程读取新增事件，发布到进程内事件总线，再通过SSE推送给访问记录页面
+"""
+import json
+import os
+import queue
+import threading
+import time
+from collections import deque
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+EVENTS_DIR = os.path.join('instance', 'access_events')
+EVENTS_FILE = 'events.ndjson'
+# 事件文件超过该大小时轮转（只保留上一份）
+MAX_EVENTS_FILE_BYTES = 4 * 1024 * 1024
+# 同一会话的活动事件最小间隔（秒），前台每个请求都会更新活动时间，不逐条推送
+ACTIVITY_INTERVAL = 15
+# 转发线程检查新事件的间隔（秒）
+RELAY_POLL_INTERVAL = 0.5
+
+
+class EventBus:
+    """进程内事件总线：每个订阅者一个有界队列，保留最近的事件供断线重连时补发"""
+
+    def __init__(self, history: int = 200, queue_size: int = 500):
+        self._lock = threading.Lock()
+        self._subscribers = set()
+        self._history = deque(maxlen=history)
+        self._queue_size = queue_size
+        self._next_id = 1
+
+    def publish(self, event_type: str, data: Dict[str, Any], event_time: Optional[str] = None) -> Dict[str, Any]:
+        with self._lock:
+            event = {
+                'id': self._next_id,
+                'type': event_type,
+                'time': event_time or datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'data': data,
+            }
+            self._next_id += 1
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait(event)
+            except queue.Full:
+                # 订阅者消费过慢，丢弃最旧的事件
+                try:
+                    subscriber.get_nowait()
+                    subscriber.put_nowait(event)
+                except (queue.Empty, queue.Full):
+                    pass
+        return event
+
+    def subscribe(self, last_event_id: Optional[int] = None) -> queue.Queue:
+        """订阅事件，last_event_id 之后的历史事件会先放入队列"""
+        subscriber = queue.Queue(maxsize=self._queue_size)
+        with self._lock:
+            if last_event_id is not None:
+                for event in self._history:
+                    if event['id'] > last_event_id:
+                        subscriber.put_nowait(event)
+            self._subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: queue.Queue):
+        with self._lock:
+            self._subscribers.discard(subscriber)
+
+    @property
+    def subscriber_count(self) -> int:
+        with self._lock:
+            return len(self._subscribers)
+
+
+bus = EventBus()
+
+_activity_published: Dict[str, float] = {}
+_activity_lock = threading.Lock()
+_relay_lock = threading.Lock()
+_relay_thread: Optional[threading.Thread] = None
+
+
+def _events_path(directory: Optional[str] = None) -> str:
+    return os.path.join(directory or EVENTS_DIR, EVENTS_FILE)
+
+
+def publish_access_event(event_type: str, data: Dict[str, Any], directory: Optional[str] = None):
+    """
+    记录访问事件（login / logout / activity / force_logout），任一进程均可调用
+    写入失败只打印，不影响登录等主流程
+    """
+    if event_type == 'activity':
+        session_id = data.get('session_id')
+        now = time.monotonic()
+        with _activity_lock:
+            if now - _activity_published.get(session_id, 0.0) < ACTIVITY_INTERVAL:
+                return
+            if len(_activity_published) > 10000:
+                _activity_published.clear()
+            _activity_published[session_id] = now
+    elif event_type in ('logout', 'force_logout'):
+        with _activity_lock:
+            _activity_published.pop(data.get('session_id'), None)
+
+    path = _events_path(directory)
+    line = json.dumps({
+        'type': event_type,
+        'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'data': data,
+    }, ensure_ascii=False, default=str) + '\n'
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            if os.path.getsize(path) > MAX_EVENTS_FILE_BYTES:
+                os.replace(path, path + '.1')
+        except OSError:
+            pass
+        # 追加模式下单行写入不会与其他进程的写入交错
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(line)
+    except OSError as e:
+        print(f"记录访问事件失败: {e}")
+
+
+def _relay(path: str, target: EventBus):
+    """读取事件文件新增的完整行并发布到事件总线，只转发启动之后的事件"""
+    try:
+        stat = os.stat(path)
+        inode, offset = stat.st_ino, stat.st_size
+    except OSError:
+        inode, offset = None, 0
+    pending = b''
+    while True:
+        time.sleep(RELAY_POLL_INTERVAL)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            continue
+        if stat.st_ino != inode or stat.st_size < offset:
+            # 文件已轮转，从新文件开头读取
+            inode, offset, pending = stat.st_ino, 0, b''
+        if stat.st_size == offset:
+            continue
+        try:
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                chunk = f.read(stat.st_size - offset)
+        except OSError:
+            continue
+        offset += len(chunk)
+        lines = (pending + chunk).split(b'\n')
+        # 最后一段可能是正在写入的半行
+        pending = lines.pop()
+        for raw in lines:
+            if not raw.strip():
+                continue
+            try:
+                event = json.loads(raw)
+                target.publish(event['type'], event.get('data') or {}, event.get('time'))
+            except (ValueError, KeyError, TypeError) as e:
+                print(f"解析访问事件失败: {e}")
+
+
+def ensure_event_relay(directory: Optional[str] = None) -> EventBus:
+    """确保转发线程已启动（首次有页面订阅时调用），返回事件总线"""
+    global _relay_thread
+    with _relay_lock:
+        if _relay_thread is None or not _relay_thread.is_alive():
+            _relay_thread = threading.Thread(target=_relay, args=(_events_path(directory), bus),
+                                             name='access-event-relay', daemon=True)
+            _relay_thread.start()
+    return bus
+
+
+def format_sse(event: Dict[str, Any]) -> str:
+    """格式化为SSE消息"""
+    payload = json.dumps({'time': event['time'], **event['data']}, ensure_ascii=False, default=str)
+    return f"id: {event['id']}\nevent: {event['type']}\ndata: {payload}\n\n"
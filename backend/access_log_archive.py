@@ -0,0 +1,273 @@
+"""
+访问记录保留与冷归档
+已离线且超过保留天数的访问记录按登录月份追加到 instance/access_log_archive/access_logs_YYYY-MM.ndjson.gz，
+每批写入一个独立的gzip分段，分段位置记录在 access_log_archives 表中，查询时只解压命中的分段；
+每批的索引写入和热表删除在同一个短事务中完成，避免长时间锁库
+"""
+import gzip
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional
+
+from .database import get_db_connection
+
+ARCHIVE_DIR = os.path.join('instance', 'access_log_archive')
+DEFAULT_RETENTION_DAYS = 30
+DEFAULT_BATCH_SIZE = 500
+# SQLite 单条语句的参数个数有上限，每批删除的记录数不超过该值
+MAX_BATCH_SIZE = 900
+# 两批之间让出数据库写锁的间隔（秒）
+BATCH_PAUSE = 0.05
+# 归档任务异常退出后锁文件的过期时间（秒），运行中每批都会刷新
+LOCK_TIMEOUT = 300
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _archive_filename(month: str) -> str:
+    return f'access_logs_{month}.ndjson.gz'
+
+
+def _acquire_lock(archive_dir: str) -> Optional[int]:
+    """获取归档锁，多个进程同时触发时只由一个执行"""
+    os.makedirs(archive_dir, exist_ok=True)
+    lock_path = os.path.join(archive_dir, '.archive.lock')
+    try:
+        if time.time() - os.path.getmtime(lock_path) > LOCK_TIMEOUT:
+            # 上次归档异常退出留下的锁
+            os.remove(lock_path)
+    except OSError:
+        pass
+    try:
+        return os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return None
+
+
+def _release_lock(archive_dir: str, lock_fd: int):
+    os.close(lock_fd)
+    try:
+        os.remove(os.path.join(archive_dir, '.archive.lock'))
+    except OSError:
+        pass
+
+
+def _write_segment(path: str, rows: List[Dict[str, Any]]) -> tuple:
+    """把一组记录作为新的gzip分段追加到归档文件末尾，返回 (偏移, 长度)"""
+    payload = gzip.compress(b''.join(
+        json.dumps(row, ensure_ascii=False, default=str).encode('utf-8') + b'\n' for row in rows))
+    with open(path, 'ab') as f:
+        offset = f.tell()
+        f.write(payload)
+        f.flush()
+        # 先落盘再删除数据库中的记录
+        os.fsync(f.fileno())
+    return offset, len(payload)
+
+
+def _archive_batch(cutoff: Optional[str], batch_size: int, archive_dir: str) -> int:
+    """归档一批记录，返回归档条数"""
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        query = "SELECT * FROM access_logs WHERE is_active = 0"
+        params = []
+        if cutoff:
+            query += " AND last_activity < ?"
+            params.append(cutoff)
+        query += " ORDER BY id LIMIT ?"
+        params.append(batch_size)
+        rows = [dict(row) for row in cursor.execute(query, params).fetchall()]
+        if not rows:
+            return 0
+
+        # 按登录月份分区
+        months: Dict[str, List[Dict[str, Any]]] = {}
+        for row in rows:
+            month = str(row.get('login_time') or row.get('last_activity') or '')[:7] or 'unknown'
+            months.setdefault(month, []).append(row)
+
+        segments = []
+        for month, items in sorted(months.items()):
+            filename = _archive_filename(month)
+            offset, length = _write_segment(os.path.join(archive_dir, filename), items)
+            login_times = [str(item.get('login_time') or '') for item in items]
+            codes = sorted({item.get('access_code') or '' for item in items})
+            segments.append((
+                filename, offset, length, len(items),
+                min(item['id'] for item in items), max(item['id'] for item in items),
+                min(login_times), max(login_times), ',' + ','.join(codes) + ',',
+            ))
+
+        # 分段写入索引后未提交时异常退出，只会在文件中留下没有索引的分段，查询时不会读到
+        cursor.executemany('''
+            INSERT INTO access_log_archives
+            (archive_file, member_offset, member_length, row_count, min_log_id, max_log_id,
+             first_login, last_login, access_codes)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', segments)
+        ids = [row['id'] for row in rows]
+        cursor.execute(f"DELETE FROM access_logs WHERE id IN ({','.join('?' * len(ids))})", ids)
+        conn.commit()
+        return len(rows)
+    finally:
+        conn.close()
+
+
+def archive_closed_logs(older_than_days: Optional[float] = DEFAULT_RETENTION_DAYS,
+                        batch_size: int = DEFAULT_BATCH_SIZE, max_batches: Optional[int] = None,
+                        archive_dir: str = ARCHIVE_DIR) -> Optional[Dict[str, Any]]:
+    """
+    归档已离线且最后活动时间早于 older_than_days 天前的访问记录，older_than_days 为 None 时归档全部离线记录
+    其他进程正在归档时返回 None
+    """
+    batch_size = max(1, min(batch_size, MAX_BATCH_SIZE))
+    cutoff = None
+    if older_than_days is not None:
+        cutoff = (datetime.now() - timedelta(days=older_than_days)).strftime(TIME_FORMAT)
+
+    lock_fd = _acquire_lock(archive_dir)
+    if lock_fd is None:
+        return None
+    archived = 0
+    batches = 0
+    started = time.perf_counter()
+    try:
+        while max_batches is None or batches < max_batches:
+            count = _archive_batch(cutoff, batch_size, archive_dir)
+            if not count:
+                break
+            archived += count
+            batches += 1
+            os.utime(os.path.join(archive_dir, '.archive.lock'))
+            if count < batch_size:
+                break
+            time.sleep(BATCH_PAUSE)
+    finally:
+        _release_lock(archive_dir, lock_fd)
+    return {
+        'archived': archived,
+        'batches': batches,
+        'cutoff': cutoff,
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+    }
+
+
+def _read_segment(path: str, offset: int, length: int) -> List[Dict[str, Any]]:
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(length)
+    return [json.loads(line) for line in gzip.decompress(data).splitlines() if line]
+
+
+def query_archived_logs(access_code: Optional[str] = None, start: Optional[str] = None,
+                        end: Optional[str] = None, limit: int = 200,
+                        archive_dir: str = ARCHIVE_DIR) -> List[Dict[str, Any]]:
+    """
+    查询已归档的访问记录，按登录时间倒序
+    start/end 为登录时间范围（与数据库相同的 'YYYY-MM-DD HH:MM:SS' 格式，可只写日期）
+    """
+    conditions = []
+    params = []
+    if access_code:
+        conditions.append("instr(access_codes, ?) > 0")
+        params.append(f',{access_code},')
+    if start:
+        conditions.append("last_login >= ?")
+        params.append(start)
+    if end:
+        conditions.append("first_login <= ?")
+        params.append(end)
+    query = "SELECT * FROM access_log_archives"
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    query += " ORDER BY last_login DESC"
+
+    conn = get_db_connection()
+    try:
+        segments = [dict(row) for row in conn.execute(query, params).fetchall()]
+    finally:
+        conn.close()
+
+    # 日期格式的结束时间包含当天
+    end_bound = end + ' 99' if end and len(end) <= 10 else end
+    results: Dict[int, Dict[str, Any]] = {}
+    for segment in segments:
+        if len(results) >= limit:
+            # 分段按最晚登录时间倒序，后面的分段不可能再进入前 limit 条
+            oldest_kept = sorted(str(row.get('login_time') or '') for row in results.values())[-limit]
+            if segment['last_login'] < oldest_kept:
+                break
+        path = os.path.join(archive_dir, segment['archive_file'])
+        try:
+            rows = _read_segment(path, segment['member_offset'], segment['member_length'])
+        except (OSError, EOFError, ValueError) as e:
+            print(f"读取访问记录归档失败 {segment['archive_file']}@{segment['member_offset']}: {e}")
+            continue
+        for row in rows:
+            login_time = str(row.get('login_time') or '')
+            if access_code and row.get('access_code') != access_code:
+                continue
+            if start and login_time < start:
+                continue
+            if end_bound and login_time > end_bound:
+                continue
+            results[row['id']] = row
+
+    ordered = sorted(results.values(), key=lambda row: str(row.get('login_time') or ''), reverse=True)
+    return ordered[:limit]
+
+
+def archive_stats(archive_dir: str = ARCHIVE_DIR) -> Dict[str, Any]:
+    """归档概况：记录数、分段数、文件数和大小、时间范围"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute('''
+            SELECT COUNT(*) AS segments, COALESCE(SUM(row_count), 0) AS rows,
+                   COUNT(DISTINCT archive_file) AS files,
+                   MIN(first_login) AS first_login, MAX(last_login) AS last_login
+            FROM access_log_archives
+        ''').fetchone()
+        stats = dict(row)
+    finally:
+        conn.close()
+    total_bytes = 0
+    if os.path.isdir(archive_dir):
+        for name in os.listdir(archive_dir):
+            if name.endswith('.ndjson.gz'):
+                total_bytes += os.path.getsize(os.path.join(archive_dir, name))
+    stats['bytes'] = total_bytes
+    return stats
+
+
+def init_access_log_retention(app) -> Optional[threading.Event]:
+    """
+    启动后台线程定期归档过期的访问记录
+    app.config['ACCESS_LOG_RETENTION_DAYS'] 为保留天数（None 关闭自动归档），
+    ACCESS_LOG_RETENTION_INTERVAL 为检查间隔（秒）；返回的 Event 被设置后线程退出
+    """
+    app.config.setdefault('ACCESS_LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    app.config.setdefault('ACCESS_LOG_RETENTION_INTERVAL', 6 * 3600)
+    app.config.setdefault('ACCESS_LOG_RETENTION_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+    if app.config['ACCESS_LOG_RETENTION_DAYS'] is None or app.config['ACCESS_LOG_RETENTION_INTERVAL'] <= 0:
+        return None
+
+    stop = threading.Event()
+
+    def run():
+        # 启动后稍等再执行第一次，避免与启动过程争用数据库
+        delay = min(60, app.config['ACCESS_LOG_RETENTION_INTERVAL'])
+        while not stop.wait(delay):
+            delay = app.config['ACCESS_LOG_RETENTION_INTERVAL']
+            try:
+                result = archive_closed_logs(app.config['ACCESS_LOG_RETENTION_DAYS'],
+                                             app.config['ACCESS_LOG_RETENTION_BATCH_SIZE'])
+                if result and result['archived']:
+                    print(f"已归档 {result['archived']} 条过期访问记录（{result['batches']} 批）")
+            except Exception as e:
+                print(f"归档访问记录失败: {e}")
+
+    threading.Thread(target=run, name='access-log-retention', daemon=True).start()
+    return stop
@@ -0,0 +1,126 @@
+"""
+产品效果归档导出
+把归档记录生成Excel工作簿，图片字段直接插入归档目录中的图片
+"""
+import io
+import os
+from typing import Any, Dict, List
+
+ARCHIVE_DIR = os.path.join('uploads', 'archives')
+
+# 字段映射
+FIELD_MAPPING = {
+    'access_code': '授权码',
+    'original_product_path': '原产品图',
+    'original_depth_path': '原深度图',
+    'effect_image_path': '产品效果图',
+    'effect_category': '效果类型',
+    'register_time': '登记时间',
+    'follow_up_person': '登记人',
+    'register_info': '登记信息'
+}
+
+# 图片字段
+IMAGE_FIELDS = ['original_product_path', 'original_depth_path', 'effect_image_path']
+
+
+def build_archive_workbook(archives: List[Dict[str, Any]], selected_fields: List[str],
+                           archive_dir: str = ARCHIVE_DIR) -> io.BytesIO:
+    """生成归档Excel，返回已定位到开头的内存文件"""
+    from openpyxl import Workbook
+    from openpyxl.drawing.image import Image
+    from openpyxl.styles import Alignment, Font
+
+    # 创建工作簿
+    wb = Workbook()
+    ws = wb.active
+    ws.title = "产品效果归档"
+
+    # 写入表头
+    headers = [FIELD_MAPPING[field] for field in selected_fields if field in FIELD_MAPPING]
+    for col, header in enumerate(headers, 1):
+        ws.cell(row=1, column=col, value=header)
+
+    # 设置表头样式
+    header_font = Font(name='微软雅黑', size=12, bold=True)
+    header_alignment = Alignment(horizontal='center', vertical='center')
+
+    for col in range(1, len(headers) + 1):
+        cell = ws.cell(row=1, column=col)
+        cell.font = header_font
+        cell.alignment = header_alignment
+
+    # 设置数据行样式
+    data_font = Font(name='微软雅黑', size=11)
+    data_alignment = Alignment(horizontal='center', vertical='center')
+
+    # 包含图片字段时为图片预留行高
+    has_image = any(field in IMAGE_FIELDS for field in selected_fields)
+
+    # 写入数据
+    for row_idx, archive in enumerate(archives, 2):
+        ws.row_dimensions[row_idx].height = 60 if has_image else 20
+
+        for col_idx, field in enumerate(selected_fields, 1):
+            if field not in FIELD_MAPPING:
+                continue
+
+            cell = ws.cell(row=row_idx, column=col_idx)
+            cell.font = data_font
+            cell.alignment = data_alignment
+
+            if field in IMAGE_FIELDS:
+                # 处理图片字段，数据库中存储的是文件名
+                image_filename = archive.get(field, '')
+                if image_filename:
+                    full_image_path = os.path.join(archive_dir, image_filename)
+                    if os.path.exists(full_image_path):
+                        try:
+                            # 直接插入原图片到Excel，缩小显示在单元格中
+                            excel_img = Image(full_image_path)
+                            excel_img.width = 80
+                            excel_img.height = 50
+                            excel_img.anchor = cell.coordinate
+                            ws.add_image(excel_img)
+                        except Exception:
+                            # 如果图片处理失败，显示文件名
+                            cell.value = image_filename
+                    else:
+                        cell.value = "图片不存在"
+                else:
+                    cell.value = "无图片"
+            else:
+                # 处理非图片字段
+                value = archive.get(field, '') or ''
+                # 处理时间格式
+                if field == 'register_time' and value:
+                    value = str(value)[:16] if len(str(value)) > 16 else str(value)
+                cell.value = value
+
+    # 调整列宽
+    for col_idx, field in enumerate(selected_fields, 1):
+        column_letter = ws.cell(row=1, column=col_idx).column_letter
+
+        if field in IMAGE_FIELDS:
+            # 图片列设置固定宽度
+            ws.column_dimensions[column_letter].width = 12
+        else:
+            # 非图片列根据内容调整宽度
+            max_length = 0
+            for row in range(1, len(archives) + 2):
+                cell_value = ws.cell(row=row, column=col_idx).value
+                if cell_value:
+                    # 中文字符按2个字符计算宽度
+                    length = sum(2 if ord(char) > 127 else 1 for char in str(cell_value))
+                    if length > max_length:
+                        max_length = length
+
+            # 设置合适的列宽，最小8，最大30
+            adjusted_width = max(min(max_length + 2, 30), 8)
+            ws.column_dimensions[column_letter].width = adjusted_width
+
+    # 保存到内存
+    output = io.BytesIO()
+    wb.save(output)
+    output.seek(0)
+    return output
@@ -20,6 +20,19 @@ class AuthManager:
         password_hash = hashlib.pbkdf2_hmac('sha256', password.encode(), salt.encode(), 100000)
         return f"{salt}:{password_hash.hex()}"
     
+    @staticmethod
+    def is_valid_password_hash(password_hash: str) -> bool:
+        """检查密码哈希是否为当前格式（salt:hash），无需执行PBKDF2计算"""
+        parts = (password_hash or '').split(':')
+        if len(parts) != 2 or len(parts[0]) != 32 or len(parts[1]) != 64:
+            return False
+        try:
+            bytes.fromhex(parts[0])
+            bytes.fromhex(parts[1])
+        except ValueError:
+            return False
+        return True
+    
     @staticmethod
     def verify_password(password: str, password_hash: str) -> bool:
         """验证密码"""
@@ -0,0 +1,92 @@
+"""
+前台启动数据
+把编辑器首屏需要的印花、产品分类、默认分类的产品和当前主题的背景图合并为一个响应，
+数据取自目录快照，以快照的版本标记作为ETag，序列化后的JSON按 (版本, 主题, 分类) 缓存在进程内
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .catalog_snapshot import CatalogSnapshot, catalog
+
+# category_id 为该值时返回全部产品
+ALL_PRODUCTS = 'all'
+
+
+def build_bootstrap(theme: str = 'default', category_id: Any = None,
+                    snapshot: Optional[CatalogSnapshot] = None) -> Dict[str, Any]:
+    """
+    组装启动数据；category_id 为空时返回默认分类（没有默认分类时为第一个分类）的产品，
+    为 'all' 时返回全部产品
+    """
+    snapshot = snapshot or catalog.current()
+    categories = snapshot.categories
+    default_category = next((c for c in categories if c['is_default']), categories[0] if categories else None)
+    if category_id == ALL_PRODUCTS:
+        product_category_id = None
+    elif category_id:
+        product_category_id = category_id
+    else:
+        product_category_id = default_category['id'] if default_category else None
+    return {
+        'patterns': snapshot.patterns,
+        'categories': categories,
+        'default_category': default_category,
+        'product_category_id': product_category_id,
+        'products': snapshot.products_for(product_category_id),
+        'theme': theme,
+        'backgrounds': snapshot.backgrounds_for(theme),
+        'themes': snapshot.themes(),
+    }
+
+
+class BootstrapCache:
+    """序列化后的启动数据，键为 (快照版本标记, 主题, 分类)，数据变化后旧条目按LRU淘汰"""
+
+    def __init__(self, max_size: int = 64):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple, bytes]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, theme: str = 'default', category_id: Any = None) -> Tuple[str, bytes]:
+        """返回 (版本标记, JSON字节)"""
+        snapshot = catalog.current()
+        revision = snapshot.tag
+        key = (revision, theme, category_id)
+        with self._lock:
+            body = self._entries.get(key)
+            if body is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return revision, body
+            self.misses += 1
+
+        payload = {'success': True, 'revision': revision, 'data': build_bootstrap(theme, category_id, snapshot)}
+        body = json.dumps(payload, ensure_ascii=False, default=str, separators=(',', ':')).encode('utf-8')
+
+        with self._lock:
+            self._entries[key] = body
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return revision, body
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+bootstrap_cache = BootstrapCache()
@@ -0,0 +1,226 @@
+"""
+前台目录快照
+启用中的印花、产品分类（含产品数量）、产品和主题背景图在进程内保存为只读快照，
+各接口视图预先序列化为JSON字节，请求直接返回，不再逐次JOIN查询。
+每次读取前在常驻连接上检查 PRAGMA data_version（只有其他连接提交写入后才会变化），
+变化时再比较 data_revisions 中目录相关表的版本号，确有变化才在一个读事务中重建快照并整体替换
+"""
+import json
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from . import database
+
+# 快照涉及的表，版本号顺序即版本标记中的顺序
+CATALOG_TABLES = ('patterns', 'pattern_categories', 'product_categories', 'products', 'theme_backgrounds')
+
+
+def _dumps(payload: Any) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=str, separators=(',', ':')).encode('utf-8')
+
+
+def _response_bytes(data: Any) -> bytes:
+    """与接口 jsonify({'success': True, 'data': ...}) 相同结构的响应体"""
+    return _dumps({'success': True, 'data': data})
+
+
+EMPTY_LIST_RESPONSE = _response_bytes([])
+
+
+class CatalogSnapshot:
+    """某一数据版本的目录数据，构造后不再修改（调用方不得修改其中的列表和字典）"""
+
+    def __init__(self, revisions: Tuple[int, ...], patterns: List[Dict[str, Any]],
+                 categories: List[Dict[str, Any]], products: List[Dict[str, Any]],
+                 default_category: Optional[Dict[str, Any]], backgrounds: List[Dict[str, Any]]):
+        self.revisions = revisions
+        self.tag = 'c' + '-'.join(str(revision) for revision in revisions)
+        self.built_at = time.time()
+        self.patterns = tuple(patterns)
+        self.categories = tuple(categories)
+        self.products = tuple(products)
+        self.default_category = default_category
+
+        products_by_category: Dict[int, List[Dict[str, Any]]] = {}
+        for product in products:
+            products_by_category.setdefault(product['category_id'], []).append(product)
+        self.products_by_category = {category_id: tuple(items) for category_id, items in products_by_category.items()}
+
+        backgrounds_by_theme: Dict[str, List[Dict[str, Any]]] = {}
+        for bg in backgrounds:
+            backgrounds_by_theme.setdefault(bg['theme'], []).append(bg)
+        self.backgrounds_by_theme = {theme: tuple(items) for theme, items in backgrounds_by_theme.items()}
+
+        # 预序列化的接口视图
+        self._views = {
+            'patterns': _response_bytes(patterns),
+            'categories': _response_bytes(categories),
+            'products': _response_bytes(products),
+            'default_category': _response_bytes(default_category),
+        }
+        for category_id, items in products_by_category.items():
+            self._views[f'products:{category_id}'] = _response_bytes(items)
+        for theme, items in backgrounds_by_theme.items():
+            self._views[f'theme_backgrounds:{theme}'] = _response_bytes(items)
+
+    def products_for(self, category_id: Optional[int] = None) -> Tuple[Dict[str, Any], ...]:
+        if not category_id:
+            return self.products
+        return self.products_by_category.get(category_id, ())
+
+    def backgrounds_for(self, theme: str) -> Tuple[Dict[str, Any], ...]:
+        return self.backgrounds_by_theme.get(theme, ())
+
+    def themes(self) -> List[Dict[str, Any]]:
+        """有背景图的主题及背景图数量，默认主题始终在第一位"""
+        counts = {theme: len(items) for theme, items in self.backgrounds_by_theme.items()}
+        themes = [{'name': 'default', 'is_default': True, 'background_count': counts.pop('default', 0)}]
+        themes.extend({'name': name, 'is_default': False, 'background_count': count}
+                      for name, count in sorted(counts.items()))
+        return themes
+
+    def view(self, name: str, key: Any = None) -> bytes:
+        """
+        预序列化的接口响应体：patterns / categories / default_category / products（key 为分类ID）/
+        theme_backgrounds（key 为主题）
+        """
+        if key:
+            return self._views.get(f'{name}:{key}', EMPTY_LIST_RESPONSE)
+        return self._views.get(name, EMPTY_LIST_RESPONSE)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'tag': self.tag,
+            'built_at': self.built_at,
+            'patterns': len(self.patterns),
+            'categories': len(self.categories),
+            'products': len(self.products),
+            'backgrounds': sum(len(items) for items in self.backgrounds_by_theme.values()),
+            'view_bytes': sum(len(body) for body in self._views.values()),
+        }
+
+
+def _read_revisions(cursor) -> Tuple[int, ...]:
+    placeholders = ','.join('?' * len(CATALOG_TABLES))
+    rows = cursor.execute(
+        f"SELECT table_name, revision FROM data_revisions WHERE table_name IN ({placeholders})",
+        CATALOG_TABLES).fetchall()
+    revisions = {row[0]: row[1] for row in rows}
+    return tuple(revisions.get(name, 0) for name in CATALOG_TABLES)
+
+
+def build_snapshot(conn: sqlite3.Connection) -> CatalogSnapshot:
+    """在一个读事务中读取版本号和全部目录数据，保证快照与版本号一致"""
+    conn.execute("BEGIN")
+    try:
+        cursor = conn.cursor()
+        revisions = _read_revisions(cursor)
+        patterns = [dict(row) for row in cursor.execute('''
+            SELECT p.*, pc.name as category_name
+            FROM patterns p
+            LEFT JOIN pattern_categories pc ON p.category_id = pc.id
+            WHERE p.is_active = 1
+            ORDER BY p.upload_time DESC
+        ''')]
+        products = [dict(row) for row in cursor.execute('''
+            SELECT p.*, c.name as category_name
+            FROM products p
+            LEFT JOIN product_categories c ON p.category_id = c.id
+            WHERE p.is_active = 1
+            ORDER BY p.upload_time DESC
+        ''')]
+        categories = [dict(row) for row in cursor.execute('''
+            SELECT * FROM product_categories WHERE is_active = 1 ORDER BY sort_order, created_time
+        ''')]
+        backgrounds = [{
+            'id': row['id'],
+            'name': row['background_name'],
+            'url': row['file_path'],
+            'theme': row['theme_name'],
+            'file_size': row['file_size']
+        } for row in cursor.execute('''
+            SELECT * FROM theme_backgrounds WHERE is_active = 1 ORDER BY theme_name, upload_time DESC
+        ''')]
+    finally:
+        conn.rollback()
+
+    # 产品数量由快照中的产品统计，不再JOIN
+    counts: Dict[int, int] = {}
+    for product in products:
+        counts[product['category_id']] = counts.get(product['category_id'], 0) + 1
+    for category in categories:
+        category['product_count'] = counts.get(category['id'], 0)
+    default_category = next((dict(c) for c in categories if c['is_default']), None)
+    if default_category is not None:
+        default_category.pop('product_count', None)
+    return CatalogSnapshot(revisions, patterns, categories, products, default_category, backgrounds)
+
+
+class CatalogStore:
+    """进程内的当前快照；读取时做廉价的变化检查，需要时重建并原子替换引用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._data_version: Optional[int] = None
+        self._snapshot: Optional[CatalogSnapshot] = None
+        self.rebuilds = 0
+        self.checks = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(database.DATABASE_PATH, check_same_thread=False, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            self._conn = conn
+        return self._conn
+
+    def current(self) -> CatalogSnapshot:
+        """返回最新快照（数据库未被其他连接写入时只执行一次 PRAGMA data_version）"""
+        with self._lock:
+            self.checks += 1
+            conn = self._connection()
+            data_version = conn.execute("PRAGMA data_version").fetchone()[0]
+            if self._snapshot is not None and data_version == self._data_version:
+                return self._snapshot
+            # 有写入（多数是访问记录），目录版本号未变时沿用快照
+            if self._snapshot is None or _read_revisions(conn.cursor()) != self._snapshot.revisions:
+                self._snapshot = build_snapshot(conn)
+                self.rebuilds += 1
+            self._data_version = data_version
+            return self._snapshot
+
+    def invalidate(self):
+        """丢弃快照，下次读取时重建"""
+        with self._lock:
+            self._snapshot = None
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+            self._snapshot = None
+            self._data_version = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        snapshot = self._snapshot
+        return {
+            'checks': self.checks,
+            'rebuilds': self.rebuilds,
+            'snapshot': snapshot.stats() if snapshot else None,
+        }
+
+
+catalog = CatalogStore()
+
+
+def init_catalog_snapshot(app) -> CatalogStore:
+    """为前台应用预建目录快照"""
+    try:
+        catalog.current()
+    except Exception as e:
+        # 数据库不可用时不影响启动，首次请求时再构建
+        print(f"构建目录快照失败: {e}")
+    return catalog
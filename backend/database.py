@@ -4,23 +4,53 @@
 """
 import sqlite3
 import os
+import re
+import time
 from datetime import datetime
-from typing import List, Optional, Dict, Any
+from typing import Callable, List, Optional, Dict, Any
 from .models import Pattern, ProductCategory, Product, AccessCode, User
 
 DATABASE_PATH = 'database.db'
 
+# 数据库结构版本，修改表结构或默认数据时递增，启动时版本一致则跳过建表流程
+SCHEMA_VERSION = 7
+
+# 需要维护数据版本号的表，写入时自动递增版本，供模板片段缓存等判断数据是否变化
+REVISION_TRACKED_TABLES = (
+    'patterns', 'pattern_categories', 'product_categories', 'products',
+    'theme_backgrounds', 'roles', 'pattern_colors'
+)
+
+# 建立全文搜索索引的表及列，索引表名为 <表名>_fts，由触发器与原表同步
+SEARCH_INDEXES = {
+    'patterns': ('name',),
+    'products': ('title',),
+    'pattern_categories': ('name', 'description'),
+    'product_categories': ('name',),
+    'product_archives': ('register_info', 'follow_up_person', 'access_code'),
+}
+
+_WRITE_TABLE_PATTERN = re.compile(
+    r'^\s*(?:INSERT(?:\s+OR\s+\w+)?\s+INTO|UPDATE(?:\s+OR\s+\w+)?|DELETE\s+FROM)\s+(\w+)',
+    re.IGNORECASE
+)
+
 def get_db_connection():
     """获取数据库连接"""
     conn = sqlite3.connect(DATABASE_PATH)
     conn.row_factory = sqlite3.Row
     return conn
 
-def init_database():
+def init_database(force: bool = False):
     """初始化数据库表结构"""
     conn = get_db_connection()
     cursor = conn.cursor()
     
+    # 快速路径：结构版本已是最新时不再执行建表和默认数据插入
+    if not force and cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        conn.close()
+        return
+    
     # 创建印花图案表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS patterns (
@@ -174,13 +204,228 @@ def init_database():
         )
     ''')
     
+    # 创建数据版本表
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS data_revisions (
+            table_name TEXT PRIMARY KEY,
+            revision INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
+    # 创建访问记录归档索引表（每行对应归档文件中的一个gzip分段）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_log_archives (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            archive_file TEXT NOT NULL,
+            member_offset INTEGER NOT NULL,
+            member_length INTEGER NOT NULL,
+            row_count INTEGER NOT NULL,
+            min_log_id INTEGER,
+            max_log_id INTEGER,
+            first_login TIMESTAMP,
+            last_login TIMESTAMP,
+            access_codes TEXT,
+            archived_at TIMESTAMP DEFAULT (datetime('now', 'localtime'))
+        )
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_access_log_archives_login ON access_log_archives (last_login, first_login)")
+    
+    # 归档时按状态和最后活动时间筛选离线记录
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_access_logs_retention ON access_logs (is_active, last_activity)")
+    
+    # 创建访问统计汇总表（按授权码和登录时间的小时/天汇总），由下方触发器在登录和登出时增量维护
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_rollup_hourly (
+            access_code TEXT NOT NULL,
+            bucket TEXT NOT NULL,
+            logins INTEGER NOT NULL DEFAULT 0,
+            sessions_closed INTEGER NOT NULL DEFAULT 0,
+            duration_seconds REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (access_code, bucket)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_rollup_daily (
+            access_code TEXT NOT NULL,
+            day TEXT NOT NULL,
+            logins INTEGER NOT NULL DEFAULT 0,
+            sessions_closed INTEGER NOT NULL DEFAULT 0,
+            duration_seconds REAL NOT NULL DEFAULT 0,
+            devices INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (access_code, day)
+        )
+    ''')
+    # 每天出现过的设备（IP + 浏览器 + 操作系统），用于统计活跃设备数
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS access_rollup_devices (
+            access_code TEXT NOT NULL,
+            day TEXT NOT NULL,
+            device TEXT NOT NULL,
+            PRIMARY KEY (access_code, day, device)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_access_logs_rollup_login AFTER INSERT ON access_logs
+        BEGIN
+            INSERT INTO access_rollup_hourly (access_code, bucket, logins)
+            VALUES (NEW.access_code, substr(NEW.login_time, 1, 13), 1)
+            ON CONFLICT (access_code, bucket) DO UPDATE SET logins = logins + 1;
+            INSERT INTO access_rollup_daily (access_code, day, logins, devices)
+            VALUES (NEW.access_code, substr(NEW.login_time, 1, 10), 1,
+                    NOT EXISTS (SELECT 1 FROM access_rollup_devices
+                                WHERE access_code = NEW.access_code AND day = substr(NEW.login_time, 1, 10)
+                                  AND device = {_ROLLUP_DEVICE_SQL.format(row='NEW')}))
+            ON CONFLICT (access_code, day) DO UPDATE SET logins = logins + 1, devices = devices + excluded.devices;
+            INSERT OR IGNORE INTO access_rollup_devices (access_code, day, device)
+            VALUES (NEW.access_code, substr(NEW.login_time, 1, 10), {_ROLLUP_DEVICE_SQL.format(row='NEW')});
+        END
+    ''')
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_access_logs_rollup_logout AFTER UPDATE OF is_active ON access_logs
+        WHEN OLD.is_active = 1 AND NEW.is_active = 0
+        BEGIN
+            UPDATE access_rollup_hourly
+            SET sessions_closed = sessions_closed + 1,
+                duration_seconds = duration_seconds + {_ROLLUP_DURATION_SQL.format(row='NEW')}
+            WHERE access_code = NEW.access_code AND bucket = substr(NEW.login_time, 1, 13);
+            UPDATE access_rollup_daily
+            SET sessions_closed = sessions_closed + 1,
+                duration_seconds = duration_seconds + {_ROLLUP_DURATION_SQL.format(row='NEW')}
+            WHERE access_code = NEW.access_code AND day = substr(NEW.login_time, 1, 10);
+        END
+    ''')
+    if not cursor.execute("SELECT 1 FROM access_rollup_daily LIMIT 1").fetchone():
+        # 升级前已有的访问记录补算一次
+        rebuild_access_rollups(cursor)
+    
+    # 创建全文搜索索引
+    create_search_indexes(cursor)
+    
+    # 创建印花感知哈希表（pHash/dHash 为有符号64位整数，图片无法读取时为 NULL，不再重复计算）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pattern_hashes (
+            pattern_id INTEGER NOT NULL UNIQUE,
+            phash INTEGER,
+            dhash INTEGER,
+            computed_at TIMESTAMP DEFAULT (datetime('now', 'localtime')),
+            FOREIGN KEY (pattern_id) REFERENCES patterns (id)
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_patterns_hash_delete AFTER DELETE ON patterns
+        BEGIN
+            DELETE FROM pattern_hashes WHERE pattern_id = OLD.id;
+        END
+    ''')
+    
+    # 创建印花主色表（每个图案最多5行，按占比排序；图片无法读取时为一行占比为0的空记录）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS pattern_colors (
+            pattern_id INTEGER NOT NULL,
+            rank INTEGER NOT NULL,
+            r INTEGER,
+            g INTEGER,
+            b INTEGER,
+            lab_l REAL,
+            lab_a REAL,
+            lab_b REAL,
+            weight REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (pattern_id, rank)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_patterns_colors_delete AFTER DELETE ON patterns
+        BEGIN
+            DELETE FROM pattern_colors WHERE pattern_id = OLD.id;
+        END
+    ''')
+    
     # 插入默认数据
     init_default_data(cursor)
     
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
     print("数据库初始化完成")
 
+# 访问统计使用的设备标识和会话时长（秒）表达式，row 为表别名或触发器中的 NEW
+_ROLLUP_DEVICE_SQL = "(COALESCE({row}.ip_address, '') || '|' || COALESCE({row}.browser, '') || '|' || COALESCE({row}.operating_system, ''))"
+_ROLLUP_DURATION_SQL = ("COALESCE(MAX(0, (julianday(COALESCE({row}.logout_time, {row}.last_activity)) "
+                        "- julianday({row}.login_time)) * 86400), 0)")
+
+def rebuild_access_rollups(cursor):
+    """根据 access_logs 重新计算访问统计汇总（已归档移出热表的记录不计入）"""
+    cursor.execute("DELETE FROM access_rollup_hourly")
+    cursor.execute("DELETE FROM access_rollup_daily")
+    cursor.execute("DELETE FROM access_rollup_devices")
+    duration = _ROLLUP_DURATION_SQL.format(row='al')
+    cursor.execute(f'''
+        INSERT INTO access_rollup_hourly (access_code, bucket, logins, sessions_closed, duration_seconds)
+        SELECT access_code, substr(login_time, 1, 13), COUNT(*), SUM(is_active = 0),
+               SUM(CASE WHEN is_active = 0 THEN {duration} ELSE 0 END)
+        FROM access_logs al
+        WHERE login_time IS NOT NULL
+        GROUP BY access_code, substr(login_time, 1, 13)
+    ''')
+    cursor.execute(f'''
+        INSERT OR IGNORE INTO access_rollup_devices (access_code, day, device)
+        SELECT access_code, substr(login_time, 1, 10), {_ROLLUP_DEVICE_SQL.format(row='al')}
+        FROM access_logs al
+        WHERE login_time IS NOT NULL
+    ''')
+    cursor.execute('''
+        INSERT INTO access_rollup_daily (access_code, day, logins, sessions_closed, duration_seconds, devices)
+        SELECT access_code, substr(bucket, 1, 10), SUM(logins), SUM(sessions_closed), SUM(duration_seconds),
+               (SELECT COUNT(*) FROM access_rollup_devices d
+                WHERE d.access_code = h.access_code AND d.day = substr(h.bucket, 1, 10))
+        FROM access_rollup_hourly h
+        GROUP BY access_code, substr(bucket, 1, 10)
+    ''')
+
+def create_search_indexes(cursor) -> bool:
+    """
+    为 SEARCH_INDEXES 中的表创建FTS5全文索引（外部内容表，rowid 即原表 id）及同步触发器，
+    新建的索引从原表重建一次；SQLite 未编译FTS5或不支持 trigram 分词时返回 False，搜索退回 LIKE 匹配
+    """
+    for table_name, columns in SEARCH_INDEXES.items():
+        fts_table = f'{table_name}_fts'
+        column_list = ', '.join(columns)
+        new_values = ', '.join(f'NEW.{column}' for column in columns)
+        old_values = ', '.join(f'OLD.{column}' for column in columns)
+        exists = cursor.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (fts_table,)).fetchone()
+        try:
+            cursor.execute(f'''
+                CREATE VIRTUAL TABLE IF NOT EXISTS {fts_table}
+                USING fts5({column_list}, content='{table_name}', content_rowid='id', tokenize='trigram')
+            ''')
+        except sqlite3.OperationalError as e:
+            print(f"全文搜索不可用，使用普通匹配: {e}")
+            return False
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_fts_insert AFTER INSERT ON {table_name}
+            BEGIN
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+            END
+        ''')
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_fts_delete AFTER DELETE ON {table_name}
+            BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+            END
+        ''')
+        # 只在被索引的列变化时更新（启用/停用等不影响索引）
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS trg_{table_name}_fts_update AFTER UPDATE OF {column_list} ON {table_name}
+            BEGIN
+                INSERT INTO {fts_table} ({fts_table}, rowid, {column_list}) VALUES ('delete', OLD.id, {old_values});
+                INSERT INTO {fts_table} (rowid, {column_list}) VALUES (NEW.id, {new_values});
+            END
+        ''')
+        if not exists:
+            cursor.execute(f"INSERT INTO {fts_table} ({fts_table}) VALUES ('rebuild')")
+    return True
+
 def init_default_data(cursor):
     """插入默认数据"""
     # 创建默认产品分类
@@ -220,6 +465,20 @@ def init_default_data(cursor):
     # 将现有的印花图案关联到默认分类（ID为1）
     cursor.execute("UPDATE patterns SET category_id = 1 WHERE category_id IS NULL OR category_id = 0")
     
+    # 为访问记录添加原始UA字段（如果不存在），用于回填浏览器/操作系统信息
+    try:
+        cursor.execute("ALTER TABLE access_logs ADD COLUMN user_agent TEXT")
+    except sqlite3.OperationalError:
+        # 字段已存在，忽略错误
+        pass
+    
+    # 为产品效果归档添加渲染配方字段（如果不存在），用于服务端按任意分辨率重绘
+    try:
+        cursor.execute("ALTER TABLE product_archives ADD COLUMN render_recipe TEXT")
+    except sqlite3.OperationalError:
+        # 字段已存在，忽略错误
+        pass
+    
     # 创建默认角色
     import json
     
@@ -310,41 +569,101 @@ def init_default_data(cursor):
         VALUES (?, ?, ?)
     ''', ('查看员', '只读用户，只能查看数据', json.dumps(viewer_permissions, ensure_ascii=False)))
 
+def bump_data_revision(cursor, query: Optional[str] = None, table_name: Optional[str] = None):
+    """
+    如果写入涉及需要跟踪的表，在同一事务中递增该表的数据版本
+    table_name 直接指定表名（批量写入等不经过 execute_update 的场景），否则从写入语句中解析
+    """
+    if table_name is None:
+        match = _WRITE_TABLE_PATTERN.match(query or '')
+        if not match:
+            return
+        table_name = match.group(1)
+    table_name = table_name.lower()
+    if table_name not in REVISION_TRACKED_TABLES:
+        return
+    cursor.execute('''
+        INSERT INTO data_revisions (table_name, revision) VALUES (?, 1)
+        ON CONFLICT(table_name) DO UPDATE SET revision = revision + 1
+    ''', (table_name,))
+
+# 语句执行观察者，以 (操作类型, SQL, 参数, 耗时秒) 调用，供指标统计等使用
+_query_listeners: List[Callable[[str, str, tuple, float], None]] = []
+
+def add_query_listener(listener: Callable[[str, str, tuple, float], None]):
+    """注册语句执行观察者（同一函数只注册一次）"""
+    if listener not in _query_listeners:
+        _query_listeners.append(listener)
+
+def remove_query_listener(listener: Callable[[str, str, tuple, float], None]):
+    """移除语句执行观察者"""
+    if listener in _query_listeners:
+        _query_listeners.remove(listener)
+
+def _notify_query(operation: str, query: str, params: tuple, started: float):
+    """通知观察者，观察者出错不影响业务"""
+    elapsed = time.perf_counter() - started
+    for listener in list(_query_listeners):
+        try:
+            listener(operation, query, params, elapsed)
+        except Exception as e:
+            print(f"查询观察者执行失败: {e}")
+
 class DatabaseManager:
     """数据库管理类"""
     
     @staticmethod
     def execute_query(query: str, params: tuple = ()) -> List[Dict[str, Any]]:
         """执行查询并返回结果"""
+        started = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(query, params)
         results = [dict(row) for row in cursor.fetchall()]
         conn.close()
+        if _query_listeners:
+            _notify_query('query', query, params, started)
         return results
     
     @staticmethod
     def execute_update(query: str, params: tuple = ()) -> int:
         """执行更新操作并返回影响的行数"""
+        started = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(query, params)
-        conn.commit()
         affected_rows = cursor.rowcount
+        if affected_rows:
+            bump_data_revision(cursor, query)
+        conn.commit()
         conn.close()
+        if _query_listeners:
+            _notify_query('update', query, params, started)
         return affected_rows
     
     @staticmethod
     def execute_insert(query: str, params: tuple = ()) -> int:
         """执行插入操作并返回新记录的ID"""
+        started = time.perf_counter()
         conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute(query, params)
-        conn.commit()
         last_id = cursor.lastrowid
+        bump_data_revision(cursor, query)
+        conn.commit()
         conn.close()
+        if _query_listeners:
+            _notify_query('insert', query, params, started)
         return last_id or 0
 
+    @staticmethod
+    def get_data_revisions() -> Dict[str, int]:
+        """获取所有被跟踪表的数据版本号"""
+        rows = DatabaseManager.execute_query("SELECT table_name, revision FROM data_revisions")
+        revisions = {table_name: 0 for table_name in REVISION_TRACKED_TABLES}
+        revisions.update({row['table_name']: row['revision'] for row in rows})
+        return revisions
+
     # 印花图案相关操作
     @staticmethod
     def get_patterns(category_id: Optional[int] = None, active_only: bool = True) -> List[Dict[str, Any]]:
@@ -615,15 +934,17 @@ class DatabaseManager:
     # 访问记录相关操作
     @staticmethod
     def add_access_log(session_id: str, access_code: str, ip_address: str, 
-                      location: str, browser: str, operating_system: str) -> int:
+                      location: str, browser: str, operating_system: str,
+                      user_agent: str = None) -> int:
         """添加访问记录"""
         query = '''
             INSERT INTO access_logs 
-            (session_id, access_code, ip_address, location, browser, operating_system, login_time, last_activity)
-            VALUES (?, ?, ?, ?, ?, ?, datetime('now', 'localtime'), datetime('now', 'localtime'))
+            (session_id, access_code, ip_address, location, browser, operating_system, user_agent,
+             login_time, last_activity)
+            VALUES (?, ?, ?, ?, ?, ?, ?, datetime('now', 'localtime'), datetime('now', 'localtime'))
         '''
         return DatabaseManager.execute_insert(query, (
-            session_id, access_code, ip_address, location, browser, operating_system
+            session_id, access_code, ip_address, location, browser, operating_system, user_agent
         ))
     
     @staticmethod
@@ -666,6 +987,45 @@ class DatabaseManager:
         '''
         return DatabaseManager.execute_update(query, (session_id,))
     
+    @staticmethod
+    def get_access_rollups(granularity: str = 'day', access_code: str = None,
+                           start: str = None, end: str = None) -> List[Dict[str, Any]]:
+        """
+        获取访问统计汇总，granularity 为 day 或 hour，按时间升序
+        start/end 为包含边界的时间范围（'YYYY-MM-DD' 或 'YYYY-MM-DD HH'）
+        """
+        if granularity == 'hour':
+            table, column, width = 'access_rollup_hourly', 'bucket', 13
+            devices = 'NULL AS devices'
+        else:
+            table, column, width = 'access_rollup_daily', 'day', 10
+            devices = 'devices'
+        query = f'''
+            SELECT access_code, {column} AS bucket, logins, sessions_closed, duration_seconds, {devices}
+            FROM {table}
+        '''
+        params = []
+        conditions = []
+        
+        if access_code:
+            conditions.append("access_code = ?")
+            params.append(access_code)
+        
+        if start:
+            conditions.append(f"{column} >= ?")
+            params.append(start[:width])
+        
+        if end:
+            # 日期格式的结束时间包含当天所有小时
+            conditions.append(f"{column} <= ?")
+            params.append(end[:width] if len(end) >= width else end + ' 23')
+        
+        if conditions:
+            query += " WHERE " + " AND ".join(conditions)
+        
+        query += f" ORDER BY {column}, access_code"
+        return DatabaseManager.execute_query(query, tuple(params))
+
     @staticmethod
     def force_logout_access_log(log_id: int) -> int:
         """强制登出指定的访问记录"""
@@ -881,17 +1241,19 @@ class DatabaseManager:
     def add_product_archive(access_code: str, original_product_image: str, original_depth_image: str,
                            effect_image: str, effect_category: str, register_info: str,
                            follow_up_person: str, original_product_path: str, original_depth_path: str,
-                           effect_image_path: str) -> int:
-        """添加产品效果归档"""
+                           effect_image_path: str, render_recipe: Optional[str] = None) -> int:
+        """添加产品效果归档，render_recipe 为渲染配方JSON"""
         query = '''
             INSERT INTO product_archives 
             (access_code, original_product_image, original_depth_image, effect_image, effect_category,
-             register_info, follow_up_person, original_product_path, original_depth_path, effect_image_path)
-            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+             register_info, follow_up_person, original_product_path, original_depth_path, effect_image_path,
+             render_recipe)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
         '''
         return DatabaseManager.execute_insert(query, (
             access_code, original_product_image, original_depth_image, effect_image, effect_category,
-            register_info, follow_up_person, original_product_path, original_depth_path, effect_image_path
+            register_info, follow_up_person, original_product_path, original_depth_path, effect_image_path,
+            render_recipe
         ))
     
     @staticmethod
@@ -0,0 +1,144 @@
+"""
+上传图片规范化
+入库前统一限制纹理尺寸、深度图转单通道灰度、去除EXIF/ICC等元数据，并尽早拒绝解压炸弹
+"""
+import os
+from dataclasses import dataclass
+from io import BytesIO
+from typing import Optional, Tuple
+
+from .request_timing import timing_span
+
+# 浏览器GPU纹理的最大边长，超过则等比缩小
+MAX_TEXTURE_SIZE = 4096
+# 解码前按图片头信息检查像素总数，超过则直接拒绝
+MAX_IMAGE_PIXELS = 80_000_000
+# 是否在 uploads/originals/ 下保留原始上传文件
+KEEP_ORIGINALS = False
+ORIGINALS_DIR = os.path.join('uploads', 'originals')
+
+IMAGE_KINDS = ('pattern', 'product', 'depth')
+
+
+class ImageNormalizationError(Exception):
+    """图片无法通过规范化检查"""
+
+
+@dataclass
+class NormalizedImage:
+    """规范化后的图片数据"""
+    data: bytes
+    width: int
+    height: int
+    extension: str
+    changed: bool = False
+
+
+def _has_metadata(image) -> bool:
+    """是否带有EXIF/ICC/XMP或PNG文本块等可去除的元数据"""
+    if any(key in image.info for key in ('exif', 'icc_profile', 'xmp', 'XML:com.adobe.xmp', 'photoshop')):
+        return True
+    return bool(getattr(image, 'text', None))
+
+
+@timing_span('image')
+def normalize_image(data: bytes, kind: str, max_size: Optional[int] = None) -> NormalizedImage:
+    """
+    规范化一张上传图片
+    kind: pattern / product / depth，深度图会存为8位或16位单通道PNG
+    """
+    from PIL import Image, ImageOps
+
+    if kind not in IMAGE_KINDS:
+        raise ValueError(f'未知的图片类型: {kind}')
+    max_size = max_size or MAX_TEXTURE_SIZE
+
+    try:
+        image = Image.open(BytesIO(data))
+    except Exception:
+        raise ImageNormalizationError('不是有效的图片文件')
+
+    # 只读取了文件头，此时检查尺寸不会触发完整解码
+    width, height = image.size
+    if width * height > MAX_IMAGE_PIXELS:
+        raise ImageNormalizationError(f'图片像素过大（{width}x{height}），已拒绝')
+
+    source_format = image.format
+    try:
+        image.load()
+    except Exception:
+        raise ImageNormalizationError('图片数据损坏，无法解码')
+
+    changed = False
+    has_metadata = _has_metadata(image)
+
+    # 按EXIF方向摆正后再丢弃元数据
+    if image.getexif().get(0x0112, 1) != 1:
+        image = ImageOps.exif_transpose(image)
+        changed = True
+
+    if kind == 'depth':
+        if image.mode in ('I;16', 'I;16B', 'I;16L', 'I'):
+            # Pillow将16位灰度PNG读取为I模式，无需再转换
+            if image.mode != 'I;16' and not (image.mode == 'I' and source_format == 'PNG'):
+                image = image.convert('I;16')
+                changed = True
+        elif image.mode != 'L':
+            image = image.convert('L')
+            changed = True
+    elif image.mode not in ('RGB', 'RGBA', 'L', 'LA', 'P') or (image.mode == 'P' and max(image.size) > max_size):
+        # 调色板图片只有需要缩放时才展开，避免无谓增大体积
+        image = image.convert('RGBA' if image.mode in ('P', 'PA', 'LA') or 'transparency' in image.info else 'RGB')
+        changed = True
+
+    if max(image.size) > max_size:
+        # 16位图像不支持LANCZOS缩放，使用近似的双线性
+        resample = Image.BILINEAR if image.mode == 'I;16' else Image.LANCZOS
+        image.thumbnail((max_size, max_size), resample)
+        changed = True
+
+    output_format = 'PNG' if kind == 'depth' else (source_format if source_format in ('PNG', 'JPEG') else 'PNG')
+    if output_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        output_format = 'PNG'
+    if output_format != source_format:
+        changed = True
+
+    extension = '.jpg' if output_format == 'JPEG' else '.png'
+    if not changed and not has_metadata:
+        return NormalizedImage(data, image.size[0], image.size[1], extension, changed=False)
+
+    buffer = BytesIO()
+    if output_format == 'JPEG':
+        image.save(buffer, 'JPEG', quality=92, optimize=True)
+    else:
+        image.save(buffer, 'PNG', optimize=True)
+    return NormalizedImage(buffer.getvalue(), image.size[0], image.size[1], extension, changed=True)
+
+
+def replace_extension(filename: str, extension: str) -> str:
+    """规范化可能改变格式，同步替换文件扩展名"""
+    return os.path.splitext(filename)[0] + extension
+
+
+def keep_original(data: bytes, kind: str, filename: str) -> Optional[str]:
+    """按配置保留原始上传文件，返回保存路径"""
+    if not KEEP_ORIGINALS:
+        return None
+    directory = os.path.join(ORIGINALS_DIR, kind)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def store_normalized(normalized: NormalizedImage, original: bytes, kind: str,
+                     directory: str, filename: str) -> Tuple[str, str]:
+    """写入规范化后的图片（扩展名随输出格式调整）并按配置保留原图，返回 (文件名, 文件路径)"""
+    filename = replace_extension(filename, normalized.extension)
+    keep_original(original, kind, filename)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, filename)
+    with open(path, 'wb') as f:
+        f.write(normalized.data)
+    return filename, path
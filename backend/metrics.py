@@ -0,0 +1,491 @@
+"""
+运行指标
+按Prometheus文本格式输出请求量、延迟直方图、数据库语句、缓存命中、上传字节、活跃会话和任务队列深度。
+每个进程把自己的累计值定期写入 instance/metrics/<应用>_<pid>.json，抓取时合并所有进程的文件，
+计数器和直方图跨进程求和，仪表值只统计仍在运行的进程
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+METRICS_DIR = os.path.join('instance', 'metrics')
+# 请求结束后距上次写入超过该间隔才写文件，避免每个请求都落盘
+FLUSH_INTERVAL = 1.0
+# 反向代理或隧道（如ngrok）转发时添加的请求头，带有这些头的请求不视为本机访问
+PROXY_HEADERS = ('X-Forwarded-For', 'X-Forwarded-Host', 'X-Real-IP', 'Forwarded')
+# 活跃会话：最近活动时间在该分钟数内的授权码会话
+ACTIVE_SESSION_MINUTES = 30
+
+REQUEST_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+# 指标名 -> (类型, 说明)
+METRIC_DEFINITIONS = {
+    'http_requests_total': ('counter', 'HTTP请求数'),
+    'http_request_duration_seconds': ('histogram', 'HTTP请求处理耗时'),
+    'db_queries_total': ('counter', '数据库语句执行次数'),
+    'db_query_duration_seconds': ('histogram', '数据库语句执行耗时'),
+    'cache_hits_total': ('counter', '缓存命中次数'),
+    'cache_misses_total': ('counter', '缓存未命中次数'),
+    'upload_bytes_total': ('counter', '上传请求体字节数'),
+    'job_queue_depth': ('gauge', '正在执行或排队的后台任务数'),
+    'active_sessions': ('gauge', '最近活跃的授权码会话数'),
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+def _label_key(labels: Optional[Dict[str, Any]]) -> LabelKey:
+    return tuple(sorted((str(k), str(v)) for k, v in (labels or {}).items()))
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    parts = []
+    for key, value in labels:
+        value = value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+        parts.append(f'{key}="{value}"')
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if value == int(value):
+        return str(int(value))
+    return repr(float(value))
+
+
+def _windows_pid_alive(pid: int) -> bool:
+    """Windows 上 os.kill 会直接结束目标进程，改为查询进程退出码"""
+    import ctypes
+    from ctypes import wintypes
+
+    PROCESS_QUERY_LIMITED_INFORMATION = 0x1000
+    STILL_ACTIVE = 259
+    ERROR_ACCESS_DENIED = 5
+
+    kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+    kernel32.OpenProcess.restype = wintypes.HANDLE
+    kernel32.OpenProcess.argtypes = (wintypes.DWORD, wintypes.BOOL, wintypes.DWORD)
+    kernel32.GetExitCodeProcess.argtypes = (wintypes.HANDLE, ctypes.POINTER(wintypes.DWORD))
+    kernel32.CloseHandle.argtypes = (wintypes.HANDLE,)
+
+    handle = kernel32.OpenProcess(PROCESS_QUERY_LIMITED_INFORMATION, False, pid)
+    if not handle:
+        # 无权访问说明进程存在
+        return ctypes.get_last_error() == ERROR_ACCESS_DENIED
+    try:
+        exit_code = wintypes.DWORD()
+        if not kernel32.GetExitCodeProcess(handle, ctypes.byref(exit_code)):
+            return True
+        return exit_code.value == STILL_ACTIVE
+    finally:
+        kernel32.CloseHandle(handle)
+
+
+def _pid_alive(pid: int) -> bool:
+    """进程是否仍在运行（只查询，不向进程发送信号）"""
+    if pid <= 0:
+        return False
+    if pid == os.getpid():
+        return True
+    if os.name == 'nt':
+        return _windows_pid_alive(pid)
+    try:
+        # POSIX 上信号0只做存在性和权限检查
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except (PermissionError, OSError):
+        return True
+    return True
+
+
+def _merge_snapshots(snapshots: List[Dict[str, Any]]) -> Tuple[Dict, Dict, Dict]:
+    """计数器和直方图求和，仪表值只合并仍在运行的进程"""
+    counters: Dict[Tuple[str, LabelKey], float] = {}
+    gauges: Dict[Tuple[str, LabelKey], float] = {}
+    histograms: Dict[Tuple[str, LabelKey], Dict[str, Any]] = {}
+    for snapshot in snapshots:
+        for name, labels, value in snapshot.get('counters', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            counters[key] = counters.get(key, 0.0) + value
+        if _pid_alive(snapshot.get('pid', 0)):
+            for name, labels, value in snapshot.get('gauges', []):
+                key = (name, tuple(tuple(pair) for pair in labels))
+                gauges[key] = gauges.get(key, 0.0) + value
+        for name, labels, histogram in snapshot.get('histograms', []):
+            key = (name, tuple(tuple(pair) for pair in labels))
+            merged = histograms.get(key)
+            if merged is None:
+                histograms[key] = {
+                    'buckets': list(histogram['buckets']), 'counts': list(histogram['counts']),
+                    'sum': histogram['sum'], 'count': histogram['count']
+                }
+                continue
+            if merged['buckets'] != histogram['buckets']:
+                # 不同版本进程的分桶不一致，无法合并
+                continue
+            merged['counts'] = [a + b for a, b in zip(merged['counts'], histogram['counts'])]
+            merged['sum'] += histogram['sum']
+            merged['count'] += histogram['count']
+    return counters, gauges, histograms
+
+
+class MetricsRegistry:
+    """进程内指标累计，flush() 写入本进程文件，render() 合并所有进程后输出文本格式"""
+
+    def __init__(self, app_name: str, directory: str = METRICS_DIR):
+        self.app_name = app_name
+        self.directory = directory
+        self._counters: Dict[Tuple[str, LabelKey], float] = {}
+        self._gauges: Dict[Tuple[str, LabelKey], float] = {}
+        self._histograms: Dict[Tuple[str, LabelKey], Dict[str, Any]] = {}
+        # sync_counter 上次看到的外部累计值
+        self._external_totals: Dict[Tuple[str, LabelKey], float] = {}
+        # 抓取或写入前调用，用于同步缓存命中等外部累计值
+        self._collectors: List[Callable[['MetricsRegistry'], None]] = []
+        # 仅在抓取时计算的全局指标（如从数据库统计），不参与跨进程合并
+        self._scrape_collectors: List[Callable[[], List[Tuple[str, Dict[str, Any], float]]]] = []
+        self._lock = threading.Lock()
+        self._last_flush = 0.0
+
+    @property
+    def path(self) -> str:
+        return os.path.join(self.directory, f'{self.app_name}_{os.getpid()}.json')
+
+    def inc(self, name: str, labels: Optional[Dict[str, Any]] = None, value: float = 1.0):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0.0) + value
+
+    def sync_counter(self, name: str, labels: Optional[Dict[str, Any]], value: float):
+        """
+        按外部累计值（如缓存自身的命中数）递增计数器
+        来源会在 clear() 后归零，此时把新的累计值整体计为增量，保证导出的计数器单调递增
+        """
+        key = (name, _label_key(labels))
+        with self._lock:
+            previous = self._external_totals.get(key, 0.0)
+            delta = value - previous if value >= previous else value
+            self._external_totals[key] = float(value)
+            self._counters[key] = self._counters.get(key, 0.0) + delta
+
+    def gauge_add(self, name: str, labels: Optional[Dict[str, Any]] = None, delta: float = 1.0):
+        key = (name, _label_key(labels))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0.0) + delta
+
+    def observe(self, name: str, labels: Optional[Dict[str, Any]], value: float,
+                buckets: Tuple[float, ...] = REQUEST_BUCKETS):
+        key = (name, _label_key(labels))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = {
+                    'buckets': list(buckets), 'counts': [0] * len(buckets), 'sum': 0.0, 'count': 0
+                }
+            for index, bound in enumerate(histogram['buckets']):
+                if value <= bound:
+                    histogram['counts'][index] += 1
+                    break
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    def add_collector(self, collector: Callable[['MetricsRegistry'], None]):
+        self._collectors.append(collector)
+
+    def add_scrape_collector(self, collector: Callable[[], List[Tuple[str, Dict[str, Any], float]]]):
+        self._scrape_collectors.append(collector)
+
+    @contextmanager
+    def track_job(self, job: str) -> Iterator[None]:
+        """在任务执行期间计入队列深度，变化立即写入使其他进程可见"""
+        self.gauge_add('job_queue_depth', {'job': job}, 1)
+        self.flush(force=True)
+        try:
+            yield
+        finally:
+            self.gauge_add('job_queue_depth', {'job': job}, -1)
+            self.flush(force=True)
+
+    def _snapshot(self) -> Dict[str, Any]:
+        for collector in self._collectors:
+            try:
+                collector(self)
+            except Exception as e:
+                print(f"指标采集失败: {e}")
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'app': self.app_name,
+                'counters': [[name, list(labels), value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, list(labels), value] for (name, labels), value in self._gauges.items()],
+                'histograms': [[name, list(labels), histogram]
+                               for (name, labels), histogram in self._histograms.items()],
+            }
+
+    def flush(self, force: bool = False):
+        """写入本进程的累计值（原子替换）"""
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        snapshot = self._snapshot()
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f'{self.path}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                json.dump(snapshot, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"写入指标文件失败: {e}")
+
+    def _load_snapshots(self) -> List[Dict[str, Any]]:
+        snapshots = []
+        prefix = f'{self.app_name}_'
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            names = []
+        for name in names:
+            if not (name.startswith(prefix) and name.endswith('.json')):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                with open(path, encoding='utf-8') as f:
+                    snapshot = json.load(f)
+            except (OSError, ValueError):
+                continue
+            snapshot['_path'] = path
+            snapshots.append(snapshot)
+        return snapshots
+
+    def compact(self):
+        """将已退出进程的文件合并为一个，避免多次重启后文件不断增加（多个进程同时启动时只由一个执行）"""
+        os.makedirs(self.directory, exist_ok=True)
+        lock_path = os.path.join(self.directory, f'.{self.app_name}.compact.lock')
+        try:
+            if time.time() - os.path.getmtime(lock_path) > 60:
+                # 上次整理异常退出留下的锁
+                os.remove(lock_path)
+        except OSError:
+            pass
+        try:
+            lock_fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+        except FileExistsError:
+            return
+        try:
+            self._compact_dead()
+        finally:
+            os.close(lock_fd)
+            os.remove(lock_path)
+
+    def _compact_dead(self):
+        dead = [snapshot for snapshot in self._load_snapshots()
+                if not _pid_alive(snapshot.get('pid', 0))]
+        if len(dead) < 2:
+            return
+        counters, _, histograms = _merge_snapshots(dead)
+        merged = {
+            'pid': 0,
+            'app': self.app_name,
+            'counters': [[name, list(labels), value] for (name, labels), value in counters.items()],
+            'gauges': [],
+            'histograms': [[name, list(labels), histogram] for (name, labels), histogram in histograms.items()],
+        }
+        merged_path = os.path.join(self.directory, f'{self.app_name}_exited.json')
+        temp_path = f'{merged_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(merged, f)
+        os.replace(temp_path, merged_path)
+        for snapshot in dead:
+            path = snapshot.get('_path')
+            if path and path != merged_path:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def collect(self) -> Tuple[Dict, Dict, Dict]:
+        """合并所有进程的指标，返回 (计数器, 仪表, 直方图)"""
+        self.flush(force=True)
+        counters, gauges, histograms = _merge_snapshots(self._load_snapshots())
+        for collector in self._scrape_collectors:
+            try:
+                for name, labels, value in collector():
+                    gauges[(name, _label_key(labels))] = value
+            except Exception as e:
+                print(f"指标采集失败: {e}")
+        return counters, gauges, histograms
+
+    def render(self) -> str:
+        """输出Prometheus文本格式"""
+        counters, gauges, histograms = self.collect()
+        samples: Dict[str, List[str]] = {}
+
+        for (name, labels), value in sorted(counters.items()):
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), value in sorted(gauges.items()):
+            samples.setdefault(name, []).append(f'{name}{_format_labels(labels)} {_format_value(value)}')
+        for (name, labels), histogram in sorted(histograms.items()):
+            lines = samples.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(histogram['buckets'], histogram['counts']):
+                cumulative += count
+                bucket_labels = labels + (('le', _format_value(bound)),)
+                lines.append(f'{name}_bucket{_format_labels(bucket_labels)} {cumulative}')
+            lines.append(f'{name}_bucket{_format_labels(labels + (("le", "+Inf"),))} {histogram["count"]}')
+            lines.append(f'{name}_sum{_format_labels(labels)} {_format_value(histogram["sum"])}')
+            lines.append(f'{name}_count{_format_labels(labels)} {histogram["count"]}')
+
+        output = []
+        for name in sorted(samples):
+            metric_type, description = METRIC_DEFINITIONS.get(name, ('untyped', name))
+            output.append(f'# HELP {name} {description}')
+            output.append(f'# TYPE {name} {metric_type}')
+            output.extend(samples[name])
+        return '\n'.join(output) + '\n'
+
+
+# 当前进程的指标实例，由 init_metrics() 按应用名创建
+metrics: Optional[MetricsRegistry] = None
+
+
+def get_metrics() -> Optional[MetricsRegistry]:
+    return metrics
+
+
+@contextmanager
+def track_job(job: str) -> Iterator[None]:
+    """任务队列深度统计，未启用指标时不做任何事"""
+    if metrics is None:
+        yield
+        return
+    with metrics.track_job(job):
+        yield
+
+
+def tracked_job(job: str):
+    """视图函数装饰器，执行期间计入队列深度"""
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            with track_job(job):
+                return f(*args, **kwargs)
+        return decorated_function
+    return decorator
+
+
+def track_stream(job: str, iterable: Iterable[Any]) -> Iterator[Any]:
+    """流式响应在整个输出期间计入队列深度"""
+    with track_job(job):
+        yield from iterable
+
+
+def _statement_operation(query: str) -> str:
+    words = query.lstrip().split(None, 1)
+    return words[0].lower() if words else 'unknown'
+
+
+def _record_query(operation: str, query: str, params: tuple, elapsed: float):
+    if metrics is None:
+        return
+    labels = {'operation': _statement_operation(query)}
+    metrics.inc('db_queries_total', labels)
+    metrics.observe('db_query_duration_seconds', labels, elapsed, QUERY_BUCKETS)
+
+
+def _collect_cache_stats(app):
+    def collect(registry: MetricsRegistry):
+        from .user_agent_cache import ua_cache
+        from .render_cache import render_cache
+
+        caches = {'user_agent': ua_cache, 'render': render_cache}
+        fragment_cache = getattr(app.jinja_env, 'fragment_cache', None)
+        if fragment_cache is not None:
+            caches['template_fragment'] = fragment_cache
+        for name, cache in caches.items():
+            stats = cache.get_stats()
+            registry.sync_counter('cache_hits_total', {'cache': name}, stats['hits'])
+            registry.sync_counter('cache_misses_total', {'cache': name}, stats['misses'])
+    return collect
+
+
+def _collect_active_sessions() -> List[Tuple[str, Dict[str, Any], float]]:
+    from .session_registry import live_session_count
+
+    # 合并前台进程的在线会话快照，不查询数据库
+    return [('active_sessions', {}, live_session_count(ACTIVE_SESSION_MINUTES * 60))]
+
+
+def init_metrics(app, app_name: str, directory: Optional[str] = None) -> MetricsRegistry:
+    """
+    为Flask应用启用请求指标和 /metrics 接口
+    配置 app.config['METRICS_TOKEN']（或环境变量 METRICS_TOKEN）后须携带 Authorization: Bearer <令牌> 抓取；
+    未配置令牌时只允许本机直接访问，设置 app.config['METRICS_ALLOW_REMOTE'] = True 后允许远程访问。
+    外部分享模式（NGROK_SHARE_MODE）或经代理转发的请求在没有令牌时一律拒绝，因为隧道转发的请求来源同样是本机
+    """
+    import hmac
+    from flask import Response, abort, g, request
+    from .database import add_query_listener
+
+    global metrics
+    metrics = MetricsRegistry(app_name, directory or METRICS_DIR)
+    metrics.add_collector(_collect_cache_stats(app))
+    metrics.add_scrape_collector(_collect_active_sessions)
+    add_query_listener(_record_query)
+    atexit.register(metrics.flush, True)
+    try:
+        metrics.compact()
+    except OSError as e:
+        print(f"整理指标文件失败: {e}")
+    registry = metrics
+
+    def record(status_code: int):
+        started = g.pop('_metrics_started', None)
+        if started is None:
+            return
+        elapsed = time.perf_counter() - started
+        endpoint = request.endpoint or 'unmatched'
+        labels = {'blueprint': request.blueprint or '', 'endpoint': endpoint}
+        registry.inc('http_requests_total', dict(labels, method=request.method, status=status_code))
+        registry.observe('http_request_duration_seconds', labels, elapsed, REQUEST_BUCKETS)
+        if request.mimetype == 'multipart/form-data' and request.content_length:
+            registry.inc('upload_bytes_total', {'endpoint': endpoint}, request.content_length)
+        registry.flush()
+
+    @app.before_request
+    def start_request_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def record_request_metrics(response):
+        record(response.status_code)
+        return response
+
+    @app.teardown_request
+    def record_failed_request(exc):
+        # 未处理的异常不会经过 after_request
+        if exc is not None:
+            record(500)
+
+    def scrape_allowed() -> bool:
+        token = app.config.get('METRICS_TOKEN') or os.environ.get('METRICS_TOKEN')
+        if token:
+            authorization = request.headers.get('Authorization', '')
+            return hmac.compare_digest(authorization.encode(), f'Bearer {token}'.encode())
+        if app.config.get('NGROK_SHARE_MODE') or any(header in request.headers for header in PROXY_HEADERS):
+            return False
+        return bool(app.config.get('METRICS_ALLOW_REMOTE')) or request.remote_addr in ('127.0.0.1', '::1')
+
+    @app.route('/metrics')
+    def metrics_endpoint():
+        if not scrape_allowed():
+            abort(403)
+        return Response(registry.render(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+    return metrics
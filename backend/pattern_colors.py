@@ -0,0 +1,311 @@
+"""
+印花主色索引
+入库时把缩略图缩放到 64x64，在 Lab 色彩空间用 NumPy 向量化 k-means 提取最多5个主色及其占比，
+保存在 pattern_colors 表中；按颜色筛选时在进程内的主色矩阵上计算色差（CIE76），
+返回含有足够占比的相近颜色的图案。已有图案由后台线程或 python -m backend.pattern_colors 补算
+"""
+import re
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .database import bump_data_revision, get_db_connection
+
+PALETTE_SIZE = 5
+SAMPLE_SIZE = (64, 64)
+KMEANS_ITERATIONS = 10
+# 占比低于该值的主色不参与颜色筛选（避免小面积点缀色命中）
+MIN_COLOR_WEIGHT = 0.08
+# 默认色差阈值（CIE76，约 2.3 为人眼可分辨的最小差异）
+DEFAULT_COLOR_DISTANCE = 30.0
+BACKFILL_BATCH_SIZE = 32
+
+# 常用颜色名称
+COLOR_NAMES = {
+    'red': 'd62828', '红': 'd62828', '红色': 'd62828',
+    'orange': 'f77f00', '橙': 'f77f00', '橙色': 'f77f00',
+    'yellow': 'fcbf49', '黄': 'fcbf49', '黄色': 'fcbf49',
+    'gold': 'd4af37', '金': 'd4af37', '金色': 'd4af37',
+    'green': '2a9d4f', '绿': '2a9d4f', '绿色': '2a9d4f',
+    'cyan': '2ec4d6', '青': '2ec4d6', '青色': '2ec4d6',
+    'blue': '1d4ed8', '蓝': '1d4ed8', '蓝色': '1d4ed8',
+    'purple': '7b2cbf', '紫': '7b2cbf', '紫色': '7b2cbf',
+    'pink': 'f4a6c1', '粉': 'f4a6c1', '粉色': 'f4a6c1',
+    'brown': '7f5539', '棕': '7f5539', '棕色': '7f5539',
+    'black': '111111', '黑': '111111', '黑色': '111111',
+    'white': 'f8f8f8', '白': 'f8f8f8', '白色': 'f8f8f8',
+    'gray': '8d8d8d', 'grey': '8d8d8d', '灰': '8d8d8d', '灰色': '8d8d8d',
+}
+
+_HEX_PATTERN = re.compile(r'^#?([0-9a-fA-F]{6}|[0-9a-fA-F]{3})$')
+
+
+def rgb_to_lab(rgb):
+    """sRGB (0~255, 形状 (..., 3)) 转换为 CIE Lab（D65）"""
+    import numpy as np
+
+    srgb = np.asarray(rgb, dtype=np.float32) / 255.0
+    linear = np.where(srgb > 0.04045, ((srgb + 0.055) / 1.055) ** 2.4, srgb / 12.92)
+    matrix = np.array([[0.4124, 0.3576, 0.1805],
+                       [0.2126, 0.7152, 0.0722],
+                       [0.0193, 0.1192, 0.9505]], dtype=np.float32)
+    xyz = linear @ matrix.T / np.array([0.95047, 1.0, 1.08883], dtype=np.float32)
+    f = np.where(xyz > 0.008856, np.cbrt(xyz), 7.787 * xyz + 16.0 / 116.0)
+    return np.stack([116.0 * f[..., 1] - 16.0,
+                     500.0 * (f[..., 0] - f[..., 1]),
+                     200.0 * (f[..., 1] - f[..., 2])], axis=-1)
+
+
+def parse_color(value: str) -> Optional[Tuple[int, int, int]]:
+    """解析颜色名称或十六进制颜色（#ff0000 / f00），无法识别时返回 None"""
+    value = (value or '').strip().lower()
+    value = COLOR_NAMES.get(value, value)
+    match = _HEX_PATTERN.match(value)
+    if not match:
+        return None
+    digits = match.group(1)
+    if len(digits) == 3:
+        digits = ''.join(ch * 2 for ch in digits)
+    return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _kmeans(points, k: int, iterations: int = KMEANS_ITERATIONS):
+    """向量化 k-means（k-means++ 初始化，固定随机种子保证结果可复现），返回 (中心, 各点所属簇)"""
+    import numpy as np
+
+    rng = np.random.default_rng(0)
+    centers = [points[rng.integers(len(points))]]
+    for _ in range(1, k):
+        distances = np.min(((points[:, None, :] - np.array(centers)[None]) ** 2).sum(-1), axis=1)
+        total = distances.sum()
+        if total <= 0:
+            break
+        centers.append(points[rng.choice(len(points), p=distances / total)])
+    centers = np.array(centers)
+    for _ in range(iterations):
+        labels = np.argmin(((points[:, None, :] - centers[None]) ** 2).sum(-1), axis=1)
+        counts = np.bincount(labels, minlength=len(centers))
+        sums = np.zeros_like(centers)
+        np.add.at(sums, labels, points)
+        updated = np.where(counts[:, None] > 0, sums / np.maximum(counts, 1)[:, None], centers)
+        if np.allclose(updated, centers, atol=0.5):
+            centers = updated
+            break
+        centers = updated
+    labels = np.argmin(((points[:, None, :] - centers[None]) ** 2).sum(-1), axis=1)
+    return centers, labels
+
+
+def extract_palette(image, size: int = PALETTE_SIZE) -> List[Dict[str, Any]]:
+    """
+    提取 PIL 图片的主色，返回按占比降序的 [{rgb: (r, g, b), lab: (L, a, b), weight}]
+    透明像素不参与计算，完全透明的图片返回空列表
+    """
+    import numpy as np
+    from PIL import Image
+
+    sample = image.convert('RGBA').resize(SAMPLE_SIZE, Image.BILINEAR)
+    pixels = np.asarray(sample, dtype=np.float32).reshape(-1, 4)
+    pixels = pixels[pixels[:, 3] >= 128][:, :3]
+    if not len(pixels):
+        return []
+    lab = rgb_to_lab(pixels)
+    centers, labels = _kmeans(lab, min(size, len(np.unique(pixels, axis=0))))
+    counts = np.bincount(labels, minlength=len(centers))
+    palette = []
+    for index in np.argsort(-counts):
+        if not counts[index]:
+            continue
+        # 簇内像素的平均 sRGB 作为显示颜色
+        rgb = pixels[labels == index].mean(axis=0)
+        palette.append({
+            'rgb': tuple(int(round(channel)) for channel in rgb),
+            'lab': tuple(round(float(channel), 2) for channel in centers[index]),
+            'weight': round(float(counts[index]) / len(labels), 4),
+        })
+    return palette
+
+
+def palette_file(file_path: str) -> Optional[List[Dict[str, Any]]]:
+    """提取图片文件的主色，无法读取时返回 None"""
+    from PIL import Image
+
+    try:
+        with Image.open(file_path) as image:
+            image.draft('RGB', (SAMPLE_SIZE[0] * 4, SAMPLE_SIZE[1] * 4))
+            return extract_palette(image)
+    except Exception as e:
+        print(f"提取图片主色失败 {file_path}: {e}")
+        return None
+
+
+def save_palettes(cursor, palettes: Iterable[Tuple[int, Optional[List[Dict[str, Any]]]]]):
+    """
+    写入 (pattern_id, 主色列表)，由调用方提交；主色为 None（图片无法读取）时写入一条占比为0的空记录，避免重复补算
+    同时递增 pattern_colors 数据版本，使各进程的颜色索引失效（不影响依赖 patterns 版本的目录快照等缓存）
+    """
+    rows = []
+    pattern_ids = []
+    for pattern_id, palette in palettes:
+        pattern_ids.append((pattern_id,))
+        if not palette:
+            rows.append((pattern_id, 0, None, None, None, None, None, None, 0))
+            continue
+        for rank, color in enumerate(palette):
+            rows.append((pattern_id, rank, *color['rgb'], *color['lab'], color['weight']))
+    if not pattern_ids:
+        return
+    cursor.executemany("DELETE FROM pattern_colors WHERE pattern_id = ?", pattern_ids)
+    cursor.executemany('''
+        INSERT INTO pattern_colors (pattern_id, rank, r, g, b, lab_l, lab_a, lab_b, weight)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    bump_data_revision(cursor, table_name='pattern_colors')
+
+
+def register_pattern_palette(pattern_id: int, file_path: str):
+    """图案入库或替换图片后提取并保存主色，出错只打印，不影响上传"""
+    try:
+        palette = palette_file(file_path)
+        conn = get_db_connection()
+        try:
+            save_palettes(conn.cursor(), [(pattern_id, palette)])
+            conn.commit()
+        finally:
+            conn.close()
+    except Exception as e:
+        print(f"保存图案主色失败 {pattern_id}: {e}")
+
+
+class PatternColorIndex:
+    """启用中的印花的主色矩阵，patterns 或 pattern_colors 数据版本变化后在下次查询时重建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._revision = None
+        # 首次查询时才加载 NumPy 并建立矩阵
+        self._pattern_ids = None
+        self._lab = None
+        self._weights = None
+
+    def _load(self):
+        import numpy as np
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            # 主色变化或图案启用状态变化都需要重建
+            revisions = dict(cursor.execute(
+                "SELECT table_name, revision FROM data_revisions WHERE table_name IN ('patterns', 'pattern_colors')"
+            ).fetchall())
+            revision = (revisions.get('patterns', 0), revisions.get('pattern_colors', 0))
+            with self._lock:
+                if revision == self._revision:
+                    return self._pattern_ids, self._lab, self._weights
+                rows = cursor.execute(f'''
+                    SELECT pc.pattern_id, pc.lab_l, pc.lab_a, pc.lab_b, pc.weight
+                    FROM pattern_colors pc
+                    JOIN patterns p ON p.id = pc.pattern_id
+                    WHERE p.is_active = 1 AND pc.weight >= {MIN_COLOR_WEIGHT}
+                ''').fetchall()
+                self._pattern_ids = np.array([r['pattern_id'] for r in rows], dtype=np.int64)
+                self._lab = np.array([[r['lab_l'], r['lab_a'], r['lab_b']] for r in rows],
+                                     dtype=np.float32).reshape(-1, 3)
+                self._weights = np.array([r['weight'] for r in rows], dtype=np.float32)
+                self._revision = revision
+                return self._pattern_ids, self._lab, self._weights
+        finally:
+            conn.close()
+
+    def nearest(self, rgb: Tuple[int, int, int],
+                max_distance: float = DEFAULT_COLOR_DISTANCE) -> Dict[int, Dict[str, float]]:
+        """
+        查找主色与给定颜色相近的图案，返回 {pattern_id: {distance, weight}}（按色差升序插入）
+        每个图案取与查询颜色最接近的主色
+        """
+        import numpy as np
+
+        pattern_ids, lab, weights = self._load()
+        if not len(pattern_ids):
+            return {}
+        distances = np.linalg.norm(lab - rgb_to_lab(np.array(rgb, dtype=np.float32)), axis=1)
+        matched = np.nonzero(distances <= max_distance)[0]
+        # 色差相同时占比高的优先
+        matched = matched[np.lexsort((-weights[matched], distances[matched]))]
+        results = {}
+        for index in matched:
+            pattern_id = int(pattern_ids[index])
+            if pattern_id not in results:
+                results[pattern_id] = {'distance': round(float(distances[index]), 2),
+                                       'weight': round(float(weights[index]), 4)}
+        return results
+
+
+color_index = PatternColorIndex()
+
+
+def filter_by_color(patterns: Sequence[Dict[str, Any]], rgb: Tuple[int, int, int],
+                    max_distance: float = DEFAULT_COLOR_DISTANCE) -> List[Dict[str, Any]]:
+    """筛选主色相近的图案并按色差排序，结果附带 color_distance / color_weight"""
+    matches = color_index.nearest(rgb, max_distance)
+    order = {pattern_id: position for position, pattern_id in enumerate(matches)}
+    results = [dict(pattern, color_distance=matches[pattern['id']]['distance'],
+                    color_weight=matches[pattern['id']]['weight'])
+               for pattern in patterns if pattern['id'] in matches]
+    results.sort(key=lambda pattern: order[pattern['id']])
+    return results
+
+
+def backfill_pattern_colors(batch_size: int = BACKFILL_BATCH_SIZE) -> Dict[str, int]:
+    """补算 uploads/patterns 中尚无主色记录的图案，返回 {extracted, failed}"""
+    from .storage_reaper import upload_path
+
+    conn = get_db_connection()
+    try:
+        rows = [dict(row) for row in conn.execute('''
+            SELECT p.id, p.filename, p.file_path FROM patterns p
+            WHERE NOT EXISTS (SELECT 1 FROM pattern_colors pc WHERE pc.pattern_id = p.id)
+        ''').fetchall()]
+    finally:
+        conn.close()
+
+    stats = {'extracted': 0, 'failed': 0}
+    for start in range(0, len(rows), batch_size):
+        palettes = []
+        for row in rows[start:start + batch_size]:
+            palette = palette_file(upload_path('patterns', row['filename'] or row['file_path']))
+            stats['extracted' if palette is not None else 'failed'] += 1
+            palettes.append((row['id'], palette))
+        conn = get_db_connection()
+        try:
+            save_palettes(conn.cursor(), palettes)
+            conn.commit()
+        finally:
+            conn.close()
+    return stats
+
+
+def init_pattern_color_index(app) -> Optional[threading.Thread]:
+    """
+    启动后台线程补算已有图案的主色
+    app.config['PATTERN_COLOR_BACKFILL'] 为 False 时不启动
+    """
+    app.config.setdefault('PATTERN_COLOR_BACKFILL', True)
+    if not app.config['PATTERN_COLOR_BACKFILL']:
+        return None
+
+    def run():
+        try:
+            stats = backfill_pattern_colors()
+            if stats['extracted'] or stats['failed']:
+                print(f"已补算 {stats['extracted']} 个图案的主色，{stats['failed']} 个图片无法读取")
+        except Exception as e:
+            print(f"补算图案主色失败: {e}")
+
+    thread = threading.Thread(target=run, name='pattern-color-backfill', daemon=True)
+    thread.start()
+    return thread
+
+
+if __name__ == '__main__':
+    result = backfill_pattern_colors()
+    print(f"图案主色补算完成: 提取 {result['extracted']} 个, 失败 {result['failed']} 个")
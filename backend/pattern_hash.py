@@ -0,0 +1,331 @@
+"""
+印花感知哈希与近似图案索引
+入库时用 NumPy 批量计算 pHash（32x32 灰度图的DCT低频系数与中位数比较）和 dHash（9x8 灰度图相邻像素差），
+保存在 pattern_hashes 表中；进程内按 pHash 建立 BK 树，按汉明距离查找近似重复的图案，
+图案或哈希表变化后在下次查询时重建。已有图案的哈希由后台线程补算
+"""
+import threading
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from .database import get_db_connection
+
+# pHash 汉明距离不超过该值视为近似重复（64位）
+DEFAULT_MAX_DISTANCE = 8
+PHASH_SIZE = 32
+HASH_BITS = 64
+BACKFILL_BATCH_SIZE = 64
+
+
+@lru_cache(maxsize=None)
+def _dct_matrix(size: int):
+    """正交DCT-II变换矩阵（首次计算哈希时生成）"""
+    import numpy as np
+
+    k = np.arange(size)[:, None]
+    n = np.arange(size)[None, :]
+    matrix = np.cos(np.pi * (2 * n + 1) * k / (2 * size)) * np.sqrt(2.0 / size)
+    matrix[0] /= np.sqrt(2.0)
+    return matrix.astype(np.float32)
+
+
+def _grayscale_stack(images: Sequence[Any], size: Tuple[int, int]):
+    """缩放为灰度图并堆叠为 (N, 高, 宽) 数组"""
+    import numpy as np
+    from PIL import Image
+
+    return np.stack([
+        np.asarray(image.convert('L').resize(size, Image.BILINEAR), dtype=np.float32)
+        for image in images
+    ])
+
+
+def _pack_bits(bits) -> List[int]:
+    """(N, 64) 布尔数组打包为64位整数"""
+    import numpy as np
+
+    packed = np.packbits(bits.astype(np.uint8), axis=1)
+    return [int.from_bytes(row.tobytes(), 'big') for row in packed]
+
+
+def compute_hashes(images: Sequence[Any]) -> List[Tuple[int, int]]:
+    """批量计算 PIL 图片的 (pHash, dHash)，均为无符号64位整数"""
+    import numpy as np
+
+    if not images:
+        return []
+    dct = _dct_matrix(PHASH_SIZE)
+    pixels = _grayscale_stack(images, (PHASH_SIZE, PHASH_SIZE))
+    coefficients = dct @ pixels @ dct.T
+    low = coefficients[:, :8, :8].reshape(len(images), HASH_BITS)
+    # 直流分量不参与中位数
+    phash_bits = low > np.median(low[:, 1:], axis=1, keepdims=True)
+
+    small = _grayscale_stack(images, (9, 8))
+    dhash_bits = (small[:, :, 1:] > small[:, :, :-1]).reshape(len(images), HASH_BITS)
+    return list(zip(_pack_bits(phash_bits), _pack_bits(dhash_bits)))
+
+
+def hash_file(file_path: str) -> Optional[Tuple[int, int]]:
+    """计算图片文件的 (pHash, dHash)，无法读取时返回 None"""
+    from PIL import Image
+
+    try:
+        with Image.open(file_path) as image:
+            image.draft('L', (PHASH_SIZE * 4, PHASH_SIZE * 4))
+            return compute_hashes([image])[0]
+    except Exception as e:
+        print(f"计算图片哈希失败 {file_path}: {e}")
+        return None
+
+
+def hamming(a: int, b: int) -> int:
+    # int.bit_count() 需要 Python 3.10，项目支持 3.7+
+    return bin(a ^ b).count('1')
+
+
+def to_signed(value: Optional[int]) -> Optional[int]:
+    """SQLite INTEGER 为有符号64位，存储前转换"""
+    if value is None:
+        return None
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+
+def to_unsigned(value: Optional[int]) -> Optional[int]:
+    if value is None:
+        return None
+    return value + (1 << 64) if value < 0 else value
+
+
+class BKTree:
+    """按汉明距离组织的 BK 树，节点为 [哈希, 值列表, {距离: 子节点}]"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def add(self, value_hash: int, value: Any):
+        self._size += 1
+        if self._root is None:
+            self._root = [value_hash, [value], {}]
+            return
+        node = self._root
+        while True:
+            distance = hamming(value_hash, node[0])
+            if distance == 0:
+                node[1].append(value)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [value_hash, [value], {}]
+                return
+            node = child
+
+    def search(self, value_hash: int, max_distance: int) -> List[Tuple[int, Any]]:
+        """返回距离不超过 max_distance 的 (距离, 值)，按距离升序"""
+        results = []
+        stack = [self._root] if self._root is not None else []
+        while stack:
+            node = stack.pop()
+            distance = hamming(value_hash, node[0])
+            if distance <= max_distance:
+                results.extend((distance, value) for value in node[1])
+            # 三角不等式：只有边距离在 [d - r, d + r] 内的子树可能命中
+            for edge, child in node[2].items():
+                if distance - max_distance <= edge <= distance + max_distance:
+                    stack.append(child)
+        results.sort(key=lambda item: item[0])
+        return results
+
+
+class PatternHashIndex:
+    """启用中的印花的 pHash BK 树，patterns 数据版本或 pattern_hashes 变化后在下次查询时重建"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tree = BKTree()
+        self._signature = None
+
+    @staticmethod
+    def _current_signature(cursor) -> tuple:
+        revision = cursor.execute(
+            "SELECT revision FROM data_revisions WHERE table_name = 'patterns'").fetchone()
+        hashes = cursor.execute("SELECT COUNT(*), COALESCE(MAX(rowid), 0) FROM pattern_hashes").fetchone()
+        return (revision[0] if revision else 0, hashes[0], hashes[1])
+
+    def tree(self) -> BKTree:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            signature = self._current_signature(cursor)
+            with self._lock:
+                if signature == self._signature:
+                    return self._tree
+                rows = cursor.execute('''
+                    SELECT ph.pattern_id, ph.phash, ph.dhash
+                    FROM pattern_hashes ph
+                    JOIN patterns p ON p.id = ph.pattern_id
+                    WHERE p.is_active = 1 AND ph.phash IS NOT NULL
+                ''').fetchall()
+                tree = BKTree()
+                for row in rows:
+                    tree.add(to_unsigned(row['phash']), (row['pattern_id'], to_unsigned(row['dhash'])))
+                self._tree, self._signature = tree, signature
+                return tree
+        finally:
+            conn.close()
+
+    def find_similar(self, phash: int, dhash: int, max_distance: int = DEFAULT_MAX_DISTANCE,
+                     exclude: Iterable[int] = (), limit: int = 10) -> List[Dict[str, Any]]:
+        """
+        查找近似图案：pHash 距离不超过 max_distance，且 dHash 距离不超过其两倍（排除构图相近但明暗不同的图案）
+        返回 [{id, name, filename, distance, dhash_distance}]，按距离升序
+        """
+        excluded = set(exclude)
+        matches = []
+        for distance, (pattern_id, candidate_dhash) in self.tree().search(phash, max_distance):
+            if pattern_id in excluded:
+                continue
+            dhash_distance = hamming(dhash, candidate_dhash)
+            if dhash_distance > max_distance * 2:
+                continue
+            matches.append({'id': pattern_id, 'distance': distance, 'dhash_distance': dhash_distance})
+        matches.sort(key=lambda item: (item['distance'], item['dhash_distance']))
+        matches = matches[:limit]
+        if matches:
+            ids = [item['id'] for item in matches]
+            conn = get_db_connection()
+            try:
+                rows = conn.execute(
+                    f"SELECT id, name, filename FROM patterns WHERE id IN ({','.join('?' * len(ids))})", ids
+                ).fetchall()
+            finally:
+                conn.close()
+            names = {row['id']: row for row in rows}
+            matches = [dict(item, name=names[item['id']]['name'], filename=names[item['id']]['filename'])
+                       for item in matches if item['id'] in names]
+        return matches
+
+
+pattern_index = PatternHashIndex()
+
+
+def save_hashes(cursor, rows: Iterable[Tuple[int, Optional[int], Optional[int]]]):
+    """写入 (pattern_id, pHash, dHash)，由调用方提交"""
+    cursor.executemany(
+        "INSERT OR REPLACE INTO pattern_hashes (pattern_id, phash, dhash) VALUES (?, ?, ?)",
+        [(pattern_id, to_signed(phash), to_signed(dhash)) for pattern_id, phash, dhash in rows]
+    )
+
+
+def get_pattern_hashes(pattern_id: int) -> Optional[Tuple[int, int]]:
+    """已保存的 (pHash, dHash)，没有记录或图片无法读取时返回 None"""
+    conn = get_db_connection()
+    try:
+        row = conn.execute("SELECT phash, dhash FROM pattern_hashes WHERE pattern_id = ?", (pattern_id,)).fetchone()
+    finally:
+        conn.close()
+    if not row or row['phash'] is None:
+        return None
+    return to_unsigned(row['phash']), to_unsigned(row['dhash'])
+
+
+def register_pattern_image(pattern_id: int, file_path: str,
+                           max_distance: int = DEFAULT_MAX_DISTANCE) -> List[Dict[str, Any]]:
+    """图案入库或替换图片后计算并保存哈希，返回与之近似的其他图案；出错只打印，不影响上传"""
+    try:
+        hashes = hash_file(file_path)
+        similar = []
+        if hashes:
+            similar = pattern_index.find_similar(hashes[0], hashes[1], max_distance, exclude=[pattern_id])
+        conn = get_db_connection()
+        try:
+            save_hashes(conn.cursor(), [(pattern_id, *(hashes or (None, None)))])
+            conn.commit()
+        finally:
+            conn.close()
+        return similar
+    except Exception as e:
+        print(f"登记图案哈希失败 {pattern_id}: {e}")
+        return []
+
+
+def similar_message(similar: List[Dict[str, Any]]) -> str:
+    """上传结果中的近似图案提示"""
+    if not similar:
+        return ''
+    names = '、'.join(f'"{item["name"]}"' for item in similar[:3])
+    more = f'等 {len(similar)} 个图案' if len(similar) > 3 else ''
+    return f'（疑似与{names}{more}重复）'
+
+
+def backfill_pattern_hashes(batch_size: int = BACKFILL_BATCH_SIZE) -> Dict[str, int]:
+    """补算没有哈希记录的图案，返回 {hashed, failed}"""
+    conn = get_db_connection()
+    try:
+        rows = [dict(row) for row in conn.execute('''
+            SELECT p.id, p.filename, p.file_path FROM patterns p
+            LEFT JOIN pattern_hashes ph ON ph.pattern_id = p.id
+            WHERE ph.pattern_id IS NULL
+        ''').fetchall()]
+    finally:
+        conn.close()
+
+    stats = {'hashed': 0, 'failed': 0}
+    if not rows:
+        return stats
+    # 有待补算的图案时才加载 Pillow / NumPy
+    from PIL import Image
+    from .storage_reaper import upload_path
+
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        images = []
+        loaded_ids = []
+        results = []
+        for row in batch:
+            path = upload_path('patterns', row['filename'] or row['file_path'])
+            try:
+                with Image.open(path) as image:
+                    image.draft('L', (PHASH_SIZE * 4, PHASH_SIZE * 4))
+                    images.append(image.convert('L'))
+                loaded_ids.append(row['id'])
+            except Exception:
+                results.append((row['id'], None, None))
+                stats['failed'] += 1
+        for pattern_id, (phash, dhash) in zip(loaded_ids, compute_hashes(images)):
+            results.append((pattern_id, phash, dhash))
+            stats['hashed'] += 1
+        conn = get_db_connection()
+        try:
+            save_hashes(conn.cursor(), results)
+            conn.commit()
+        finally:
+            conn.close()
+    return stats
+
+
+def init_pattern_hash_index(app) -> Optional[threading.Thread]:
+    """
+    启动后台线程补算已有图案的哈希并预建索引
+    app.config['PATTERN_HASH_BACKFILL'] 为 False 时不启动
+    """
+    app.config.setdefault('PATTERN_HASH_BACKFILL', True)
+    if not app.config['PATTERN_HASH_BACKFILL']:
+        return None
+
+    def run():
+        try:
+            stats = backfill_pattern_hashes()
+            if stats['hashed'] or stats['failed']:
+                print(f"已补算 {stats['hashed']} 个图案的哈希，{stats['failed']} 个图片无法读取")
+            pattern_index.tree()
+        except Exception as e:
+            print(f"补算图案哈希失败: {e}")
+
+    thread = threading.Thread(target=run, name='pattern-hash-backfill', daemon=True)
+    thread.start()
+    return thread
@@ -0,0 +1,326 @@
+"""
+印花图案批量导入
+一次查询完成重名检测，线程池并行解码校验，所有记录在单个事务中写入，并逐个文件返回进度
+"""
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from werkzeug.utils import secure_filename
+
+from .database import get_db_connection, bump_data_revision
+from .image_normalizer import ImageNormalizationError, keep_original, normalize_image, replace_extension
+from .pattern_colors import extract_palette, save_palettes
+from .render_cache import invalidate_render_cache
+from .storage_reaper import schedule_delete
+from .pattern_hash import compute_hashes, hamming, pattern_index, save_hashes, similar_message, DEFAULT_MAX_DISTANCE
+
+PATTERN_UPLOAD_DIR = os.path.join('uploads', 'patterns')
+ALLOWED_PATTERN_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
+# 缩略图用于后续的图像分析阶段，只保存在内存中
+THUMBNAIL_SIZE = (256, 256)
+# SQLite单条语句的参数上限较低，分批查询
+SQL_PARAM_CHUNK = 500
+
+
+def _chunks(items: List[Any], size: int) -> Iterator[List[Any]]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def find_existing_pattern_names(cursor, names: Iterable[str]) -> Dict[str, Dict[str, Any]]:
+    """批量查询已存在的图案名称，返回 名称 -> 记录"""
+    names = list({name for name in names if name})
+    existing = {}
+    for chunk in _chunks(names, SQL_PARAM_CHUNK):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(
+            f"SELECT id, name, filename, file_path FROM patterns WHERE name IN ({placeholders})",
+            tuple(chunk)
+        )
+        for row in cursor.fetchall():
+            existing.setdefault(row['name'], dict(row))
+    return existing
+
+
+class PatternUploadItem:
+    """批量上传中的单个文件"""
+
+    def __init__(self, index: int, filename: str, data: bytes, pattern_name: str, action: str = 'rename'):
+        self.index = index
+        self.filename = filename
+        self.data = data
+        self.pattern_name = pattern_name
+        self.action = action
+        self.stored_filename = ''
+        self.file_path = ''
+        self.original_path = None
+        self.file_size = len(data)
+        self.image_width = 0
+        self.image_height = 0
+        self.thumbnail = None
+        # (pHash, dHash) 及近似的已有图案或本批次中的其他文件
+        self.hashes = None
+        self.palette = None
+        self.similar = []
+        self.status = 'pending'
+        self.message = ''
+
+    def fail(self, message: str):
+        self.status = 'error'
+        self.message = message
+
+    def to_result(self) -> Dict[str, Any]:
+        result = {
+            'index': self.index,
+            'filename': self.filename,
+            'pattern_name': self.pattern_name,
+            'status': self.status,
+            'message': self.message
+        }
+        if self.similar:
+            result['similar'] = self.similar
+        return result
+
+
+def process_pattern_file(item: PatternUploadItem, upload_dir: str = PATTERN_UPLOAD_DIR) -> PatternUploadItem:
+    """解码校验并规范化图片、生成内存缩略图并写入磁盘（在线程池中执行）"""
+    from io import BytesIO
+    from PIL import Image
+
+    try:
+        normalized = normalize_image(item.data, 'pattern')
+        with Image.open(BytesIO(normalized.data)) as image:
+            item.image_width, item.image_height = image.size
+            thumbnail = image.copy()
+            thumbnail.thumbnail(THUMBNAIL_SIZE)
+            item.thumbnail = thumbnail
+        item.hashes = compute_hashes([thumbnail])[0]
+        item.palette = extract_palette(thumbnail)
+    except ImageNormalizationError as e:
+        item.fail(str(e))
+        return item
+    except Exception:
+        item.fail('不是有效的图片文件')
+        return item
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
+    safe_name = replace_extension(secure_filename(item.filename), normalized.extension)
+    item.stored_filename = f"pattern_{timestamp}_{item.index}_{safe_name}"
+    item.file_path = os.path.join(upload_dir, item.stored_filename)
+    item.file_size = len(normalized.data)
+    try:
+        item.original_path = keep_original(item.data, 'pattern', item.stored_filename)
+        with open(item.file_path, 'wb') as f:
+            f.write(normalized.data)
+    except OSError as e:
+        item.fail(f'文件保存失败: {e}')
+        return item
+
+    item.status = 'processed'
+    item.message = '已处理'
+    return item
+
+
+class BatchPatternImporter:
+    """批量导入流水线，run() 逐行产出可直接序列化为NDJSON的进度事件"""
+
+    def __init__(self, category_id: int = 1, max_workers: Optional[int] = None,
+                 upload_dir: str = PATTERN_UPLOAD_DIR):
+        self.category_id = category_id or 1
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.upload_dir = upload_dir
+
+    @staticmethod
+    def build_items(files: List[Tuple[str, bytes]], upload_data: Dict[str, Any]) -> List[PatternUploadItem]:
+        """根据上传文件和前端提交的命名/处理方式构造待处理项"""
+        items = []
+        for index, (filename, data) in enumerate(files):
+            options = upload_data.get(str(index)) or {}
+            default_name = os.path.splitext(filename)[0]
+            pattern_name = (options.get('newName') or default_name).strip()
+            items.append(PatternUploadItem(index, filename, data, pattern_name, options.get('action', 'rename')))
+        return items
+
+    def _validate(self, items: List[PatternUploadItem], existing: Dict[str, Dict[str, Any]]):
+        """扩展名和重名校验，不访问数据库"""
+        seen_names = set()
+        for item in items:
+            extension = item.filename.rsplit('.', 1)[-1].lower() if '.' in item.filename else ''
+            if extension not in ALLOWED_PATTERN_EXTENSIONS:
+                item.fail('不支持的文件格式')
+            elif not item.pattern_name:
+                item.fail('图案名称不能为空')
+            elif item.pattern_name in seen_names:
+                item.fail('与本批次中其他文件重名')
+            elif item.pattern_name in existing and item.action != 'overwrite':
+                item.fail('图案名称已存在')
+            seen_names.add(item.pattern_name)
+
+    def run(self, items: List[PatternUploadItem]) -> Iterator[Dict[str, Any]]:
+        os.makedirs(self.upload_dir, exist_ok=True)
+        total = len(items)
+        yield {'type': 'start', 'total': total}
+
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            existing = find_existing_pattern_names(cursor, (item.pattern_name for item in items))
+            self._validate(items, existing)
+
+            completed = 0
+            for item in items:
+                if item.status == 'error':
+                    completed += 1
+                    yield {'type': 'progress', 'completed': completed, 'total': total, **item.to_result()}
+
+            pending = [item for item in items if item.status == 'pending']
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                futures = [executor.submit(process_pattern_file, item, self.upload_dir) for item in pending]
+                try:
+                    for future in as_completed(futures):
+                        item = future.result()
+                        # 原始数据已写入磁盘，及时释放内存
+                        item.data = b''
+                        completed += 1
+                        yield {'type': 'progress', 'completed': completed, 'total': total, **item.to_result()}
+                except GeneratorExit:
+                    # 客户端已断开，排队中的文件不再处理（正在处理的文件由退出时等待完成）
+                    for future in futures:
+                        future.cancel()
+                    raise
+
+            processed = [item for item in items if item.status == 'processed']
+            self._flag_similar(processed, existing)
+            replaced_files = self._commit(conn, processed, existing)
+        except GeneratorExit:
+            # 客户端中途断开：尚未写入数据库的文件全部删除
+            conn.rollback()
+            for item in items:
+                if item.status == 'processed':
+                    self._discard_files(item)
+            raise
+        except Exception as e:
+            conn.rollback()
+            for item in items:
+                if item.status == 'processed':
+                    self._discard_files(item)
+                    item.fail(f'写入数据库失败: {e}')
+            yield self._summary(items, success=False, message=f'批量上传失败: {e}')
+            return
+        finally:
+            conn.close()
+
+        # 旧图交给后台删除队列，按文件名定位历史记录中的Windows路径或URL
+        schedule_delete('patterns', replaced_files)
+        # 被覆盖的图案换了图片，使用旧图的效果图缓存失效
+        for item in items:
+            if item.status == 'success' and item.action == 'overwrite' and item.pattern_name in existing:
+                invalidate_render_cache(pattern_id=existing[item.pattern_name]['id'])
+        yield self._summary(items, success=True)
+
+    @staticmethod
+    def _flag_similar(processed: List[PatternUploadItem], existing: Dict[str, Dict[str, Any]]):
+        """标记与已有图案或本批次中前面的文件近似的图片（只提示，不阻止上传）"""
+        seen = []
+        for item in processed:
+            if not item.hashes:
+                continue
+            phash, dhash = item.hashes
+            # 覆盖同名图案时不与被覆盖的旧图比较
+            exclude = []
+            if item.action == 'overwrite' and item.pattern_name in existing:
+                exclude.append(existing[item.pattern_name]['id'])
+            item.similar = pattern_index.find_similar(phash, dhash, exclude=exclude)
+            for other in seen:
+                distance = hamming(phash, other.hashes[0])
+                if distance <= DEFAULT_MAX_DISTANCE and hamming(dhash, other.hashes[1]) <= DEFAULT_MAX_DISTANCE * 2:
+                    item.similar.append({'id': None, 'name': other.pattern_name, 'filename': other.filename,
+                                         'distance': distance})
+            seen.append(item)
+
+    def _commit(self, conn, processed: List[PatternUploadItem], existing: Dict[str, Dict[str, Any]]) -> List[str]:
+        """在单个事务中写入所有记录，返回被覆盖的旧文件（数据库中保存的文件名或路径）"""
+        cursor = conn.cursor()
+        inserts = []
+        updates = []
+        replaced_files = []
+        for item in processed:
+            row = (item.pattern_name, item.stored_filename, item.file_path, self.category_id,
+                   item.file_size, item.image_width, item.image_height)
+            if item.action == 'overwrite' and item.pattern_name in existing:
+                old = existing[item.pattern_name]
+                updates.append(row + (old['id'],))
+                replaced_files.append(old['filename'] or old['file_path'])
+            else:
+                inserts.append(row)
+
+        if inserts:
+            cursor.executemany('''
+                INSERT INTO patterns (name, filename, file_path, category_id, file_size, image_width, image_height)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            ''', inserts)
+        if updates:
+            cursor.executemany('''
+                UPDATE patterns
+                SET name = ?, filename = ?, file_path = ?, category_id = ?, file_size = ?,
+                    image_width = ?, image_height = ?, upload_time = CURRENT_TIMESTAMP
+                WHERE id = ?
+            ''', updates)
+        if inserts or updates:
+            bump_data_revision(cursor, table_name='patterns')
+        # 哈希、主色与图案记录在同一事务中写入，按唯一的存储文件名取得图案ID
+        hashed = [item for item in processed if item.hashes]
+        for chunk in _chunks(hashed, SQL_PARAM_CHUNK):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT id, filename FROM patterns WHERE filename IN ({placeholders})",
+                           tuple(item.stored_filename for item in chunk))
+            ids = {row['filename']: row['id'] for row in cursor.fetchall()}
+            save_hashes(cursor, [(ids[item.stored_filename], *item.hashes)
+                                 for item in chunk if item.stored_filename in ids])
+            save_palettes(cursor, [(ids[item.stored_filename], item.palette)
+                                   for item in chunk if item.stored_filename in ids])
+        conn.commit()
+
+        for item in processed:
+            item.status = 'success'
+            item.message = '覆盖成功' if item.action == 'overwrite' and item.pattern_name in existing else '上传成功'
+            item.message += similar_message(item.similar)
+        return replaced_files
+
+    @classmethod
+    def _discard_files(cls, item: PatternUploadItem):
+        """删除未入库的文件及保留的原图"""
+        cls._remove_file(item.file_path)
+        cls._remove_file(item.original_path)
+
+    @staticmethod
+    def _remove_file(file_path: Optional[str]):
+        try:
+            if file_path and os.path.exists(file_path):
+                os.remove(file_path)
+        except OSError as e:
+            print(f"删除文件失败 {file_path}: {e}")
+
+    @staticmethod
+    def _summary(items: List[PatternUploadItem], success: bool, message: str = '') -> Dict[str, Any]:
+        success_count = sum(1 for item in items if item.status == 'success')
+        error_count = len(items) - success_count
+        if not message:
+            message = f'批量上传完成：成功 {success_count} 个，失败 {error_count} 个'
+        return {
+            'type': 'done',
+            'success': success and success_count > 0,
+            'message': message,
+            'success_count': success_count,
+            'error_count': error_count,
+            'results': [item.to_result() for item in items]
+        }
+
+
+def stream_ndjson(events: Iterable[Dict[str, Any]]) -> Iterator[str]:
+    """将事件序列化为NDJSON行"""
+    for event in events:
+        yield json.dumps(event, ensure_ascii=False) + '\n'
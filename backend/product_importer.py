@@ -0,0 +1,282 @@
+"""
+产品批量导入
+从ZIP压缩包或服务器目录中按命名规则（A001.png + A001_Depth.png）配对产品图和深度图，
+并行校验测量后在单个事务中写入所有产品
+"""
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from werkzeug.utils import secure_filename
+
+from .database import get_db_connection, bump_data_revision
+from .image_normalizer import ImageNormalizationError, keep_original, normalize_image
+
+PRODUCT_UPLOAD_DIR = os.path.join('uploads', 'products')
+DEPTH_UPLOAD_DIR = os.path.join('uploads', 'depth_maps')
+IMAGE_EXTENSIONS = {'png', 'jpg', 'jpeg', 'bmp', 'webp'}
+# 深度图命名：<产品名>_Depth / <产品名>-depth / <产品名> depth
+DEPTH_NAME_PATTERN = re.compile(r'^(?P<stem>.+?)[\s_\-]*depth$', re.IGNORECASE)
+# 压缩包解压后的总大小上限，防止压缩炸弹
+MAX_ARCHIVE_UNCOMPRESSED_BYTES = 4 * 1024 ** 3
+# 服务器目录导入只能读取该目录下的文件夹（可由 app.config['PRODUCT_IMPORT_ROOT'] 覆盖）
+DEFAULT_IMPORT_ROOT = os.path.join('uploads', 'imports')
+
+
+class ProductImportError(Exception):
+    """导入源无法读取"""
+
+
+class ProductImportItem:
+    """一组待导入的产品图和深度图"""
+
+    def __init__(self, key: str, title: str, folder: str = ''):
+        self.key = key
+        self.title = title
+        self.folder = folder
+        self.product_name = ''
+        self.depth_name = ''
+        self.product_loader: Optional[Callable[[], bytes]] = None
+        self.depth_loader: Optional[Callable[[], bytes]] = None
+        self.category_id: Optional[int] = None
+        self.sequence = 0
+        self.product_filename = ''
+        self.depth_filename = ''
+        self.image_width = 0
+        self.image_height = 0
+        self.status = 'pending'
+        self.message = ''
+
+    def fail(self, message: str):
+        self.status = 'error'
+        self.message = message
+
+    def to_result(self) -> Dict[str, Any]:
+        return {
+            'title': self.title,
+            'folder': self.folder,
+            'product_file': self.product_name,
+            'depth_file': self.depth_name,
+            'status': self.status,
+            'message': self.message
+        }
+
+
+def _split_entry(path: str) -> Tuple[str, str, str]:
+    """拆分为 (所在目录, 文件名主干, 扩展名)"""
+    path = path.replace('\\', '/')
+    folder, name = os.path.split(path)
+    stem, extension = os.path.splitext(name)
+    return folder, stem, extension.lstrip('.').lower()
+
+
+def pair_entries(entries: Dict[str, Callable[[], bytes]]) -> List[ProductImportItem]:
+    """按命名规则配对产品图和深度图，同一目录内按文件名主干匹配"""
+    items: Dict[str, ProductImportItem] = {}
+    for path in sorted(entries):
+        folder, stem, extension = _split_entry(path)
+        if extension not in IMAGE_EXTENSIONS or stem.startswith('.') or '__MACOSX' in folder:
+            continue
+        match = DEPTH_NAME_PATTERN.match(stem)
+        title = match.group('stem') if match else stem
+        key = f"{folder}/{title}".lower()
+        item = items.setdefault(key, ProductImportItem(key, title, folder))
+        if match:
+            item.depth_name = path
+            item.depth_loader = entries[path]
+        else:
+            item.product_name = path
+            item.product_loader = entries[path]
+
+    for item in items.values():
+        if not item.product_loader:
+            item.fail('缺少对应的产品图')
+        elif not item.depth_loader:
+            item.fail('缺少对应的深度图')
+    return list(items.values())
+
+
+def open_zip_source(file_obj) -> Tuple[Dict[str, Callable[[], bytes]], Callable[[], None]]:
+    """读取ZIP压缩包，返回 路径 -> 读取函数，以及关闭函数"""
+    try:
+        archive = zipfile.ZipFile(file_obj)
+    except zipfile.BadZipFile:
+        raise ProductImportError('不是有效的ZIP压缩包')
+
+    infos = [info for info in archive.infolist() if not info.is_dir()]
+    if sum(info.file_size for info in infos) > MAX_ARCHIVE_UNCOMPRESSED_BYTES:
+        archive.close()
+        raise ProductImportError('压缩包解压后体积过大')
+
+    entries = {info.filename: (lambda name=info.filename: archive.read(name)) for info in infos}
+    return entries, archive.close
+
+
+def _within(root: str, path: str) -> bool:
+    try:
+        return os.path.commonpath([root, path]) == root
+    except ValueError:
+        # Windows 上位于不同盘符
+        return False
+
+
+def resolve_import_directory(directory: str, root: str = DEFAULT_IMPORT_ROOT) -> str:
+    """把表单填写的目录解析为导入根目录下的真实路径，越出根目录（含 .. 和符号链接）时报错"""
+    root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(root, directory))
+    if not _within(root, path):
+        raise ProductImportError('只能导入服务器导入目录下的文件夹')
+    return path
+
+
+def open_directory_source(directory: str, root: str = DEFAULT_IMPORT_ROOT
+                          ) -> Tuple[Dict[str, Callable[[], bytes]], Callable[[], None]]:
+    """读取导入根目录下的文件夹（含子目录），返回 相对路径 -> 读取函数"""
+    if not directory:
+        raise ProductImportError('目录不存在')
+    root = os.path.realpath(root)
+    directory = resolve_import_directory(directory, root)
+    if not os.path.isdir(directory):
+        raise ProductImportError('目录不存在')
+
+    def reader(full_path: str) -> Callable[[], bytes]:
+        def read() -> bytes:
+            with open(full_path, 'rb') as f:
+                return f.read()
+        return read
+
+    entries = {}
+    for walk_root, _, filenames in os.walk(directory):
+        for filename in filenames:
+            full_path = os.path.join(walk_root, filename)
+            # 指向导入根目录以外的符号链接不读取
+            if not _within(root, os.path.realpath(full_path)):
+                continue
+            entries[os.path.relpath(full_path, directory)] = reader(full_path)
+    return entries, lambda: None
+
+
+def process_product_item(item: ProductImportItem) -> ProductImportItem:
+    """校验、规范化并测量产品图与深度图，然后写入磁盘（在线程池中执行）"""
+    try:
+        product_data = item.product_loader()
+        depth_data = item.depth_loader()
+    except Exception as e:
+        item.fail(f'读取文件失败: {e}')
+        return item
+
+    try:
+        product = normalize_image(product_data, 'product')
+    except ImageNormalizationError as e:
+        item.fail(f'产品图: {e}')
+        return item
+    try:
+        depth = normalize_image(depth_data, 'depth')
+    except ImageNormalizationError as e:
+        item.fail(f'深度图: {e}')
+        return item
+
+    item.image_width, item.image_height = product.width, product.height
+    depth_size = (depth.width, depth.height)
+
+    timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    safe_title = secure_filename(item.title) or 'product'
+    item.product_filename = f"product_{timestamp}_{item.sequence}_{safe_title}{product.extension}"
+    item.depth_filename = f"depth_{timestamp}_{item.sequence}_{safe_title}_Depth{depth.extension}"
+
+    try:
+        keep_original(product_data, 'product', item.product_filename)
+        keep_original(depth_data, 'depth', item.depth_filename)
+        with open(os.path.join(PRODUCT_UPLOAD_DIR, item.product_filename), 'wb') as f:
+            f.write(product.data)
+        with open(os.path.join(DEPTH_UPLOAD_DIR, item.depth_filename), 'wb') as f:
+            f.write(depth.data)
+    except OSError as e:
+        item.fail(f'文件保存失败: {e}')
+        return item
+
+    item.status = 'processed'
+    if depth_size != (item.image_width, item.image_height):
+        item.message = (f'深度图尺寸 {depth_size[0]}x{depth_size[1]} 与产品图 '
+                        f'{item.image_width}x{item.image_height} 不一致')
+    return item
+
+
+class BulkProductImporter:
+    """产品批量导入，run() 返回包含逐项结果的报告"""
+
+    def __init__(self, category_id: Optional[int] = None, max_workers: Optional[int] = None):
+        self.category_id = category_id
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+
+    @staticmethod
+    def _resolve_categories(cursor, items: List[ProductImportItem], default_category_id: Optional[int]):
+        """子目录名与产品分类名一致时归入该分类，否则使用指定分类或默认分类"""
+        cursor.execute("SELECT id, name, is_default FROM product_categories WHERE is_active = 1")
+        categories = cursor.fetchall()
+        by_name = {row['name']: row['id'] for row in categories}
+        fallback = default_category_id or next(
+            (row['id'] for row in categories if row['is_default']),
+            categories[0]['id'] if categories else 1
+        )
+        for item in items:
+            folder_name = item.folder.replace('\\', '/').split('/')[-1] if item.folder else ''
+            item.category_id = by_name.get(folder_name, fallback)
+
+    def run(self, entries: Dict[str, Callable[[], bytes]]) -> Dict[str, Any]:
+        os.makedirs(PRODUCT_UPLOAD_DIR, exist_ok=True)
+        os.makedirs(DEPTH_UPLOAD_DIR, exist_ok=True)
+
+        items = pair_entries(entries)
+        pending = [item for item in items if item.status == 'pending']
+        for sequence, item in enumerate(pending, start=1):
+            item.sequence = sequence
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(process_product_item, pending))
+
+        processed = [item for item in items if item.status == 'processed']
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            self._resolve_categories(cursor, processed, self.category_id)
+            if processed:
+                cursor.executemany('''
+                    INSERT INTO products
+                    (title, category_id, product_image, depth_image, product_image_path, depth_image_path,
+                     image_width, image_height)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                ''', [
+                    (item.title, item.category_id, item.product_filename, item.depth_filename,
+                     item.product_filename, item.depth_filename, item.image_width, item.image_height)
+                    for item in processed
+                ])
+                bump_data_revision(cursor, table_name='products')
+            conn.commit()
+        except Exception as e:
+            conn.rollback()
+            for item in processed:
+                for path in (os.path.join(PRODUCT_UPLOAD_DIR, item.product_filename),
+                             os.path.join(DEPTH_UPLOAD_DIR, item.depth_filename)):
+                    if os.path.exists(path):
+                        os.remove(path)
+                item.fail(f'写入数据库失败: {e}')
+        finally:
+            conn.close()
+
+        for item in processed:
+            if item.status == 'processed':
+                item.status = 'success'
+                item.message = item.message or '导入成功'
+
+        success_count = sum(1 for item in items if item.status == 'success')
+        return {
+            'success': success_count > 0,
+            'message': f'产品导入完成：成功 {success_count} 个，失败 {len(items) - success_count} 个',
+            'success_count': success_count,
+            'error_count': len(items) - success_count,
+            'results': [item.to_result() for item in items]
+        }
@@ -0,0 +1,316 @@
+"""
+SQL语句性能分析
+挂接 DatabaseManager 的语句观察者，按需开启逐条计时：归一化语句聚合耗时、记录慢查询日志，
+并为慢语句自动抓取 EXPLAIN QUERY PLAN。开关和阈值保存在共享配置文件中，前台和后台进程同时生效，
+各进程的聚合结果写入 instance/query_profile/ 下的文件，查看时合并
+"""
+import json
+import os
+import re
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+PROFILE_DIR = os.path.join('instance', 'query_profile')
+SLOW_LOG_MAX_BYTES = 5 * 1024 * 1024
+DEFAULT_CONFIG = {'enabled': False, 'slow_threshold_ms': 100.0, 'explain': True}
+# 配置文件和聚合结果的检查/写入间隔（秒）
+CONFIG_CHECK_INTERVAL = 2.0
+FLUSH_INTERVAL = 2.0
+# 慢查询日志中参数的最大长度，避免记录大段图片数据
+MAX_PARAM_LENGTH = 200
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r'\b\d+(?:\.\d+)?\b')
+_IN_LIST = re.compile(r'\bIN\s*\(\s*\?(?:\s*,\s*\?)*\s*\)', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_statement(query: str) -> str:
+    """去掉字面量和多余空白，使只有参数不同的语句归为一类"""
+    statement = _STRING_LITERAL.sub('?', query)
+    statement = _NUMBER_LITERAL.sub('?', statement)
+    statement = _IN_LIST.sub('IN (...)', statement)
+    return _WHITESPACE.sub(' ', statement).strip()
+
+
+def find_full_scans(plan: List[str]) -> List[str]:
+    """从查询计划中找出未使用索引的全表扫描"""
+    scans = []
+    for detail in plan:
+        match = re.match(r'SCAN (?:TABLE )?(\S+)', detail)
+        if match and 'USING' not in detail:
+            scans.append(match.group(1))
+    return scans
+
+
+def _short_params(params: tuple) -> List[str]:
+    values = []
+    for value in params or ():
+        text = repr(value)
+        values.append(text if len(text) <= MAX_PARAM_LENGTH else text[:MAX_PARAM_LENGTH] + '...')
+    return values
+
+
+def explain_query_plan(query: str, params: Optional[tuple] = None) -> List[str]:
+    """
+    获取 EXPLAIN QUERY PLAN 结果（直接使用连接，不经过 DatabaseManager，不会再次触发观察者）
+    params 为None时按归一化语句处理，所有占位符绑定NULL
+    """
+    from .database import get_db_connection
+
+    if params is None:
+        query = query.replace('IN (...)', 'IN (?)')
+        params = (None,) * query.count('?')
+    try:
+        conn = get_db_connection()
+        try:
+            rows = conn.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()
+            return [row['detail'] for row in rows]
+        finally:
+            conn.close()
+    except Exception as e:
+        return [f'无法获取查询计划: {e}']
+
+
+class QueryProfiler:
+    """单个进程的语句统计，record() 作为 DatabaseManager 的语句观察者"""
+
+    def __init__(self, source: str, directory: str = PROFILE_DIR):
+        self.source = source
+        self.directory = directory
+        self._stats: Dict[str, Dict[str, Any]] = {}
+        self._plans: Dict[str, List[str]] = {}
+        self._lock = threading.Lock()
+        # 环境变量 QUERY_PROFILING=1 强制本进程开启分析，优先于配置文件
+        self._env_enabled = os.environ.get('QUERY_PROFILING') == '1'
+        # 配置文件中的内容，_config 为叠加环境变量后实际生效的配置
+        self._file_config = dict(DEFAULT_CONFIG)
+        self._config = self._effective_config(self._file_config)
+        self._config_mtime = None
+        self._config_checked = 0.0
+        self._last_flush = 0.0
+
+    @property
+    def config_path(self) -> str:
+        return os.path.join(self.directory, 'config.json')
+
+    @property
+    def slow_log_path(self) -> str:
+        return os.path.join(self.directory, 'slow_queries.ndjson')
+
+    @property
+    def snapshot_path(self) -> str:
+        return os.path.join(self.directory, f'{self.source}_{os.getpid()}.json')
+
+    def _effective_config(self, config: Dict[str, Any]) -> Dict[str, Any]:
+        if self._env_enabled:
+            return {**config, 'enabled': True}
+        return dict(config)
+
+    def get_config(self) -> Dict[str, Any]:
+        """读取共享配置，按间隔检查文件修改时间"""
+        now = time.monotonic()
+        if now - self._config_checked < CONFIG_CHECK_INTERVAL:
+            return self._config
+        self._config_checked = now
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError:
+            return self._config
+        if mtime != self._config_mtime:
+            try:
+                with open(self.config_path, encoding='utf-8') as f:
+                    self._file_config = {**DEFAULT_CONFIG, **json.load(f)}
+                self._config = self._effective_config(self._file_config)
+                self._config_mtime = mtime
+            except (OSError, ValueError) as e:
+                print(f"读取查询分析配置失败: {e}")
+        return self._config
+
+    def set_config(self, **changes) -> Dict[str, Any]:
+        """修改共享配置，所有进程在下次检查时生效（环境变量强制开启的进程仍保持开启）"""
+        self.get_config()
+        config = {**self._file_config, **changes}
+        config['enabled'] = bool(config['enabled'])
+        config['explain'] = bool(config['explain'])
+        config['slow_threshold_ms'] = max(0.0, float(config['slow_threshold_ms']))
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = f'{self.config_path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(config, f)
+        os.replace(temp_path, self.config_path)
+        self._file_config = config
+        self._config = self._effective_config(config)
+        self._config_checked = 0.0
+        return self._config
+
+    def record(self, operation: str, query: str, params: tuple, elapsed: float):
+        config = self.get_config()
+        if not config['enabled']:
+            return
+        statement = normalize_statement(query)
+        elapsed_ms = elapsed * 1000.0
+        with self._lock:
+            stats = self._stats.get(statement)
+            if stats is None:
+                stats = self._stats[statement] = {
+                    'statement': statement, 'operation': operation, 'count': 0,
+                    'total_ms': 0.0, 'max_ms': 0.0, 'slow_count': 0
+                }
+            stats['count'] += 1
+            stats['total_ms'] += elapsed_ms
+            stats['max_ms'] = max(stats['max_ms'], elapsed_ms)
+            is_slow = elapsed_ms >= config['slow_threshold_ms']
+            if is_slow:
+                stats['slow_count'] += 1
+
+        if is_slow:
+            plan = self.explain(statement, query, params) if config['explain'] else []
+            self._log_slow({
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'source': self.source,
+                'pid': os.getpid(),
+                'duration_ms': round(elapsed_ms, 3),
+                'operation': operation,
+                'statement': statement,
+                'params': _short_params(params),
+                'plan': plan,
+                'full_scans': find_full_scans(plan),
+            })
+        self.flush()
+
+    def explain(self, statement: str, query: str, params: tuple) -> List[str]:
+        """获取语句的查询计划，同一归一化语句只抓取一次"""
+        with self._lock:
+            if statement in self._plans:
+                return self._plans[statement]
+        plan = explain_query_plan(query, params)
+        with self._lock:
+            self._plans[statement] = plan
+            stats = self._stats.get(statement)
+            if stats is not None:
+                stats['plan'] = plan
+                stats['full_scans'] = find_full_scans(plan)
+        return plan
+
+    def _log_slow(self, entry: Dict[str, Any]):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            try:
+                if os.path.getsize(self.slow_log_path) > SLOW_LOG_MAX_BYTES:
+                    os.replace(self.slow_log_path, self.slow_log_path + '.1')
+            except OSError:
+                pass
+            with open(self.slow_log_path, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        except OSError as e:
+            print(f"写入慢查询日志失败: {e}")
+
+    def flush(self, force: bool = False):
+        """把本进程的聚合结果写入文件"""
+        now = time.monotonic()
+        if not force and now - self._last_flush < FLUSH_INTERVAL:
+            return
+        self._last_flush = now
+        with self._lock:
+            snapshot = {'source': self.source, 'pid': os.getpid(), 'stats': list(self._stats.values())}
+            payload = json.dumps(snapshot, ensure_ascii=False)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            temp_path = f'{self.snapshot_path}.{threading.get_ident()}.tmp'
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(payload)
+            os.replace(temp_path, self.snapshot_path)
+        except OSError as e:
+            print(f"写入查询统计失败: {e}")
+
+    def reset(self):
+        """清空所有进程的统计结果和慢查询日志（其他进程的内存统计会在下次写入时重新出现）"""
+        with self._lock:
+            self._stats.clear()
+            self._plans.clear()
+        if not os.path.isdir(self.directory):
+            return
+        for name in os.listdir(self.directory):
+            if name == 'config.json':
+                continue
+            try:
+                os.remove(os.path.join(self.directory, name))
+            except OSError:
+                pass
+
+    def report(self, top_n: int = 20, slow_limit: int = 50) -> Dict[str, Any]:
+        """合并所有进程的统计，返回按总耗时排序的语句和最近的慢查询"""
+        self.flush(force=True)
+        merged: Dict[str, Dict[str, Any]] = {}
+        sources = set()
+        if os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == 'config.json':
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name), encoding='utf-8') as f:
+                        snapshot = json.load(f)
+                except (OSError, ValueError):
+                    continue
+                sources.add(snapshot.get('source', ''))
+                for stats in snapshot.get('stats', []):
+                    target = merged.get(stats['statement'])
+                    if target is None:
+                        merged[stats['statement']] = dict(stats)
+                        continue
+                    target['count'] += stats['count']
+                    target['total_ms'] += stats['total_ms']
+                    target['max_ms'] = max(target['max_ms'], stats['max_ms'])
+                    target['slow_count'] += stats['slow_count']
+                    if 'plan' in stats and 'plan' not in target:
+                        target['plan'] = stats['plan']
+                        target['full_scans'] = stats.get('full_scans', [])
+
+        top = sorted(merged.values(), key=lambda item: item['total_ms'], reverse=True)[:top_n]
+        for item in top:
+            if 'plan' not in item:
+                item['plan'] = explain_query_plan(item['statement'])
+                item['full_scans'] = find_full_scans(item['plan'])
+            item['avg_ms'] = round(item['total_ms'] / item['count'], 3) if item['count'] else 0.0
+            item['total_ms'] = round(item['total_ms'], 3)
+            item['max_ms'] = round(item['max_ms'], 3)
+
+        return {
+            'config': self.get_config(),
+            'sources': sorted(sources),
+            'statement_count': len(merged),
+            'top_statements': top,
+            'slow_queries': self._read_slow_log(slow_limit),
+        }
+
+    def _read_slow_log(self, limit: int) -> List[Dict[str, Any]]:
+        try:
+            with open(self.slow_log_path, encoding='utf-8') as f:
+                lines = f.readlines()[-limit:]
+        except OSError:
+            return []
+        entries = []
+        for line in reversed(lines):
+            try:
+                entries.append(json.loads(line))
+            except ValueError:
+                continue
+        return entries
+
+
+# 当前进程的分析器实例，由 install_query_profiler() 创建
+query_profiler: Optional[QueryProfiler] = None
+
+
+def install_query_profiler(source: str) -> QueryProfiler:
+    """注册为语句观察者；是否计时由共享配置或环境变量 QUERY_PROFILING=1 决定"""
+    from .database import add_query_listener
+
+    global query_profiler
+    if query_profiler is None:
+        query_profiler = QueryProfiler(source)
+        add_query_listener(query_profiler.record)
+    return query_profiler
@@ -0,0 +1,275 @@
+"""
+效果图渲染结果缓存
+以图案、产品、深度图的内容哈希加规范化的渲染参数作为键，将效果图缓存在磁盘上，按总大小LRU淘汰
+"""
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+RENDER_CACHE_DIR = os.path.join('instance', 'render_cache')
+RENDER_CACHE_MAX_BYTES = 512 * 1024 * 1024
+
+# 与 pattern_editor.js 中 state 的变换/混合参数保持一致，width/height 为输出尺寸，pixelRatio 为设备像素比
+DEFAULT_RENDER_PARAMS = {
+    'tx': 0.0, 'ty': 0.0, 'scale': 1.0,
+    'skewX': 0.0, 'skewY': 0.0,
+    'distortion': 0.3, 'perspective': 0.0,
+    'depthThreshold': 0.7, 'blendMode': 'normal', 'opacity': 1.0,
+    'width': 0, 'height': 0, 'pixelRatio': 1.0,
+}
+PARAM_PRECISION = 4
+
+
+def canonicalize_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """补全默认值、统一数值精度并丢弃无关字段，保证相同效果得到相同的键"""
+    params = params or {}
+    canonical = {}
+    for key, default in DEFAULT_RENDER_PARAMS.items():
+        value = params.get(key, default)
+        if key == 'blendMode':
+            value = str(value or default)
+        elif isinstance(default, int):
+            value = int(value or 0)
+        else:
+            value = round(float(value if value is not None else default), PARAM_PRECISION)
+            if value == 0:
+                value = 0.0
+        canonical[key] = value
+    return canonical
+
+
+_asset_hashes: Dict[str, Tuple[float, int, str]] = {}
+_asset_hash_lock = threading.Lock()
+
+
+def asset_hash(path: str) -> Optional[str]:
+    """计算素材文件内容哈希，按(修改时间, 大小)缓存避免重复读取"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    with _asset_hash_lock:
+        cached = _asset_hashes.get(path)
+        if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+            return cached[2]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    value = digest.hexdigest()
+
+    with _asset_hash_lock:
+        _asset_hashes[path] = (stat.st_mtime, stat.st_size, value)
+    return value
+
+
+def pattern_asset_path(pattern: Dict[str, Any]) -> str:
+    return os.path.join('uploads', 'patterns', pattern['filename'])
+
+
+def product_asset_paths(product: Dict[str, Any]) -> Tuple[str, str]:
+    return (os.path.join('uploads', 'products', product['product_image_path']),
+            os.path.join('uploads', 'depth_maps', product['depth_image_path']))
+
+
+def build_render_key(pattern: Optional[Dict[str, Any]], product: Dict[str, Any],
+                     params: Optional[Dict[str, Any]]) -> Optional[str]:
+    """根据素材内容和渲染参数生成缓存键，素材缺失时返回None"""
+    product_path, depth_path = product_asset_paths(product)
+    parts = {
+        'pattern': asset_hash(pattern_asset_path(pattern)) if pattern else '',
+        'product': asset_hash(product_path),
+        'depth': asset_hash(depth_path),
+        'params': canonicalize_params(params),
+    }
+    if not parts['product'] or (pattern and not parts['pattern']):
+        return None
+    payload = json.dumps(parts, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class RenderCache:
+    """磁盘LRU缓存，每个条目为 <key>.png 和记录来源的 <key>.json"""
+
+    def __init__(self, cache_dir: str = RENDER_CACHE_DIR, max_bytes: int = RENDER_CACHE_MAX_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._index: "OrderedDict[str, int]" = OrderedDict()
+        self._total_bytes = 0
+        self._loaded = False
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.puts = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _path(self, key: str, extension: str = '.png') -> str:
+        return os.path.join(self.cache_dir, key + extension)
+
+    def _load_index(self):
+        """首次使用时按文件修改时间重建LRU顺序"""
+        if self._loaded:
+            return
+        os.makedirs(self.cache_dir, exist_ok=True)
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.png'):
+                try:
+                    stat = os.stat(os.path.join(self.cache_dir, name))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, name[:-4], stat.st_size))
+        for _, key, size in sorted(entries):
+            self._index[key] = size
+            self._total_bytes += size
+        self._loaded = True
+
+    def contains(self, key: str) -> bool:
+        """检查条目是否存在（不计入命中统计）"""
+        return os.path.exists(self._path(key))
+
+    def get(self, key: str) -> Optional[bytes]:
+        """读取缓存的效果图"""
+        with self._lock:
+            self._load_index()
+        try:
+            with open(self._path(key), 'rb') as f:
+                data = f.read()
+        except OSError:
+            with self._lock:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+                self.misses += 1
+            return None
+
+        now = time.time()
+        try:
+            # 更新修改时间，其他进程重建索引时也能反映访问顺序
+            os.utime(self._path(key), (now, now))
+        except OSError:
+            pass
+        with self._lock:
+            if key not in self._index:
+                self._index[key] = len(data)
+                self._total_bytes += len(data)
+            self._index.move_to_end(key)
+            self.hits += 1
+        return data
+
+    def put(self, key: str, data: bytes, meta: Optional[Dict[str, Any]] = None):
+        """写入效果图，超过容量时淘汰最久未使用的条目"""
+        with self._lock:
+            self._load_index()
+        temp_path = self._path(key, f'.{os.getpid()}.{threading.get_ident()}.tmp')
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, self._path(key))
+        with open(self._path(key, '.json'), 'w', encoding='utf-8') as f:
+            json.dump(meta or {}, f, ensure_ascii=False)
+
+        with self._lock:
+            previous = self._index.pop(key, 0)
+            self._index[key] = len(data)
+            self._total_bytes += len(data) - previous
+            self.puts += 1
+            evicted = []
+            while self._total_bytes > self.max_bytes and len(self._index) > 1:
+                old_key, size = self._index.popitem(last=False)
+                self._total_bytes -= size
+                evicted.append(old_key)
+            self.evictions += len(evicted)
+        for old_key in evicted:
+            self._remove(old_key)
+
+    def _remove(self, key: str):
+        for extension in ('.png', '.json'):
+            try:
+                os.remove(self._path(key, extension))
+            except OSError:
+                pass
+
+    def invalidate(self, pattern_id: Optional[int] = None, product_id: Optional[int] = None) -> int:
+        """删除引用了指定图案或产品的缓存条目（扫描磁盘，其他进程写入的条目同样生效）"""
+        if pattern_id is None and product_id is None:
+            return 0
+        if not os.path.isdir(self.cache_dir):
+            return 0
+        removed = []
+        for name in os.listdir(self.cache_dir):
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.cache_dir, name), encoding='utf-8') as f:
+                    meta = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if ((pattern_id is not None and meta.get('pattern_id') == pattern_id) or
+                    (product_id is not None and meta.get('product_id') == product_id)):
+                removed.append(name[:-5])
+
+        for key in removed:
+            self._remove(key)
+        with self._lock:
+            for key in removed:
+                size = self._index.pop(key, None)
+                if size is not None:
+                    self._total_bytes -= size
+            self.invalidations += len(removed)
+        return len(removed)
+
+    def clear(self):
+        """清空缓存（扫描磁盘，其他进程写入的条目同样删除）"""
+        with self._lock:
+            self._index.clear()
+            self._total_bytes = 0
+            self._loaded = False
+        if not os.path.isdir(self.cache_dir):
+            return
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(('.png', '.json')):
+                self._remove(name.rsplit('.', 1)[0])
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中和容量统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'entries': len(self._index),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0,
+                'puts': self.puts,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations
+            }
+
+
+# 进程内共享的缓存实例
+render_cache = RenderCache()
+
+
+def invalidate_render_cache(pattern_id: Optional[int] = None, product_id: Optional[int] = None) -> int:
+    """素材被替换或删除后使相关缓存失效，失败不影响业务操作"""
+    try:
+        return render_cache.invalidate(pattern_id=int(pattern_id) if pattern_id is not None else None,
+                                       product_id=int(product_id) if product_id is not None else None)
+    except Exception as e:
+        print(f"清理渲染缓存失败: {e}")
+        return 0
+
+
+def clear_render_cache():
+    """图案或产品被清空后删除全部缓存，失败不影响业务操作"""
+    try:
+        render_cache.clear()
+    except Exception as e:
+        print(f"清理渲染缓存失败: {e}")
@@ -0,0 +1,155 @@
+"""
+请求耗时分解
+在请求范围内累计各阶段耗时（会话检查、数据库、模板渲染、JSON序列化、文件发送、图片处理等），
+以 Server-Timing 响应头输出，浏览器开发者工具可直接查看；可选按JSON行写入日志文件
+"""
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+# 各阶段在 Server-Timing 中的说明（响应头只能使用latin-1字符）
+SPAN_DESCRIPTIONS = {
+    'session': 'Session check',
+    'db': 'Database',
+    'tpl': 'Template render',
+    'json': 'JSON serialization',
+    'file': 'File send',
+    'image': 'Image processing',
+    'render': 'Effect render',
+}
+
+_log_lock = threading.Lock()
+
+
+def _spans() -> Optional[Dict[str, List[float]]]:
+    """当前请求的阶段累计 {名称: [耗时秒, 次数]}，不在请求中或未启用时返回None"""
+    from flask import g, has_request_context
+
+    if not has_request_context():
+        return None
+    return g.get('_timing_spans')
+
+
+def add_span(name: str, elapsed: float):
+    """把一段耗时计入当前请求"""
+    spans = _spans()
+    if spans is None:
+        return
+    span = spans.setdefault(name, [0.0, 0])
+    span[0] += elapsed
+    span[1] += 1
+
+
+@contextmanager
+def timing_span(name: str) -> Iterator[None]:
+    """统计代码块耗时，不在请求中（如线程池、命令行）时只执行不计时"""
+    if _spans() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        add_span(name, time.perf_counter() - started)
+
+
+def format_server_timing(spans: Dict[str, List[float]], total: float) -> str:
+    """生成 Server-Timing 头，如 db;dur=3.20;desc="Database x5" """
+    parts = []
+    for name, (elapsed, count) in spans.items():
+        description = SPAN_DESCRIPTIONS.get(name, name)
+        if count > 1:
+            description = f'{description} x{count}'
+        parts.append(f'{name};dur={elapsed * 1000:.2f};desc="{description}"')
+    parts.append(f'total;dur={total * 1000:.2f}')
+    return ', '.join(parts)
+
+
+def _record_query_span(operation: str, query: str, params: tuple, elapsed: float):
+    add_span('db', elapsed)
+
+
+def _write_log(path: str, entry: Dict):
+    line = json.dumps(entry, ensure_ascii=False) + '\n'
+    with _log_lock:
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            with open(path, 'a', encoding='utf-8') as f:
+                f.write(line)
+        except OSError as e:
+            print(f"写入请求耗时日志失败: {e}")
+
+
+def init_request_timing(app):
+    """
+    启用请求耗时分解，需在其他 before_request 之前调用以覆盖整个请求
+    app.config:
+        SERVER_TIMING            是否输出 Server-Timing 响应头（默认开启）
+        REQUEST_TIMING_LOG       JSON行日志文件路径，为空则不记录
+        REQUEST_TIMING_LOG_MIN_MS 只记录总耗时不低于该值的请求
+    """
+    from flask import g, request
+    from flask.json.provider import DefaultJSONProvider
+    from flask.signals import before_render_template, template_rendered
+    from .database import add_query_listener
+
+    app.config.setdefault('SERVER_TIMING', True)
+    app.config.setdefault('REQUEST_TIMING_LOG', None)
+    app.config.setdefault('REQUEST_TIMING_LOG_MIN_MS', 0)
+    add_query_listener(_record_query_span)
+
+    class TimedJSONProvider(DefaultJSONProvider):
+        """jsonify 序列化计入 json 阶段"""
+
+        def response(self, *args, **kwargs):
+            with timing_span('json'):
+                return super().response(*args, **kwargs)
+
+    app.json = TimedJSONProvider(app)
+
+    def on_before_render(sender, template, context, **extra):
+        g.setdefault('_timing_templates', []).append(time.perf_counter())
+
+    def on_rendered(sender, template, context, **extra):
+        starts = g.get('_timing_templates')
+        if starts:
+            add_span('tpl', time.perf_counter() - starts.pop())
+
+    # 接收函数是局部函数，需强引用，否则会被回收
+    before_render_template.connect(on_before_render, app, weak=False)
+    template_rendered.connect(on_rendered, app, weak=False)
+
+    @app.before_request
+    def start_request_timing():
+        g._timing_started = time.perf_counter()
+        g._timing_spans = {}
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.pop('_timing_started', None)
+        spans = g.pop('_timing_spans', None)
+        if started is None or spans is None:
+            return response
+        total = time.perf_counter() - started
+        if app.config['SERVER_TIMING']:
+            response.headers['Server-Timing'] = format_server_timing(spans, total)
+
+        log_path = app.config['REQUEST_TIMING_LOG']
+        if log_path and total * 1000 >= app.config['REQUEST_TIMING_LOG_MIN_MS']:
+            _write_log(log_path, {
+                'time': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'status': response.status_code,
+                'total_ms': round(total * 1000, 3),
+                'spans': {name: {'ms': round(elapsed * 1000, 3), 'count': count}
+                          for name, (elapsed, count) in spans.items()},
+            })
+        return response
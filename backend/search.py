@@ -0,0 +1,190 @@
+"""
+全文搜索
+基于 FTS5 trigram 索引搜索印花、产品、分类名称和归档登记信息，按 bm25 相关度排序并分页；
+trigram 分词至少需要3个字符，较短的关键词（如两个汉字）以及未启用FTS5时退回 LIKE 匹配
+"""
+import html
+import re
+from typing import Any, Dict, Iterable, List, Optional
+
+from .database import SEARCH_INDEXES, get_db_connection
+
+# 前台可搜索的类型（归档含登记人信息，只在后台搜索）
+FRONTEND_KINDS = ('pattern', 'product', 'pattern_category', 'product_category')
+ALL_KINDS = FRONTEND_KINDS + ('archive',)
+MAX_PER_PAGE = 50
+# trigram 分词能匹配的最短关键词长度
+MIN_FTS_TERM_LENGTH = 3
+
+# 各类型对应的表及结果列：title 为标题，detail 为补充信息，image 为图片路径
+_SOURCES = {
+    'pattern': {
+        'table': 'patterns',
+        'columns': '''p.id, p.name AS title, COALESCE(c.name, '') AS detail, p.file_path AS image''',
+        'joins': 'LEFT JOIN pattern_categories c ON p.category_id = c.id',
+    },
+    'product': {
+        'table': 'products',
+        'columns': '''p.id, p.title AS title, COALESCE(c.name, '') AS detail, p.product_image_path AS image''',
+        'joins': 'LEFT JOIN product_categories c ON p.category_id = c.id',
+    },
+    'pattern_category': {
+        'table': 'pattern_categories',
+        'columns': '''p.id, p.name AS title, COALESCE(p.description, '') AS detail, NULL AS image''',
+        'joins': '',
+    },
+    'product_category': {
+        'table': 'product_categories',
+        'columns': '''p.id, p.name AS title, '' AS detail, NULL AS image''',
+        'joins': '',
+    },
+    'archive': {
+        'table': 'product_archives',
+        'columns': '''p.id, COALESCE(NULLIF(p.register_info, ''), p.access_code) AS title,
+                      COALESCE(p.follow_up_person, '') || ' / ' || p.access_code || ' / ' || p.register_time AS detail,
+                      p.effect_image_path AS image''',
+        'joins': '',
+    },
+}
+
+_HIGHLIGHT_OPEN = '\x01'
+_HIGHLIGHT_CLOSE = '\x02'
+
+
+def parse_terms(query: str) -> List[str]:
+    """按空白拆分关键词（去重，保持顺序），多个关键词之间为“且”关系"""
+    terms = []
+    for term in (query or '').split():
+        term = term.strip()
+        if term and term.lower() not in (t.lower() for t in terms):
+            terms.append(term)
+    return terms[:8]
+
+
+def _fts_available(cursor, table_name: str) -> bool:
+    return cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                          (f'{table_name}_fts',)).fetchone() is not None
+
+
+def _fts_query(terms: Iterable[str]) -> str:
+    """每个关键词作为短语（转义双引号），避免用户输入被解析为FTS5语法"""
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def _source_sql(kind: str, terms: List[str], use_fts: bool, active_only: bool) -> tuple:
+    """单个类型的查询语句和参数，结果列为 type, id, title, detail, image, is_active, score（越小越相关）"""
+    source = _SOURCES[kind]
+    table_name = source['table']
+    columns = SEARCH_INDEXES[table_name]
+    conditions = []
+    params: List[Any] = [kind]
+    if use_fts:
+        fts_table = f'{table_name}_fts'
+        # 第一列（名称/标题/登记信息）权重更高
+        weights = ', '.join(['10.0'] + ['1.0'] * (len(columns) - 1))
+        score = f'bm25({fts_table}, {weights})'
+        joins = f'JOIN {fts_table} ON {fts_table}.rowid = p.id {source["joins"]}'
+        conditions.append(f'{fts_table} MATCH ?')
+        params.append(_fts_query(terms))
+    else:
+        # 完全相同 < 前缀匹配 < 包含
+        first = f"COALESCE(p.{columns[0]}, '')"
+        score = (f"CASE WHEN lower({first}) = lower(?) THEN 0 "
+                 f"WHEN instr(lower({first}), lower(?)) = 1 THEN 1 ELSE 2 END")
+        params = [kind, terms[0], terms[0]]
+        joins = source['joins']
+        text = " || ' ' || ".join(f"COALESCE(p.{column}, '')" for column in columns)
+        for term in terms:
+            conditions.append(f'instr(lower({text}), lower(?)) > 0')
+            params.append(term)
+    if active_only:
+        conditions.append('p.is_active = 1')
+    sql = f'''
+        SELECT ? AS type, {source["columns"]}, p.is_active AS is_active, {score} AS score
+        FROM {table_name} p {joins}
+        WHERE {" AND ".join(conditions)}
+    '''
+    return sql, params
+
+
+def highlight(text: Optional[str], terms: Iterable[str]) -> str:
+    """转义HTML后用 <mark> 标出关键词"""
+    text = text or ''
+    patterns = [re.escape(term) for term in sorted(terms, key=len, reverse=True) if term]
+    if patterns:
+        text = re.sub('|'.join(patterns), lambda m: f'{_HIGHLIGHT_OPEN}{m.group(0)}{_HIGHLIGHT_CLOSE}',
+                      text, flags=re.IGNORECASE)
+    return html.escape(text).replace(_HIGHLIGHT_OPEN, '<mark>').replace(_HIGHLIGHT_CLOSE, '</mark>')
+
+
+def search(query: str, kinds: Optional[Iterable[str]] = None, page: int = 1, per_page: int = 20,
+           active_only: bool = True) -> Dict[str, Any]:
+    """
+    搜索指定类型（默认前台可见的类型），返回 {items, total, page, per_page, mode}
+    items 中每项含 type, id, title, detail, image, is_active, score 以及高亮后的 title_html / detail_html；
+    active_only 为 False 时包含已停用的记录（后台使用）；
+    所有关键词都不少于3个字符且已建立FTS5索引时 mode 为 fts（按bm25排序），否则为 like
+    """
+    kinds = [kind for kind in (kinds or FRONTEND_KINDS) if kind in _SOURCES]
+    page = max(1, page)
+    per_page = max(1, min(per_page, MAX_PER_PAGE))
+    terms = parse_terms(query)
+    result = {'items': [], 'total': 0, 'page': page, 'per_page': per_page, 'mode': 'like', 'query': query or ''}
+    if not terms or not kinds:
+        return result
+
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        use_fts = (all(len(term) >= MIN_FTS_TERM_LENGTH for term in terms)
+                   and all(_fts_available(cursor, _SOURCES[kind]['table']) for kind in kinds))
+        parts = [_source_sql(kind, terms, use_fts, active_only) for kind in kinds]
+        union = ' UNION ALL '.join(sql for sql, _ in parts)
+        params = [param for _, source_params in parts for param in source_params]
+        result['mode'] = 'fts' if use_fts else 'like'
+        result['total'] = cursor.execute(f'SELECT COUNT(*) FROM ({union})', params).fetchone()[0]
+        rows = cursor.execute(f'SELECT * FROM ({union}) ORDER BY score, type, id DESC LIMIT ? OFFSET ?',
+                              params + [per_page, (page - 1) * per_page]).fetchall()
+    finally:
+        conn.close()
+
+    for row in rows:
+        item = dict(row)
+        item['title_html'] = highlight(item['title'], terms)
+        item['detail_html'] = highlight(item['detail'], terms)
+        result['items'].append(item)
+    return result
+
+
+def parse_kinds(value: Optional[str], allowed: Iterable[str]) -> List[str]:
+    """解析逗号分隔的类型参数，忽略不允许的类型；为空时返回全部允许的类型"""
+    allowed = list(allowed)
+    if not value:
+        return allowed
+    kinds = [kind.strip() for kind in value.split(',')]
+    return [kind for kind in kinds if kind in allowed] or allowed
+
+
+def search_request(args, allowed: Iterable[str], active_only: bool = True) -> Dict[str, Any]:
+    """
+    按请求参数搜索（q 为关键词，type 为逗号分隔的类型，page/per_page 分页），返回接口的JSON结构
+    args 为 request.args；前台只搜索启用中的记录，后台传 active_only=False
+    """
+    query = (args.get('q') or '').strip()
+    if not query:
+        return {'success': False, 'message': '请输入搜索关键词'}
+    try:
+        result = search(query, parse_kinds(args.get('type'), allowed),
+                        page=args.get('page', 1, type=int),
+                        per_page=args.get('per_page', 20, type=int),
+                        active_only=active_only)
+    except Exception as e:
+        return {'success': False, 'message': f'搜索失败: {str(e)}'}
+    return {
+        'success': True,
+        'data': result['items'],
+        'total': result['total'],
+        'page': result['page'],
+        'per_page': result['per_page'],
+        'mode': result['mode']
+    }
@@ -0,0 +1,362 @@
+"""
+效果图服务端渲染
+按 pattern_editor.js 片段着色器的同一套公式，用原始素材按任意分辨率重绘效果图，
+输出按行切分为图块，在线程池中并行计算（NumPy运算期间释放GIL）
+"""
+import hashlib
+import json
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, Dict, Optional, Tuple
+
+from .render_cache import PARAM_PRECISION, asset_hash, canonicalize_params
+from .request_timing import timing_span
+
+# 单次渲染的输出像素上限，防止请求过大的尺寸耗尽内存
+MAX_RENDER_PIXELS = 64_000_000
+# 前台访客提交的画布尺寸上限（与编辑器实际画布相当），更大的重绘只能在后台归档管理中进行
+VISITOR_MAX_LONG_EDGE = 4096
+VISITOR_MAX_PIXEL_RATIO = 4.0
+# 每个图块的像素数，决定单块的临时内存占用（约 像素数 x 200 字节）
+TILE_PIXELS = 512 * 1024
+# 前端未提供画布尺寸时使用的逻辑画布尺寸
+DEFAULT_CANVAS_SIZE = (1024, 768)
+
+# 与 pattern_editor.js 中 blendModes 的编号一致
+BLEND_MODES = ('normal', 'multiply', 'screen', 'overlay', 'darken', 'lighten',
+               'color-dodge', 'color-burn', 'soft-light', 'hard-light', 'hologram')
+
+
+class RenderError(Exception):
+    """效果图无法渲染"""
+
+
+def build_recipe(pattern: Optional[Dict[str, Any]], product: Dict[str, Any],
+                 params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """生成归档保存的渲染配方：素材ID、图案文件名和规范化后的全部参数"""
+    return {
+        'pattern_id': pattern['id'] if pattern else None,
+        'pattern_file': pattern['filename'] if pattern else '',
+        'product_id': product['id'],
+        'params': canonicalize_params(params),
+    }
+
+
+def limit_visitor_params(params: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    规范化前台提交的渲染参数，并把画布尺寸和设备像素比限制在编辑器的实际范围内
+    超出时按比例缩小画布像素尺寸和像素比，保持逻辑画布尺寸（即效果图构图）不变
+    参数不是数值时抛出 ValueError
+    """
+    if params is not None and not isinstance(params, dict):
+        raise ValueError('渲染参数格式错误')
+    try:
+        params = canonicalize_params(params)
+    except (TypeError, OverflowError) as e:
+        raise ValueError(str(e))
+    ratio = params['pixelRatio']
+    if not math.isfinite(ratio) or ratio <= 0:
+        ratio = 1.0
+    ratio = min(ratio, VISITOR_MAX_PIXEL_RATIO)
+    width, height = max(0, params['width']), max(0, params['height'])
+    long_edge = max(width, height)
+    if long_edge > VISITOR_MAX_LONG_EDGE:
+        factor = VISITOR_MAX_LONG_EDGE / long_edge
+        width, height = round(width * factor), round(height * factor)
+        ratio = round(ratio * factor, PARAM_PRECISION) or 1.0
+    params.update(width=width, height=height, pixelRatio=ratio)
+    return params
+
+
+def parse_recipe(text: Optional[str]) -> Optional[Dict[str, Any]]:
+    """读取归档中保存的配方，旧归档或内容损坏时返回None"""
+    if not text:
+        return None
+    try:
+        recipe = json.loads(text)
+    except ValueError:
+        return None
+    if not isinstance(recipe, dict) or 'params' not in recipe:
+        return None
+    recipe['params'] = canonicalize_params(recipe['params'])
+    return recipe
+
+
+def logical_canvas_size(params: Dict[str, Any]) -> Tuple[float, float]:
+    """着色器中的 uCanvasSize 为CSS像素，由输出像素除以设备像素比得到"""
+    ratio = params.get('pixelRatio') or 1.0
+    width, height = params.get('width') or 0, params.get('height') or 0
+    if width <= 0 or height <= 0:
+        return DEFAULT_CANVAS_SIZE
+    return width / ratio, height / ratio
+
+
+def _load_texture(path: Optional[str], mode: str):
+    """读取素材为 float32 数组（值域0~1），深度图只取单通道"""
+    import numpy as np
+    from PIL import Image
+
+    if not path:
+        return None
+    try:
+        with Image.open(path) as image:
+            image.load()
+            if mode == 'depth':
+                if image.mode in ('I', 'I;16', 'I;16B', 'I;16L'):
+                    array = np.asarray(image, dtype=np.float32) / 65535.0
+                else:
+                    # 与着色器读取 .r 一致
+                    array = np.asarray(image.convert('RGB'), dtype=np.float32)[..., 0] / 255.0
+                return np.clip(array, 0.0, 1.0)
+            return np.asarray(image.convert('RGBA'), dtype=np.float32) / 255.0
+    except FileNotFoundError:
+        raise RenderError(f'素材文件不存在: {os.path.basename(path)}')
+    except OSError:
+        raise RenderError(f'素材文件无法读取: {os.path.basename(path)}')
+
+
+def _sample(texture, u, v):
+    """双线性采样，纹理坐标原点在左下角（纹理 flipY），边缘钳制"""
+    import numpy as np
+
+    height, width = texture.shape[:2]
+    x = np.clip(u * width - 0.5, 0, width - 1)
+    y = np.clip((1.0 - v) * height - 0.5, 0, height - 1)
+    x0 = np.floor(x).astype(np.int32)
+    y0 = np.floor(y).astype(np.int32)
+    x1 = np.minimum(x0 + 1, width - 1)
+    y1 = np.minimum(y0 + 1, height - 1)
+    fx = x - x0
+    fy = y - y0
+    if texture.ndim == 3:
+        fx = fx[..., None]
+        fy = fy[..., None]
+    top = texture[y0, x0] * (1 - fx) + texture[y0, x1] * fx
+    bottom = texture[y1, x0] * (1 - fx) + texture[y1, x1] * fx
+    return top * (1 - fy) + bottom * fy
+
+
+def _blend(mode: str, b, s):
+    import numpy as np
+
+    if mode == 'multiply':
+        return b * s
+    if mode == 'screen':
+        return 1.0 - (1.0 - b) * (1.0 - s)
+    if mode in ('overlay', 'hard-light'):
+        # 着色器中两者都按图案颜色分段
+        return np.where(s <= 0.5, 2.0 * b * s, 1.0 - 2.0 * (1.0 - b) * (1.0 - s))
+    if mode == 'darken':
+        return np.minimum(b, s)
+    if mode == 'lighten':
+        return np.maximum(b, s)
+    if mode == 'color-dodge':
+        return b / (1.0 - s + 0.001)
+    if mode == 'color-burn':
+        return 1.0 - (1.0 - b) / (s + 0.001)
+    if mode == 'soft-light':
+        return np.where(s <= 0.5, 2.0 * b * s + b * b * (1.0 - 2.0 * s),
+                        np.sqrt(b) * (2.0 * s - 1.0) + 2.0 * b * (1.0 - s))
+    if mode == 'hologram':
+        hue = np.mod(s[..., 0:1] * 6.0, 1.0)
+        rainbow = np.concatenate([
+            np.abs(hue * 6.0 - 3.0) - 1.0,
+            2.0 - np.abs(hue * 6.0 - 2.0),
+            2.0 - np.abs(hue * 6.0 - 4.0),
+        ], axis=-1)
+        rainbow = np.clip(rainbow, 0.0, 1.0)
+        return b + (rainbow * s - b) * 0.7
+    return s
+
+
+class EffectRenderer:
+    """持有已解码的素材和参数，render() 按输出尺寸并行计算所有图块"""
+
+    def __init__(self, product_path: str, depth_path: Optional[str], pattern_path: Optional[str],
+                 params: Optional[Dict[str, Any]], max_workers: Optional[int] = None):
+        try:
+            import numpy  # noqa: F401
+        except ImportError:
+            raise RenderError('服务端渲染需要安装 numpy')
+
+        self.params = canonicalize_params(params)
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.product = _load_texture(product_path, 'rgba')
+        depth = _load_texture(depth_path, 'depth') if depth_path and os.path.exists(depth_path) else None
+        # 与前端一致：缺少深度图时用产品图代替
+        self.depth = depth if depth is not None else self.product[..., 0]
+        self.pattern = _load_texture(pattern_path, 'rgba') if pattern_path else None
+        self.canvas_size = logical_canvas_size(self.params)
+
+    def product_rect(self) -> Tuple[float, float, float, float]:
+        """产品图在画布 vUv 空间中的范围 (u0, v0, u1, v1)，与着色器中的等比适配一致"""
+        canvas_w, canvas_h = self.canvas_size
+        product_h, product_w = self.product.shape[:2]
+        canvas_aspect = (canvas_w / max(canvas_w, canvas_h), canvas_h / max(canvas_w, canvas_h))
+        product_aspect = (product_w / max(product_w, product_h), product_h / max(product_w, product_h))
+        scale = min(canvas_aspect[0] / product_aspect[0], canvas_aspect[1] / product_aspect[1])
+        scaled = (product_aspect[0] * scale, product_aspect[1] * scale)
+        offset = ((canvas_aspect[0] - scaled[0]) * 0.5, (canvas_aspect[1] - scaled[1]) * 0.5)
+        return (offset[0] / canvas_aspect[0], offset[1] / canvas_aspect[1],
+                (offset[0] + scaled[0]) / canvas_aspect[0], (offset[1] + scaled[1]) / canvas_aspect[1])
+
+    def output_size(self, long_edge: Optional[int] = None, crop_to_product: bool = False) -> Tuple[int, int]:
+        """
+        计算输出像素尺寸
+        裁剪到产品区域时默认使用产品原图分辨率，否则默认使用归档时的画布像素尺寸
+        """
+        if crop_to_product:
+            u0, v0, u1, v1 = self.product_rect()
+            canvas_w, canvas_h = self.canvas_size
+            aspect = ((u1 - u0) * canvas_w) / max((v1 - v0) * canvas_h, 1e-6)
+            default_long = max(self.product.shape[:2])
+        else:
+            canvas_w, canvas_h = self.canvas_size
+            aspect = canvas_w / canvas_h
+            default_long = max(self.params['width'], self.params['height']) or max(DEFAULT_CANVAS_SIZE)
+        long_edge = int(long_edge or default_long)
+        if aspect >= 1:
+            width, height = long_edge, max(1, round(long_edge / aspect))
+        else:
+            width, height = max(1, round(long_edge * aspect)), long_edge
+        if width * height > MAX_RENDER_PIXELS:
+            raise RenderError(f'输出尺寸过大（{width}x{height}）')
+        return width, height
+
+    def render(self, width: int, height: int, crop_to_product: bool = False):
+        """渲染为 (height, width, 4) 的 uint8 数组"""
+        import numpy as np
+
+        if width <= 0 or height <= 0 or width * height > MAX_RENDER_PIXELS:
+            raise RenderError(f'输出尺寸无效（{width}x{height}）')
+        bounds = self.product_rect() if crop_to_product else (0.0, 0.0, 1.0, 1.0)
+        output = np.zeros((height, width, 4), dtype=np.uint8)
+        rows_per_tile = max(1, TILE_PIXELS // width)
+        tiles = [(top, min(top + rows_per_tile, height)) for top in range(0, height, rows_per_tile)]
+
+        def render_tile(tile):
+            top, bottom = tile
+            output[top:bottom] = self._render_rows(top, bottom, width, height, bounds)
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            list(executor.map(render_tile, tiles))
+        return output
+
+    def _render_rows(self, top: int, bottom: int, width: int, height: int, bounds):
+        """计算输出图像 [top, bottom) 行，逐像素对应着色器 main()"""
+        import numpy as np
+
+        p = self.params
+        canvas_w, canvas_h = self.canvas_size
+        u0, v0, u1, v1 = bounds
+
+        # 输出像素中心对应的画布 vUv（第0行在画布顶部，即 vUv.y 最大处）
+        xs = (np.arange(width, dtype=np.float32) + 0.5) / width
+        ys = (np.arange(top, bottom, dtype=np.float32) + 0.5) / height
+        vu, vv = np.meshgrid(u0 + xs * (u1 - u0), v1 - ys * (v1 - v0))
+
+        pu0, pv0, pu1, pv1 = self.product_rect()
+        product_u = (vu - pu0) / (pu1 - pu0)
+        product_v = (vv - pv0) / (pv1 - pv0)
+        inside = (product_u >= 0) & (product_u <= 1) & (product_v >= 0) & (product_v <= 1)
+
+        base = _sample(self.product, product_u, product_v)
+        depth = _sample(self.depth, product_u, product_v)
+
+        feather = 2.0 / min(canvas_w, canvas_h)
+        edge0, edge1 = p['depthThreshold'] - feather, p['depthThreshold'] + feather
+        t = np.clip((depth - edge0) / (edge1 - edge0), 0.0, 1.0)
+        mask = t * t * (3.0 - 2.0 * t)
+
+        result = base.copy()
+        result[~inside] = 0.0
+        if self.pattern is not None:
+            self._apply_pattern(result, base, depth, mask, inside & (mask >= 0.01),
+                                vu, vv, product_u, product_v)
+
+        return np.clip(result * 255.0 + 0.5, 0, 255).astype(np.uint8)
+
+    def _apply_pattern(self, result, base, depth, mask, active, vu, vv, product_u, product_v):
+        import numpy as np
+
+        if not active.any():
+            return
+        p = self.params
+        canvas_w, canvas_h = self.canvas_size
+        depth = depth[active]
+        pu, pv = product_u[active], product_v[active]
+        screen_x, screen_y = vu[active] * canvas_w, vv[active] * canvas_h
+
+        # 位移扭曲：深度梯度 x 扭曲强度
+        texel_x, texel_y = 1.0 / canvas_w, 1.0 / canvas_h
+        grad_x = _sample(self.depth, pu + texel_x, pv) - _sample(self.depth, pu - texel_x, pv)
+        grad_y = _sample(self.depth, pu, pv + texel_y) - _sample(self.depth, pu, pv - texel_y)
+        strength = p['distortion'] * np.power(depth, 0.7) * 200.0
+        displaced_x, displaced_y = screen_x + grad_x * strength, screen_y + grad_y * strength
+
+        # 透视扭曲：以画布中心按深度缩放
+        center_x, center_y = canvas_w * 0.5, canvas_h * 0.5
+        factor = np.maximum(0.1, 1.0 + (depth - 0.5) * p['perspective'])
+        perspective_x = center_x + (displaced_x - center_x) * factor
+        perspective_y = center_y + (displaced_y - center_y) * factor
+        w_pers = p['perspective'] / (p['distortion'] + p['perspective'] + 0.001)
+        warped_x = displaced_x + (perspective_x - displaced_x) * w_pers
+        warped_y = displaced_y + (perspective_y - displaced_y) * w_pers
+
+        # 逆变换到图案像素坐标，uTransform = [scale, skewX, skewY, scale]（列主序）
+        tx = warped_x - center_x - p['tx']
+        ty = warped_y - center_y - p['ty']
+        m00, m01, m10, m11 = p['scale'], p['skewX'], p['skewY'], p['scale']
+        det = max(m00 * m11 - m01 * m10, 1e-6)
+        pattern_x = (m11 * tx - m10 * ty) / det
+        pattern_y = (-m01 * tx + m00 * ty) / det
+
+        pattern_h, pattern_w = self.pattern.shape[:2]
+        pat_u = (pattern_x + 0.5 * pattern_w) / pattern_w
+        pat_v = (pattern_y + 0.5 * pattern_h) / pattern_h
+        on_pattern = (pat_u >= 0) & (pat_u <= 1) & (pat_v >= 0) & (pat_v <= 1)
+        if not on_pattern.any():
+            return
+
+        pat = _sample(self.pattern, pat_u[on_pattern], pat_v[on_pattern])
+        b = base[active][on_pattern][:, :3]
+        alpha = (pat[:, 3] * p['opacity'] * mask[active][on_pattern])[:, None]
+        blended = b + (_blend(p['blendMode'], b, pat[:, :3]) - b) * alpha
+
+        rows, cols = np.nonzero(active)
+        result[rows[on_pattern], cols[on_pattern], :3] = blended
+
+
+def encode_png(array) -> bytes:
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.fromarray(array, 'RGBA').save(buffer, 'PNG')
+    return buffer.getvalue()
+
+
+@timing_span('render')
+def render_recipe(recipe: Dict[str, Any], product_path: str, depth_path: Optional[str],
+                  pattern_path: Optional[str], long_edge: Optional[int] = None,
+                  crop_to_product: bool = False, max_workers: Optional[int] = None) -> bytes:
+    """按配方渲染效果图并编码为PNG"""
+    renderer = EffectRenderer(product_path, depth_path, pattern_path, recipe.get('params'), max_workers)
+    width, height = renderer.output_size(long_edge, crop_to_product)
+    return encode_png(renderer.render(width, height, crop_to_product))
+
+
+def recipe_render_key(recipe: Dict[str, Any], paths: Tuple[Optional[str], ...],
+                      long_edge: Optional[int], crop_to_product: bool) -> Optional[str]:
+    """重绘结果的缓存键：素材内容哈希 + 配方参数 + 输出规格"""
+    hashes = [asset_hash(path) if path else '' for path in paths]
+    if not hashes[0]:
+        return None
+    payload = json.dumps({
+        'assets': hashes,
+        'params': canonicalize_params(recipe.get('params')),
+        'long_edge': long_edge or 0,
+        'crop': bool(crop_to_product),
+    }, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode()).hexdigest()
@@ -0,0 +1,280 @@
+"""
+前台在线会话登记
+当前会话保存在进程内存中，每个请求的会话检查和活动时间更新不再访问数据库；
+活动时间、登出和空闲超时由后台线程定期批量写回 access_logs，同时与数据库核对，
+移除在其他进程中结束（如后台强制登出）的会话。启动时从数据库重建。
+每次同步后把会话快照写入 instance/live_sessions/<pid>.json，后台仪表盘和指标合并各进程快照得到在线人数，
+长时间未更新的快照视为进程已退出
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from .database import DatabaseManager, get_db_connection
+
+SESSIONS_DIR = os.path.join('instance', 'live_sessions')
+# 写回数据库和核对会话的间隔（秒），也是后台强制登出在前台生效的最长延迟
+DEFAULT_SYNC_INTERVAL = 2
+# 最近多长时间内有活动的会话计为在线（秒）
+ONLINE_WINDOW = 5 * 60
+# 快照超过若干个同步间隔（且不少于最短时间）未更新，视为进程已退出
+STALE_SYNC_INTERVALS = 5
+MIN_STALE_SECONDS = 30
+TIME_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+def _format_time(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime(TIME_FORMAT)
+
+
+def _parse_time(value: Any) -> float:
+    try:
+        return datetime.strptime(str(value)[:19], TIME_FORMAT).timestamp()
+    except (TypeError, ValueError):
+        return time.time()
+
+
+class LiveSessionRegistry:
+    """进程内的在线会话表：session_id -> {id, access_code, last_activity}"""
+
+    def __init__(self, directory: str = SESSIONS_DIR):
+        self.directory = directory
+        self.sync_interval = DEFAULT_SYNC_INTERVAL
+        # 空闲超过该秒数的会话自动登出，None 表示不自动登出
+        self.idle_timeout: Optional[float] = None
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, Any]] = {}
+        self._dirty = set()
+        self._pending_logouts: Dict[str, str] = {}
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def load(self):
+        """从数据库重建在线会话"""
+        rows = DatabaseManager.execute_query(
+            "SELECT id, session_id, access_code, last_activity FROM access_logs WHERE is_active = 1")
+        with self._lock:
+            self._sessions = {
+                row['session_id']: {'id': row['id'], 'access_code': row['access_code'],
+                                    'last_activity': _parse_time(row['last_activity'])}
+                for row in rows
+            }
+            self._dirty.clear()
+
+    def start(self):
+        """重建会话并启动同步线程（重复调用无副作用）"""
+        if self._thread is not None and self._thread.is_alive():
+            return
+        self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='live-session-sync', daemon=True)
+        self._thread.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        """停止同步线程并写回未保存的变更"""
+        self._stop.set()
+        try:
+            self.sync()
+        except Exception as e:
+            print(f"保存在线会话失败: {e}")
+        # 会话已写回数据库，进程退出后不再计入在线人数
+        try:
+            os.remove(self._snapshot_path())
+        except OSError:
+            pass
+
+    def _run(self):
+        while not self._stop.wait(self.sync_interval):
+            try:
+                self.sync()
+            except Exception as e:
+                print(f"同步在线会话失败: {e}")
+
+    def register(self, session_id: str, log_id: int, access_code: str):
+        """登录后登记会话（访问记录已写入数据库）"""
+        with self._lock:
+            self._sessions[session_id] = {'id': log_id, 'access_code': access_code, 'last_activity': time.time()}
+
+    def is_active(self, session_id: str) -> bool:
+        """会话是否在线；不在内存中的会话（其他进程登录）回查一次数据库"""
+        with self._lock:
+            if session_id in self._sessions:
+                return True
+            if session_id in self._pending_logouts:
+                return False
+        rows = DatabaseManager.execute_query(
+            "SELECT id, access_code, last_activity FROM access_logs WHERE session_id = ? AND is_active = 1",
+            (session_id,))
+        if not rows:
+            return False
+        with self._lock:
+            self._sessions.setdefault(session_id, {'id': rows[0]['id'], 'access_code': rows[0]['access_code'],
+                                                   'last_activity': _parse_time(rows[0]['last_activity'])})
+        return True
+
+    def touch(self, session_id: str):
+        """记录会话活动，下次同步时写回数据库"""
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is not None:
+                entry['last_activity'] = time.time()
+                self._dirty.add(session_id)
+
+    def logout(self, session_id: str) -> bool:
+        """登出会话（不在内存中的会话同样写回数据库），重复登出时返回 False"""
+        with self._lock:
+            self._sessions.pop(session_id, None)
+            self._dirty.discard(session_id)
+            if session_id in self._pending_logouts:
+                return False
+            self._pending_logouts[session_id] = _format_time(time.time())
+            return True
+
+    def count(self, within: Optional[float] = None) -> int:
+        """在线会话数，within 为秒数时只统计该时间内有活动的会话"""
+        with self._lock:
+            if within is None:
+                return len(self._sessions)
+            threshold = time.time() - within
+            return sum(1 for entry in self._sessions.values() if entry['last_activity'] >= threshold)
+
+    def idle_sessions(self, timeout: float) -> List[str]:
+        """空闲超过 timeout 秒的会话"""
+        threshold = time.time() - timeout
+        with self._lock:
+            return [session_id for session_id, entry in self._sessions.items()
+                    if entry['last_activity'] < threshold]
+
+    def sync(self):
+        """写回活动时间和登出，处理空闲超时，并移除已在其他进程中结束的会话"""
+        from .access_events import publish_access_event
+
+        with self._sync_lock:
+            expired = []
+            if self.idle_timeout:
+                idle = self.idle_sessions(self.idle_timeout)
+                with self._lock:
+                    for session_id in idle:
+                        entry = self._sessions.pop(session_id, None)
+                        if entry is None:
+                            continue
+                        self._dirty.discard(session_id)
+                        # 空闲登出的时间记为最后活动时间
+                        self._pending_logouts[session_id] = _format_time(entry['last_activity'])
+                        expired.append(session_id)
+
+            with self._lock:
+                activity = [(_format_time(self._sessions[session_id]['last_activity']), session_id)
+                            for session_id in self._dirty if session_id in self._sessions]
+                logouts = [(logout_time, session_id) for session_id, logout_time in self._pending_logouts.items()]
+                self._dirty.clear()
+                self._pending_logouts.clear()
+                known = set(self._sessions)
+
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                if activity:
+                    cursor.executemany(
+                        "UPDATE access_logs SET last_activity = ? WHERE session_id = ? AND is_active = 1", activity)
+                if logouts:
+                    cursor.executemany('''
+                        UPDATE access_logs
+                        SET is_active = 0, logout_time = ?
+                        WHERE session_id = ? AND is_active = 1
+                    ''', logouts)
+                if activity or logouts:
+                    conn.commit()
+                active = {row['session_id'] for row in cursor.execute(
+                    "SELECT session_id FROM access_logs WHERE is_active = 1").fetchall()}
+            except Exception:
+                # 写回失败时保留变更，下次重试
+                with self._lock:
+                    for _, session_id in activity:
+                        if session_id in self._sessions:
+                            self._dirty.add(session_id)
+                    for logout_time, session_id in logouts:
+                        self._pending_logouts.setdefault(session_id, logout_time)
+                raise
+            finally:
+                conn.close()
+
+            with self._lock:
+                for session_id in known - active:
+                    self._sessions.pop(session_id, None)
+                    self._dirty.discard(session_id)
+                snapshot = {session_id: [entry['access_code'], entry['last_activity']]
+                            for session_id, entry in self._sessions.items()}
+
+            for session_id in expired:
+                publish_access_event('logout', {'session_id': session_id, 'reason': 'idle'})
+            self._write_snapshot(snapshot)
+
+    def _snapshot_path(self) -> str:
+        return os.path.join(self.directory, f'{os.getpid()}.json')
+
+    def _write_snapshot(self, sessions: Dict[str, list]):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._snapshot_path()
+        temp_path = f'{path}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'pid': os.getpid(), 'updated': time.time(), 'sync_interval': self.sync_interval,
+                       'sessions': sessions}, f)
+        os.replace(temp_path, path)
+
+
+live_sessions = LiveSessionRegistry()
+
+
+def _snapshot_stale(snapshot: Dict[str, Any], now: float) -> bool:
+    """同步线程每个间隔都会重写快照，长时间未更新说明进程已退出"""
+    interval = snapshot.get('sync_interval') or DEFAULT_SYNC_INTERVAL
+    return now - snapshot.get('updated', 0) > max(interval * STALE_SYNC_INTERVALS, MIN_STALE_SECONDS)
+
+
+def live_session_count(within: Optional[float] = ONLINE_WINDOW, directory: str = SESSIONS_DIR) -> int:
+    """合并各前台进程的会话快照得到在线人数（不查询数据库），可在任意进程调用"""
+    if not os.path.isdir(directory):
+        return 0
+    now = time.time()
+    threshold = now - within if within is not None else None
+    online = set()
+    for name in os.listdir(directory):
+        if not name.endswith('.json'):
+            continue
+        path = os.path.join(directory, name)
+        try:
+            with open(path, encoding='utf-8') as f:
+                snapshot = json.load(f)
+        except (OSError, ValueError):
+            continue
+        if _snapshot_stale(snapshot, now):
+            # 已退出进程的快照
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            continue
+        for session_id, (_, last_activity) in snapshot.get('sessions', {}).items():
+            if threshold is None or last_activity >= threshold:
+                online.add(session_id)
+    return len(online)
+
+
+def init_session_registry(app) -> LiveSessionRegistry:
+    """
+    为前台应用启用在线会话登记
+    app.config['SESSION_SYNC_INTERVAL'] 为写回间隔（秒），SESSION_IDLE_TIMEOUT 为空闲自动登出秒数（None 不登出）
+    """
+    app.config.setdefault('SESSION_SYNC_INTERVAL', DEFAULT_SYNC_INTERVAL)
+    app.config.setdefault('SESSION_IDLE_TIMEOUT', None)
+    live_sessions.sync_interval = app.config['SESSION_SYNC_INTERVAL']
+    live_sessions.idle_timeout = app.config['SESSION_IDLE_TIMEOUT']
+    live_sessions.start()
+    return live_sessions
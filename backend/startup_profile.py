@@ -0,0 +1,128 @@
+"""
+启动耗时分析
+通过 --profile-startup 启动参数统计模块导入和各初始化阶段的耗时
+"""
+import importlib.abc
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, List
+
+
+class _TimedLoader(importlib.abc.Loader):
+    """包装原始加载器，记录模块执行耗时"""
+
+    def __init__(self, profiler, loader):
+        self._profiler = profiler
+        self._loader = loader
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        self._profiler._enter(module.__name__)
+        try:
+            self._loader.exec_module(module)
+        finally:
+            self._profiler._exit(module.__name__)
+
+    def __getattr__(self, name):
+        return getattr(self._loader, name)
+
+
+class StartupProfiler(importlib.abc.MetaPathFinder):
+    """统计导入耗时（含自身耗时和累计耗时）以及初始化阶段耗时"""
+
+    def __init__(self):
+        self.enabled = False
+        self.started_at = time.perf_counter()
+        self.imports: Dict[str, Dict[str, float]] = {}
+        self.phases: List[tuple] = []
+        self._stack: List[list] = []
+        self._finding = set()
+
+    def install(self):
+        """安装导入钩子，需在其他模块导入前调用"""
+        if not self.enabled:
+            self.enabled = True
+            self.started_at = time.perf_counter()
+            sys.meta_path.insert(0, self)
+
+    def uninstall(self):
+        """移除导入钩子"""
+        if self in sys.meta_path:
+            sys.meta_path.remove(self)
+
+    def find_spec(self, fullname, path=None, target=None):
+        if fullname in self._finding:
+            return None
+        self._finding.add(fullname)
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    if spec.loader is not None and hasattr(spec.loader, 'exec_module'):
+                        spec.loader = _TimedLoader(self, spec.loader)
+                    return spec
+            return None
+        finally:
+            self._finding.discard(fullname)
+
+    def _enter(self, name: str):
+        self._stack.append([name, time.perf_counter(), 0.0])
+
+    def _exit(self, name: str):
+        _, started, children = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        self.imports[name] = {'cumulative': elapsed, 'self': elapsed - children}
+        if self._stack:
+            self._stack[-1][2] += elapsed
+
+    @contextmanager
+    def phase(self, name: str):
+        """记录一个初始化阶段的耗时"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - started))
+
+    def report(self, top: int = 20) -> str:
+        """生成启动耗时报告"""
+        total = time.perf_counter() - self.started_at
+        lines = ["=" * 60, f"⏱  启动耗时分析（总计 {total * 1000:.1f} ms）", "=" * 60]
+
+        if self.phases:
+            lines.append("初始化阶段:")
+            for name, elapsed in self.phases:
+                lines.append(f"   {elapsed * 1000:8.1f} ms  {name}")
+
+        if self.imports:
+            # 按顶层包汇总自身耗时
+            packages: Dict[str, float] = {}
+            for name, timing in self.imports.items():
+                package = name.split('.')[0]
+                packages[package] = packages.get(package, 0.0) + timing['self']
+            lines.append("-" * 60)
+            lines.append(f"导入耗时最高的包（共导入 {len(self.imports)} 个模块）:")
+            for package, elapsed in sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]:
+                lines.append(f"   {elapsed * 1000:8.1f} ms  {package}")
+
+        lines.append("=" * 60)
+        return "\n".join(lines)
+
+
+# 进程内共享的分析器实例
+startup_profiler = StartupProfiler()
+
+
+@contextmanager
+def startup_phase(name: str):
+    """未启用分析时不产生额外开销的阶段计时"""
+    if not startup_profiler.enabled:
+        yield
+        return
+    with startup_profiler.phase(name):
+        yield
@@ -0,0 +1,211 @@
+"""
+上传文件回收
+后台删除图案、产品、背景图和归档时只把文件放入删除队列，由后台线程删除，请求立即返回；
+孤儿扫描把各上传目录中的文件与数据库记录对照，统计（或删除）没有任何记录引用的文件，
+兜底处理替换图片时遗留的旧文件和队列中未来得及删除的文件
+"""
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Dict, Iterable, Optional, Set
+
+from .database import get_db_connection
+
+UPLOAD_ROOT = 'uploads'
+REPORT_DIR = os.path.join('instance', 'storage_reaper')
+# 只扫描这些目录（uploads/originals 等不由数据库记录引用的目录不参与）
+SCANNED_DIRS = ('patterns', 'products', 'depth_maps', 'themes_bgs', 'archives')
+# 修改时间在该秒数之内的文件不视为孤儿，避免误删正在上传、尚未写入数据库的文件
+DEFAULT_MIN_AGE = 3600
+
+_queue: "queue.Queue[str]" = queue.Queue()
+_worker: Optional[threading.Thread] = None
+_worker_lock = threading.Lock()
+_stats = {'queued': 0, 'deleted': 0, 'deleted_bytes': 0, 'failed': 0}
+
+
+def upload_path(directory: str, stored_path: str) -> Optional[str]:
+    """
+    把数据库中保存的文件名或路径转换为 uploads/<directory>/<文件名>
+    历史记录可能是Windows路径或 /uploads/ 开头的URL，统一按文件名定位
+    """
+    if not stored_path:
+        return None
+    filename = os.path.basename(str(stored_path).replace('\\', '/'))
+    if not filename or filename in ('.', '..'):
+        return None
+    return os.path.join(UPLOAD_ROOT, directory, filename)
+
+
+def _run_worker():
+    while True:
+        path = _queue.get()
+        try:
+            size = os.path.getsize(path)
+            os.remove(path)
+            _stats['deleted'] += 1
+            _stats['deleted_bytes'] += size
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            _stats['failed'] += 1
+            print(f"删除文件失败 {path}: {e}")
+        finally:
+            _queue.task_done()
+
+
+def schedule_delete(directory: str, stored_paths: Iterable[str]) -> int:
+    """把文件放入删除队列，返回入队数量；应在数据库记录删除或替换成功之后调用"""
+    global _worker
+    count = 0
+    for stored_path in stored_paths:
+        path = upload_path(directory, stored_path)
+        if path:
+            _queue.put(path)
+            count += 1
+    if count:
+        with _worker_lock:
+            _stats['queued'] += count
+            if _worker is None or not _worker.is_alive():
+                _worker = threading.Thread(target=_run_worker, name='storage-reaper', daemon=True)
+                _worker.start()
+    return count
+
+
+def wait_for_deletes(timeout: Optional[float] = None) -> bool:
+    """等待删除队列清空（扫描前调用，避免把排队中的文件算作孤儿），超时返回 False"""
+    deadline = None if timeout is None else time.monotonic() + timeout
+    while _queue.unfinished_tasks:
+        if deadline is not None and time.monotonic() > deadline:
+            return False
+        time.sleep(0.05)
+    return True
+
+
+def reaper_stats() -> Dict[str, int]:
+    return dict(_stats, pending=_queue.unfinished_tasks)
+
+
+def referenced_files() -> Dict[str, Set[str]]:
+    """各上传目录中被数据库记录引用的文件名（包含已停用的记录）"""
+    references = {directory: set() for directory in SCANNED_DIRS}
+
+    def add(directory: str, *values):
+        for value in values:
+            if value:
+                references[directory].add(os.path.basename(str(value).replace('\\', '/')))
+
+    conn = get_db_connection()
+    try:
+        for row in conn.execute("SELECT filename, file_path FROM patterns"):
+            add('patterns', row['filename'], row['file_path'])
+        for row in conn.execute(
+                "SELECT product_image, product_image_path, depth_image, depth_image_path FROM products"):
+            add('products', row['product_image'], row['product_image_path'])
+            add('depth_maps', row['depth_image'], row['depth_image_path'])
+        for row in conn.execute("SELECT file_path FROM theme_backgrounds"):
+            add('themes_bgs', row['file_path'])
+        for row in conn.execute(
+                "SELECT original_product_path, original_depth_path, effect_image_path FROM product_archives"):
+            add('archives', row['original_product_path'], row['original_depth_path'], row['effect_image_path'])
+    finally:
+        conn.close()
+    return references
+
+
+def scan_orphans(reclaim: bool = False, min_age: float = DEFAULT_MIN_AGE,
+                 upload_root: str = UPLOAD_ROOT) -> Dict[str, Any]:
+    """
+    扫描没有数据库记录引用的上传文件，reclaim 为 True 时删除
+    返回各目录的文件数、总大小、孤儿文件数和大小，以及孤儿文件列表（每个目录最多列出100个）
+    """
+    wait_for_deletes(timeout=30)
+    references = referenced_files()
+    now = time.time()
+    report = {'scanned_at': time.strftime('%Y-%m-%d %H:%M:%S'), 'reclaim': reclaim, 'min_age': min_age,
+              'directories': {}, 'orphan_files': 0, 'orphan_bytes': 0, 'reclaimed_files': 0, 'reclaimed_bytes': 0}
+    for directory in SCANNED_DIRS:
+        path = os.path.join(upload_root, directory)
+        summary = {'files': 0, 'bytes': 0, 'orphan_files': 0, 'orphan_bytes': 0, 'orphans': []}
+        report['directories'][directory] = summary
+        if not os.path.isdir(path):
+            continue
+        with os.scandir(path) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+                stat = entry.stat()
+                summary['files'] += 1
+                summary['bytes'] += stat.st_size
+                if entry.name in references[directory] or now - stat.st_mtime < min_age:
+                    continue
+                summary['orphan_files'] += 1
+                summary['orphan_bytes'] += stat.st_size
+                if len(summary['orphans']) < 100:
+                    summary['orphans'].append({'name': entry.name, 'bytes': stat.st_size})
+                if reclaim:
+                    try:
+                        os.remove(entry.path)
+                        report['reclaimed_files'] += 1
+                        report['reclaimed_bytes'] += stat.st_size
+                    except OSError as e:
+                        print(f"删除孤儿文件失败 {entry.path}: {e}")
+        report['orphan_files'] += summary['orphan_files']
+        report['orphan_bytes'] += summary['orphan_bytes']
+    _save_report(report)
+    return report
+
+
+def _save_report(report: Dict[str, Any]):
+    try:
+        os.makedirs(REPORT_DIR, exist_ok=True)
+        path = os.path.join(REPORT_DIR, 'last_scan.json')
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False)
+        os.replace(temp_path, path)
+    except OSError as e:
+        print(f"保存孤儿文件扫描结果失败: {e}")
+
+
+def last_scan_report() -> Optional[Dict[str, Any]]:
+    """最近一次扫描结果（任一进程执行的）"""
+    try:
+        with open(os.path.join(REPORT_DIR, 'last_scan.json'), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def init_storage_reaper(app) -> Optional[threading.Event]:
+    """
+    启动后台线程定期扫描孤儿文件
+    app.config['STORAGE_SCAN_INTERVAL'] 为扫描间隔（秒，0 关闭），STORAGE_RECLAIM_ORPHANS 为 True 时直接删除，
+    否则只记录报告；返回的 Event 被设置后线程退出
+    """
+    app.config.setdefault('STORAGE_SCAN_INTERVAL', 24 * 3600)
+    app.config.setdefault('STORAGE_RECLAIM_ORPHANS', False)
+    app.config.setdefault('STORAGE_ORPHAN_MIN_AGE', DEFAULT_MIN_AGE)
+    if not app.config['STORAGE_SCAN_INTERVAL']:
+        return None
+
+    stop = threading.Event()
+
+    def run():
+        # 启动后稍等再执行第一次，避免与启动过程争用磁盘和数据库
+        delay = min(300, app.config['STORAGE_SCAN_INTERVAL'])
+        while not stop.wait(delay):
+            delay = app.config['STORAGE_SCAN_INTERVAL']
+            try:
+                report = scan_orphans(app.config['STORAGE_RECLAIM_ORPHANS'], app.config['STORAGE_ORPHAN_MIN_AGE'])
+                if report['orphan_files']:
+                    action = '已删除' if report['reclaim'] else '发现'
+                    print(f"{action} {report['orphan_files']} 个孤儿上传文件，"
+                          f"共 {round(report['orphan_bytes'] / 1024 / 1024, 2)} MB")
+            except Exception as e:
+                print(f"扫描孤儿文件失败: {e}")
+
+    threading.Thread(target=run, name='storage-orphan-scan', daemon=True).start()
+    return stop
@@ -0,0 +1,136 @@
+"""
+模板缓存
+提供前后台共享的Jinja字节码磁盘缓存，以及按数据版本失效的模板片段缓存
+"""
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from jinja2 import FileSystemBytecodeCache, nodes
+from jinja2.ext import Extension
+from markupsafe import Markup
+
+# 前台和后台使用同一目录，多个进程可共享已编译的模板字节码
+TEMPLATE_CACHE_DIR = os.path.join('instance', 'jinja_cache')
+
+
+class FragmentCache:
+    """进程内有界LRU片段缓存，键中包含数据版本号，版本变化后旧片段自然淘汰"""
+
+    def __init__(self, max_size: int = 256):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Tuple, Markup]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_render(self, key: Tuple, render: Callable[[], str]) -> Markup:
+        """命中则返回缓存片段，否则渲染并写入缓存"""
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        fragment = Markup(render())
+
+        with self._lock:
+            self._entries[key] = fragment
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return fragment
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+class FragmentCacheExtension(Extension):
+    """
+    模板片段缓存标签
+    用法: {% cache 'category_options', data_revision('product_categories') %}...{% endcache %}
+    """
+    tags = {'cache'}
+
+    def __init__(self, environment):
+        super().__init__(environment)
+        environment.extend(fragment_cache=None)
+
+    def parse(self, parser):
+        lineno = next(parser.stream).lineno
+        key_parts = [parser.parse_expression()]
+        while parser.stream.skip_if('comma'):
+            key_parts.append(parser.parse_expression())
+        body = parser.parse_statements(('name:endcache',), drop_needle=True)
+        return nodes.CallBlock(
+            self.call_method('_render_cached', [nodes.List(key_parts)]), [], [], body
+        ).set_lineno(lineno)
+
+    def _render_cached(self, key_parts, caller):
+        cache = self.environment.fragment_cache
+        if cache is None:
+            return caller()
+        return cache.get_or_render(tuple(key_parts), caller)
+
+
+def data_revision(*table_names: str) -> str:
+    """获取指定表的数据版本标记，同一请求内只查询一次数据库"""
+    from flask import g, has_request_context
+    from .database import DatabaseManager
+
+    if has_request_context():
+        revisions = getattr(g, '_data_revisions', None)
+        if revisions is None:
+            revisions = g._data_revisions = DatabaseManager.get_data_revisions()
+    else:
+        revisions = DatabaseManager.get_data_revisions()
+    return '-'.join(str(revisions.get(name, 0)) for name in table_names)
+
+
+def init_template_cache(app, cache_dir: Optional[str] = None, fragment_cache_size: int = 256):
+    """为Flask应用启用模板字节码缓存和片段缓存"""
+    cache_dir = cache_dir or app.config.get('TEMPLATE_CACHE_DIR', TEMPLATE_CACHE_DIR)
+    os.makedirs(cache_dir, exist_ok=True)
+
+    env = app.jinja_env
+    env.bytecode_cache = FileSystemBytecodeCache(cache_dir)
+    env.add_extension(FragmentCacheExtension)
+    env.fragment_cache = FragmentCache(fragment_cache_size)
+    env.globals['data_revision'] = data_revision
+    return env.fragment_cache
+
+
+def precompile_templates(app) -> int:
+    """预编译全部模板并写入字节码缓存，部署后执行一次即可消除首次访问的编译开销"""
+    env = app.jinja_env
+    count = 0
+    for template_name in env.list_templates(extensions=('html',)):
+        env.get_template(template_name)
+        count += 1
+    return count
+
+
+if __name__ == '__main__':
+    # 预编译前后台模板：python -m backend.template_cache
+    from flask import Flask
+
+    compile_app = Flask('template_precompile', template_folder=os.path.abspath('templates'))
+    init_template_cache(compile_app)
+    compiled = precompile_templates(compile_app)
+    print(f"✓ 已预编译 {compiled} 个模板到 {TEMPLATE_CACHE_DIR}")
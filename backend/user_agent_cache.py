@@ -0,0 +1,132 @@
+"""
+User-Agent解析缓存
+展会现场大量设备共用少数几种UA字符串，缓存解析结果避免每次登录都执行正则解析
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Any, Tuple
+
+DEFAULT_MAX_SIZE = 512
+
+
+class UserAgentCache:
+    """有界LRU缓存，键为UA字符串，值为(浏览器, 操作系统)"""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, Tuple[str, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _parse(user_agent: str) -> Tuple[str, str]:
+        """调用user_agents执行实际解析"""
+        import user_agents
+
+        ua = user_agents.parse(user_agent)
+        browser = f"{ua.browser.family} {ua.browser.version_string}" if ua.browser.family else "Unknown"
+        operating_system = f"{ua.os.family} {ua.os.version_string}" if ua.os.family else "Unknown"
+        return browser.strip(), operating_system.strip()
+
+    def parse(self, user_agent: str) -> Tuple[str, str]:
+        """获取UA对应的(浏览器, 操作系统)，命中缓存时不再解析"""
+        user_agent = user_agent or ''
+        with self._lock:
+            cached = self._entries.get(user_agent)
+            if cached is not None:
+                self._entries.move_to_end(user_agent)
+                self.hits += 1
+                return cached
+            self.misses += 1
+
+        # 解析在锁外进行，避免阻塞其他请求
+        result = self._parse(user_agent) if user_agent else ("Unknown", "Unknown")
+
+        with self._lock:
+            self._entries[user_agent] = result
+            self._entries.move_to_end(user_agent)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return result
+
+    def clear(self):
+        """清空缓存和统计"""
+        with self._lock:
+            self._entries.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取缓存命中统计"""
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0.0
+            }
+
+
+# 进程内共享的缓存实例
+ua_cache = UserAgentCache()
+
+
+def parse_user_agent(user_agent: str) -> Tuple[str, str]:
+    """解析UA字符串，返回(浏览器, 操作系统)"""
+    return ua_cache.parse(user_agent)
+
+
+def backfill_access_log_user_agents(batch_size: int = 500) -> Dict[str, int]:
+    """
+    回填历史访问记录的浏览器/操作系统字段
+    有原始UA的记录重新解析，没有UA且字段为空的记录统一为Unknown
+    """
+    from .database import get_db_connection
+
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    updated = 0
+    scanned = 0
+    try:
+        last_id = 0
+        while True:
+            cursor.execute('''
+                SELECT id, user_agent, browser, operating_system FROM access_logs
+                WHERE id > ? ORDER BY id LIMIT ?
+            ''', (last_id, batch_size))
+            rows = cursor.fetchall()
+            if not rows:
+                break
+
+            changes = []
+            for row in rows:
+                scanned += 1
+                if row['user_agent']:
+                    browser, operating_system = parse_user_agent(row['user_agent'])
+                else:
+                    browser = row['browser'] or 'Unknown'
+                    operating_system = row['operating_system'] or 'Unknown'
+                if browser != row['browser'] or operating_system != row['operating_system']:
+                    changes.append((browser, operating_system, row['id']))
+            last_id = rows[-1]['id']
+
+            if changes:
+                cursor.executemany(
+                    "UPDATE access_logs SET browser = ?, operating_system = ? WHERE id = ?",
+                    changes
+                )
+                conn.commit()
+                updated += len(changes)
+    finally:
+        conn.close()
+
+    return {'scanned': scanned, 'updated': updated}
+
+
+if __name__ == '__main__':
+    result = backfill_access_log_user_agents()
+    print(f"访问记录回填完成: 扫描 {result['scanned']} 条, 更新 {result['updated']} 条")
+    print(f"UA缓存统计: {ua_cache.get_stats()}")
@@ -0,0 +1,4 @@
+"""
+性能基准测试
+loadtest: 前台授权码会话与后台管理并发负载测试，输出延迟分位数和吞吐量的JSON报告
+"""
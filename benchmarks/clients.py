@@ -0,0 +1,109 @@
+"""
+基准测试客户端
+同一套场景既可在进程内通过 Flask test_client 调用，也可通过HTTP访问本机运行的服务；
+每个客户端自带独立的Cookie，相当于一个独立的浏览器会话
+"""
+import json
+import uuid
+from dataclasses import dataclass
+from http.cookiejar import CookieJar
+from typing import Any, Dict, Optional, Tuple
+from urllib import error as urllib_error
+from urllib import request as urllib_request
+
+
+@dataclass
+class BenchResponse:
+    """统一的响应结果"""
+    status: int
+    body: bytes
+    content_type: str = ''
+
+    def json(self) -> Optional[Any]:
+        if 'json' not in self.content_type:
+            return None
+        try:
+            return json.loads(self.body)
+        except ValueError:
+            return None
+
+
+# 上传文件格式：{字段名: (文件名, 内容, MIME类型)}
+Files = Dict[str, Tuple[str, bytes, str]]
+
+
+def encode_multipart(form: Optional[Dict[str, str]], files: Optional[Files]) -> Tuple[bytes, str]:
+    """编码 multipart/form-data 请求体"""
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in (form or {}).items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'.encode()
+            + str(value).encode('utf-8') + b'\r\n'
+        )
+    for name, (filename, content, mimetype) in (files or {}).items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {mimetype}\r\n\r\n'.encode() + content + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class InProcessClient:
+    """进程内调用Flask应用，不经过网络，适合对比代码改动本身的开销"""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method: str, path: str, form: Optional[Dict[str, str]] = None,
+                json_body: Optional[Any] = None, files: Optional[Files] = None) -> BenchResponse:
+        kwargs = {}
+        if json_body is not None:
+            kwargs['json'] = json_body
+        elif form is not None or files is not None:
+            body, content_type = encode_multipart(form, files)
+            kwargs['data'] = body
+            kwargs['content_type'] = content_type
+        response = self._client.open(path, method=method, **kwargs)
+        try:
+            return BenchResponse(response.status_code, response.get_data(), response.content_type or '')
+        finally:
+            response.close()
+
+
+class _NoRedirect(urllib_request.HTTPRedirectHandler):
+    """与 test_client 一致，不自动跟随重定向"""
+
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None
+
+
+class HttpClient:
+    """通过HTTP访问已启动的服务，包含网络和WSGI服务器开销"""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._opener = urllib_request.build_opener(
+            urllib_request.HTTPCookieProcessor(CookieJar()), _NoRedirect()
+        )
+
+    def request(self, method: str, path: str, form: Optional[Dict[str, str]] = None,
+                json_body: Optional[Any] = None, files: Optional[Files] = None) -> BenchResponse:
+        headers = {}
+        data = None
+        if json_body is not None:
+            data = json.dumps(json_body).encode('utf-8')
+            headers['Content-Type'] = 'application/json'
+        elif form is not None or files is not None:
+            data, headers['Content-Type'] = encode_multipart(form, files)
+        req = urllib_request.Request(self.base_url + path, data=data, headers=headers, method=method)
+        try:
+            with self._opener.open(req, timeout=self.timeout) as response:
+                return BenchResponse(response.status, response.read(),
+                                     response.headers.get('Content-Type', ''))
+        except urllib_error.HTTPError as e:
+            body = e.read()
+            e.close()
+            return BenchResponse(e.code, body, e.headers.get('Content-Type', '') if e.headers else '')
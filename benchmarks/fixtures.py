@@ -0,0 +1,128 @@
+"""
+基准测试样例数据
+按尺寸和随机种子生成固定内容的图案、产品图、深度图和归档记录，同样的参数总是得到同样的字节，
+保证不同版本的测试结果可比
+"""
+import base64
+import os
+from datetime import datetime, timedelta
+from io import BytesIO
+from typing import Any, Dict, List
+
+
+def _encode(array, mode: str, fmt: str = 'PNG') -> bytes:
+    from PIL import Image
+
+    buffer = BytesIO()
+    Image.fromarray(array, mode).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+def _grid(size: int):
+    import numpy as np
+
+    axis = np.linspace(0.0, 1.0, size, dtype=np.float32)
+    return np.meshgrid(axis, axis)
+
+
+def pattern_image(size: int, seed: int = 0, fmt: str = 'PNG') -> bytes:
+    """印花图案：重复的几何纹样 + 少量噪声，带透明通道"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    x, y = _grid(size)
+    tiles = rng.integers(4, 12)
+    motif = (np.sin(x * tiles * np.pi * 2) * np.cos(y * tiles * np.pi * 2) + 1.0) * 0.5
+    noise = rng.random((size, size), dtype=np.float32) * 0.15
+    rgba = np.empty((size, size, 4), dtype=np.uint8)
+    color = rng.random(3)
+    for channel in range(3):
+        rgba[..., channel] = np.clip((motif * color[channel] + noise) * 255, 0, 255)
+    rgba[..., 3] = np.where(motif > 0.2, 255, 0)
+    if fmt.upper() in ('JPEG', 'JPG'):
+        return _encode(rgba[..., :3], 'RGB', 'JPEG')
+    return _encode(rgba, 'RGBA', fmt)
+
+
+def product_image(size: int, seed: int = 0, fmt: str = 'PNG') -> bytes:
+    """产品图：浅色背景上的椭圆形产品轮廓，带明暗渐变"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    x, y = _grid(size)
+    inside = ((x - 0.5) / 0.35) ** 2 + ((y - 0.5) / 0.45) ** 2 <= 1.0
+    shade = 0.6 + 0.4 * (1.0 - y)
+    base = rng.uniform(0.3, 0.9, 3)
+    rgb = np.empty((size, size, 3), dtype=np.uint8)
+    for channel in range(3):
+        rgb[..., channel] = np.where(inside, base[channel] * shade * 255, 245)
+    rgb = np.clip(rgb.astype(np.int16) + rng.integers(-4, 5, rgb.shape, dtype=np.int16), 0, 255).astype(np.uint8)
+    return _encode(rgb, 'RGB', fmt)
+
+
+def depth_map(size: int, seed: int = 0) -> bytes:
+    """深度图：与产品轮廓一致的平滑凸起，单通道灰度"""
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    x, y = _grid(size)
+    distance = ((x - 0.5) / 0.35) ** 2 + ((y - 0.5) / 0.45) ** 2
+    bumps = np.sin(x * rng.uniform(3, 8) * np.pi) * np.sin(y * rng.uniform(3, 8) * np.pi) * 0.1
+    depth = np.clip((1.0 - distance) * 0.9 + bumps, 0.0, 1.0) * (distance <= 1.0)
+    return _encode((depth * 255).astype(np.uint8), 'L')
+
+
+def data_url(png: bytes) -> str:
+    """前端提交效果图时使用的 data URL 格式"""
+    return 'data:image/png;base64,' + base64.b64encode(png).decode('ascii')
+
+
+def write_file(path: str, data: bytes) -> str:
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(data)
+    return path
+
+
+def write_product_set(directory: str, size: int, seed: int = 0) -> Dict[str, str]:
+    """写入一组产品图、深度图和图案，返回各文件路径"""
+    return {
+        'product': write_file(os.path.join(directory, f'product_{size}_{seed}.png'), product_image(size, seed)),
+        'depth': write_file(os.path.join(directory, f'depth_{size}_{seed}.png'), depth_map(size, seed)),
+        'pattern': write_file(os.path.join(directory, f'pattern_{size}_{seed}.png'), pattern_image(size, seed)),
+    }
+
+
+def archive_records(count: int, archive_dir: str, image_size: int = 0, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    生成与 product_archives 表结构一致的归档记录
+    image_size 大于0时在 archive_dir 中写入对应的三张图片（所有记录共用同一组文件）
+    """
+    images = {'original_product_path': '', 'original_depth_path': '', 'effect_image_path': ''}
+    if image_size > 0:
+        images = {
+            'original_product_path': os.path.basename(write_file(
+                os.path.join(archive_dir, f'original_product_{seed}.png'), product_image(image_size, seed))),
+            'original_depth_path': os.path.basename(write_file(
+                os.path.join(archive_dir, f'original_depth_{seed}.png'), depth_map(image_size, seed))),
+            'effect_image_path': os.path.basename(write_file(
+                os.path.join(archive_dir, f'effect_{seed}.png'), pattern_image(image_size, seed))),
+        }
+    started = datetime(2025, 8, 1, 9, 0, 0)
+    categories = ['基础效果', '高级效果', '定制效果']
+    records = []
+    for index in range(count):
+        records.append({
+            'id': index + 1,
+            'access_code': f'CODE{index % 50:04d}',
+            'original_product_image': f'A{index:04d}.png',
+            'original_depth_image': f'A{index:04d}_Depth.png',
+            'effect_image': images['effect_image_path'],
+            'effect_category': categories[index % len(categories)],
+            'register_time': (started + timedelta(minutes=index * 7)).strftime('%Y-%m-%d %H:%M:%S'),
+            'register_info': f'展会登记信息 {index}，客户意向产品及联系方式',
+            'follow_up_person': f'跟进人{index % 12}',
+            'is_active': 1,
+            **images,
+        })
+    return records
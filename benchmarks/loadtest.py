@@ -0,0 +1,256 @@
+"""
+前台会话 + 后台管理并发负载测试
+
+进程内模式（默认）：把 database.db 和 uploads/ 复制到临时工作目录后在同一进程中加载前台和后台应用，
+不修改项目数据，适合对比代码改动：
+    python -m benchmarks.loadtest run --duration 30 --kiosk-users 8 --admin-users 2 --output base.json
+
+HTTP模式：压测已启动的服务（会真实写入归档和图案数据，请勿对生产库使用）：
+    python -m benchmarks.loadtest run --mode http --frontend-url http://127.0.0.1:5000 --admin-url http://127.0.0.1:7860
+
+对比两次结果（延迟变化为正表示变慢）：
+    python -m benchmarks.loadtest compare base.json new.json --threshold 10
+"""
+import argparse
+import contextlib
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import datetime
+from typing import Any, Callable, Dict, List
+
+from .clients import HttpClient, InProcessClient
+from .scenarios import AdminSession, KioskSession, sample_png
+from .stats import PROJECT_ROOT, LatencyRecorder, compare_reports, environment_info, write_json
+
+REPORT_VERSION = 1
+
+
+def prepare_workspace(workspace: str) -> str:
+    """复制数据库和上传文件到工作目录，测试产生的归档和图案只写入副本"""
+    os.makedirs(workspace, exist_ok=True)
+    database = os.path.join(PROJECT_ROOT, 'database.db')
+    if os.path.exists(database):
+        shutil.copy2(database, os.path.join(workspace, 'database.db'))
+    uploads = os.path.join(PROJECT_ROOT, 'uploads')
+    if os.path.isdir(uploads):
+        shutil.copytree(uploads, os.path.join(workspace, 'uploads'), dirs_exist_ok=True)
+    return workspace
+
+
+def load_apps(workspace: str):
+    """在工作目录中加载前台和后台应用（应用使用相对路径访问数据库和上传目录）"""
+    os.chdir(workspace)
+    if PROJECT_ROOT not in sys.path:
+        sys.path.insert(0, PROJECT_ROOT)
+    import app as frontend_module
+    import admin_app as admin_module
+
+    # 确保默认管理员和测试授权码存在
+    admin_module.initialize_default_data()
+    upload_folder = os.path.abspath('uploads')
+    for module in (frontend_module, admin_module):
+        # 文件发送默认相对应用目录解析，改为工作目录下的副本
+        module.app.config['UPLOAD_FOLDER'] = upload_folder
+    return frontend_module.app, admin_module.app
+
+
+def _worker(name: str, stop: threading.Event, errors: List[str], iteration: Callable[[], None],
+            think_time: float, rng: random.Random):
+    """循环执行场景直到结束，场景内部异常只记录不中断其他线程"""
+    while not stop.is_set():
+        try:
+            iteration()
+        except Exception as e:
+            errors.append(f'{name}: {type(e).__name__}: {e}')
+            if len(errors) > 100:
+                stop.set()
+        if think_time > 0:
+            stop.wait(rng.uniform(0, think_time * 2))
+
+
+def run_load_test(args) -> Dict[str, Any]:
+    if args.mode == 'inprocess':
+        workspace = prepare_workspace(args.workspace or tempfile.mkdtemp(prefix='autodecal_bench_'))
+        frontend_app, admin_app = load_apps(workspace)
+
+        def make_frontend_client():
+            return InProcessClient(frontend_app)
+
+        def make_admin_client():
+            return InProcessClient(admin_app)
+    else:
+        workspace = None
+
+        def make_frontend_client():
+            return HttpClient(args.frontend_url)
+
+        def make_admin_client():
+            return HttpClient(args.admin_url)
+
+    recorders = {'kiosk': LatencyRecorder(), 'admin': LatencyRecorder(), 'combined': LatencyRecorder()}
+
+    def recorder_for(role: str):
+        def record(label: str, elapsed: float, error=None):
+            recorders[role].record(label, elapsed, error)
+            recorders['combined'].record(label, elapsed, error)
+        return record
+
+    effect_image = sample_png(args.image_size, args.image_size)
+    stop = threading.Event()
+    worker_errors: List[str] = []
+    threads = []
+
+    for index in range(args.kiosk_users):
+        rng = random.Random(args.seed * 1000 + index)
+
+        def kiosk_iteration(rng=rng):
+            # 每次会话使用新的客户端，相当于一位新访客
+            KioskSession(make_frontend_client(), recorder_for('kiosk'), rng, args.access_code, effect_image,
+                         browse_rounds=args.browse_rounds, archive_probability=args.archive_probability).run()
+        threads.append(threading.Thread(target=_worker, name=f'kiosk-{index}', daemon=True,
+                                        args=(f'kiosk-{index}', stop, worker_errors, kiosk_iteration,
+                                              args.think_time, rng)))
+
+    for index in range(args.admin_users):
+        rng = random.Random(args.seed * 1000 + 500 + index)
+        admin = AdminSession(make_admin_client(), recorder_for('admin'), rng, args.admin_username,
+                             args.admin_password, effect_image, worker_id=index)
+        threads.append(threading.Thread(target=_worker, name=f'admin-{index}', daemon=True,
+                                        args=(f'admin-{index}', stop, worker_errors, admin.run,
+                                              args.admin_think_time, rng)))
+
+    started_at = datetime.now().isoformat(timespec='seconds')
+    for thread in threads:
+        thread.start()
+    # 预热阶段的请求不计入结果
+    stop.wait(args.warmup)
+    for recorder in recorders.values():
+        recorder.start_measuring()
+    stop.wait(args.duration)
+    for recorder in recorders.values():
+        recorder.stop_measuring()
+    stop.set()
+    for thread in threads:
+        thread.join(timeout=60)
+
+    report = {
+        'benchmark': 'kiosk_admin_load',
+        'version': REPORT_VERSION,
+        'started_at': started_at,
+        'config': {
+            'mode': args.mode,
+            'seed': args.seed,
+            'duration_s': args.duration,
+            'warmup_s': args.warmup,
+            'kiosk_users': args.kiosk_users,
+            'admin_users': args.admin_users,
+            'browse_rounds': args.browse_rounds,
+            'archive_probability': args.archive_probability,
+            'think_time_s': args.think_time,
+            'admin_think_time_s': args.admin_think_time,
+            'image_size': args.image_size,
+        },
+        'environment': environment_info(),
+        'worker_errors': worker_errors[:20],
+    }
+    for role, recorder in recorders.items():
+        report[role] = recorder.report()
+
+    if workspace and not args.workspace and not args.keep_workspace:
+        os.chdir(PROJECT_ROOT)
+        shutil.rmtree(workspace, ignore_errors=True)
+    elif workspace:
+        report['workspace'] = workspace
+    return report
+
+
+def print_summary(report: Dict[str, Any]):
+    """在标准错误输出简要结果，JSON报告写入文件或标准输出"""
+    for role in ('kiosk', 'admin'):
+        section = report[role]
+        if not section['endpoints']:
+            continue
+        totals = section['totals']
+        print(f"[{role}] {totals['count']} 请求, {totals['throughput_rps']} req/s, "
+              f"p50 {totals['p50_ms']}ms p95 {totals['p95_ms']}ms p99 {totals['p99_ms']}ms, "
+              f"错误 {totals['errors']}", file=sys.stderr)
+        for label, stats in section['endpoints'].items():
+            print(f"    {label:<40} n={stats['count']:<6} p50={stats['p50_ms']:<9} "
+                  f"p95={stats['p95_ms']:<9} p99={stats['p99_ms']:<9} err={stats['errors']}", file=sys.stderr)
+
+
+def compare_command(args) -> int:
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = json.load(f)
+    result = compare_reports(baseline, candidate)
+    if baseline.get('config') != candidate.get('config'):
+        result['warning'] = '两次测试的配置不同，结果不可直接比较'
+    write_json(result, args.output)
+
+    if args.threshold is None:
+        return 0
+    # 任一角色的总体p95延迟变慢超过阈值时返回非零，便于在脚本中使用
+    regressions = [role for role, metrics in result['totals'].items()
+                   if (metrics['p95_ms']['change_pct'] or 0) > args.threshold]
+    if regressions:
+        print(f"p95延迟退化超过 {args.threshold}%: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.loadtest', description='前台会话与后台管理并发负载测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='执行负载测试')
+    run.add_argument('--mode', choices=('inprocess', 'http'), default='inprocess')
+    run.add_argument('--frontend-url', default='http://127.0.0.1:5000')
+    run.add_argument('--admin-url', default='http://127.0.0.1:7860')
+    run.add_argument('--duration', type=float, default=30.0, help='计入结果的测试时长（秒）')
+    run.add_argument('--warmup', type=float, default=5.0, help='预热时长（秒），不计入结果')
+    run.add_argument('--kiosk-users', type=int, default=8, help='并发前台会话数')
+    run.add_argument('--admin-users', type=int, default=2, help='并发后台管理员数')
+    run.add_argument('--browse-rounds', type=int, default=3, help='每次会话浏览的产品/图案次数')
+    run.add_argument('--archive-probability', type=float, default=0.3, help='会话结束时提交归档的概率')
+    run.add_argument('--think-time', type=float, default=0.0, help='前台会话间的平均间隔（秒）')
+    run.add_argument('--admin-think-time', type=float, default=0.5, help='后台操作间的平均间隔（秒）')
+    run.add_argument('--image-size', type=int, default=512, help='归档和上传使用的样例PNG边长')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--access-code', default='TEST2024')
+    run.add_argument('--admin-username', default='admin')
+    run.add_argument('--admin-password', default='admin123')
+    run.add_argument('--workspace', help='进程内模式的工作目录（默认使用临时目录并在结束后删除）')
+    run.add_argument('--keep-workspace', action='store_true', help='保留临时工作目录')
+    run.add_argument('--output', '-o', default='-', help='JSON报告输出文件，默认标准输出')
+
+    compare = subparsers.add_parser('compare', help='对比两次测试结果')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, help='p95延迟退化超过该百分比时返回非零')
+    compare.add_argument('--output', '-o', default='-')
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'compare':
+        return compare_command(args)
+    if args.output != '-':
+        args.output = os.path.abspath(args.output)
+    # 应用启动和运行中的打印输出转到标准错误，避免混入标准输出的JSON报告
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_load_test(args)
+    print_summary(report)
+    write_json(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+CPU密集路径的微基准测试（不经过HTTP）
+
+覆盖上传图片读取与规范化（Pillow解码/缩放/编码）、归档Excel导出（openpyxl）、
+归档接口的base64解码和服务端效果图合成（NumPy），每项按参数组合分别测量耗时和峰值内存：
+    python -m benchmarks.micro list
+    python -m benchmarks.micro run --output micro_base.json
+    python -m benchmarks.micro run --quick --case excel_export --case server_render
+    python -m benchmarks.micro compare micro_base.json micro_new.json --threshold 10
+
+峰值内存由 tracemalloc 在单独的一次运行中测量，包含Python对象和NumPy数组，
+不包含Pillow等C扩展内部的分配
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+from . import fixtures
+from .stats import PROJECT_ROOT, change_pct, environment_info, write_json
+
+REPORT_VERSION = 1
+
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+# 合成测试使用的渲染参数（与前端归档时提交的 renderParams 格式一致）
+RENDER_PARAMS = {
+    'width': 1280, 'height': 960, 'scale': 0.8, 'skewX': 0.05,
+    'distortion': 0.3, 'depthThreshold': 0.7, 'blendMode': 'multiply', 'opacity': 0.9,
+}
+
+
+@dataclass
+class BenchCase:
+    """一项基准测试：setup 根据参数准备数据并返回被测函数"""
+    name: str
+    description: str
+    setup: Callable[[Dict[str, Any], str], Callable[[], Any]]
+    grid: Dict[str, List[Any]]
+    quick_grid: Dict[str, List[Any]] = field(default_factory=dict)
+
+    def parameter_sets(self, quick: bool = False) -> List[Dict[str, Any]]:
+        grid = {**self.grid, **self.quick_grid} if quick else self.grid
+        names = list(grid)
+        return [dict(zip(names, values)) for values in itertools.product(*(grid[name] for name in names))]
+
+
+CASES: Dict[str, BenchCase] = {}
+
+
+def bench_case(name: str, description: str, grid: Dict[str, List[Any]],
+               quick_grid: Optional[Dict[str, List[Any]]] = None):
+    """注册基准测试项"""
+    def decorator(setup):
+        CASES[name] = BenchCase(name, description, setup, grid, quick_grid or {})
+        return setup
+    return decorator
+
+
+@bench_case('upload_image_info', '上传接口读取图片尺寸（Image.open 只解析文件头）',
+            grid={'size': [1024, 2048, 4096]}, quick_grid={'size': [1024]})
+def _upload_image_info(params, workdir):
+    from PIL import Image
+
+    path = fixtures.write_file(os.path.join(workdir, f"upload_{params['size']}.png"),
+                               fixtures.pattern_image(params['size']))
+
+    def run():
+        with Image.open(path) as img:
+            return img.size
+    return run
+
+
+@bench_case('normalize_image', '导入时的图片规范化（完整解码、缩放、去元数据并重新编码）',
+            grid={'kind': ['pattern', 'product', 'depth'], 'size': [1024, 2048, 4096]},
+            quick_grid={'size': [1024]})
+def _normalize_image(params, workdir):
+    from backend.image_normalizer import normalize_image
+
+    size, kind = params['size'], params['kind']
+    if kind == 'pattern':
+        data = fixtures.pattern_image(size)
+    elif kind == 'product':
+        data = fixtures.product_image(size)
+    else:
+        data = fixtures.depth_map(size)
+    return lambda: normalize_image(data, kind)
+
+
+@bench_case('excel_export', '后台归档导出的Excel工作簿生成',
+            grid={'archives': [100, 1000], 'images': [False, True]},
+            quick_grid={'archives': [100]})
+def _excel_export(params, workdir):
+    from backend.archive_export import FIELD_MAPPING, build_archive_workbook
+
+    archive_dir = os.path.join(workdir, f"archives_{params['archives']}_{params['images']}")
+    os.makedirs(archive_dir, exist_ok=True)
+    records = fixtures.archive_records(params['archives'], archive_dir, 256 if params['images'] else 0)
+    fields = list(FIELD_MAPPING) if params['images'] else [
+        name for name in FIELD_MAPPING if not name.endswith('_path')]
+    return lambda: build_archive_workbook(records, fields, archive_dir)
+
+
+@bench_case('archive_base64_decode', '归档接口解码前端提交的效果图 data URL',
+            grid={'size': [1024, 2048, 4096]}, quick_grid={'size': [1024]})
+def _archive_base64_decode(params, workdir):
+    import base64
+
+    effect_image_data = fixtures.data_url(fixtures.product_image(params['size']))
+
+    def run():
+        # 与 /api/archive 中的处理一致
+        if effect_image_data.startswith('data:image/png;base64,'):
+            return base64.b64decode(effect_image_data.split(',')[1])
+    return run
+
+
+@bench_case('server_composite', '服务端效果图合成（仅NumPy计算，不含素材解码和PNG编码）',
+            grid={'long_edge': [1024, 2048, 4096], 'workers': [1, 4]},
+            quick_grid={'long_edge': [1024]})
+def _server_composite(params, workdir):
+    from backend.server_renderer import EffectRenderer
+
+    paths = fixtures.write_product_set(workdir, 2048)
+    renderer = EffectRenderer(paths['product'], paths['depth'], paths['pattern'], RENDER_PARAMS,
+                              max_workers=params['workers'])
+    width, height = renderer.output_size(params['long_edge'])
+    return lambda: renderer.render(width, height)
+
+
+@bench_case('server_render', '按配方完整重绘（素材解码 + 合成 + PNG编码）',
+            grid={'long_edge': [1024, 2048, 4096]}, quick_grid={'long_edge': [1024]})
+def _server_render(params, workdir):
+    from backend.server_renderer import render_recipe
+
+    paths = fixtures.write_product_set(workdir, 2048)
+    recipe = {'params': RENDER_PARAMS}
+    return lambda: render_recipe(recipe, paths['product'], paths['depth'], paths['pattern'],
+                                 long_edge=params['long_edge'])
+
+
+def case_id(name: str, params: Dict[str, Any]) -> str:
+    """结果标识，如 normalize_image[kind=pattern,size=2048]"""
+    return f"{name}[{','.join(f'{key}={value}' for key, value in params.items())}]"
+
+
+def measure(func: Callable[[], Any], repeat: int, warmup: int = 1) -> Dict[str, Any]:
+    """预热后重复计时，再单独运行一次测量峰值内存（tracemalloc 会拖慢执行，不与计时混在一起）"""
+    for _ in range(warmup):
+        func()
+    timings = []
+    for _ in range(repeat):
+        gc.collect()
+        started = time.perf_counter()
+        func()
+        timings.append(time.perf_counter() - started)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'repeat': repeat,
+        'min_ms': round(min(timings) * 1000, 3),
+        'median_ms': round(statistics.median(timings) * 1000, 3),
+        'mean_ms': round(statistics.mean(timings) * 1000, 3),
+        'stdev_ms': round(statistics.stdev(timings) * 1000, 3) if len(timings) > 1 else 0.0,
+        'max_ms': round(max(timings) * 1000, 3),
+        'peak_kb': round(peak / 1024, 1),
+    }
+
+
+def package_versions() -> Dict[str, str]:
+    versions = {}
+    for module_name, attribute in (('numpy', '__version__'), ('PIL', '__version__'), ('openpyxl', '__version__')):
+        try:
+            versions[module_name] = getattr(__import__(module_name), attribute)
+        except ImportError:
+            versions[module_name] = ''
+    return versions
+
+
+def run_benchmarks(names: List[str], repeat: int, quick: bool) -> Dict[str, Any]:
+    results = []
+    with tempfile.TemporaryDirectory(prefix='autodecal_micro_') as workdir:
+        for name in names:
+            case = CASES[name]
+            for params in case.parameter_sets(quick):
+                identifier = case_id(name, params)
+                try:
+                    func = case.setup(params, workdir)
+                    result = {'id': identifier, 'case': name, 'params': params, **measure(func, repeat)}
+                except Exception as e:
+                    result = {'id': identifier, 'case': name, 'params': params,
+                              'error': f'{type(e).__name__}: {e}'}
+                print(f"{identifier:<60} " + (f"median {result['median_ms']}ms  peak {result['peak_kb']}KB"
+                                             if 'error' not in result else result['error']), file=sys.stderr)
+                results.append(result)
+    return {
+        'benchmark': 'micro',
+        'version': REPORT_VERSION,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {'repeat': repeat, 'quick': quick, 'cases': names},
+        'environment': {**environment_info(), 'packages': package_versions()},
+        'results': results,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """按结果标识对比中位耗时和峰值内存（变化为正表示变慢/占用更多）"""
+    before = {item['id']: item for item in baseline.get('results', []) if 'error' not in item}
+    after = {item['id']: item for item in candidate.get('results', []) if 'error' not in item}
+    compared = {}
+    for identifier in before:
+        if identifier not in after:
+            continue
+        compared[identifier] = {
+            name: {'baseline': before[identifier][name], 'candidate': after[identifier][name],
+                   'change_pct': change_pct(before[identifier][name], after[identifier][name])}
+            for name in ('median_ms', 'min_ms', 'peak_kb')
+        }
+    return {
+        'results': compared,
+        'missing': sorted(set(before) - set(after)),
+        'added': sorted(set(after) - set(before)),
+    }
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.micro', description='CPU密集路径微基准测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('list', help='列出所有测试项和参数')
+
+    run = subparsers.add_parser('run', help='执行测试')
+    run.add_argument('--case', action='append', choices=sorted(CASES), help='只运行指定测试项，可重复')
+    run.add_argument('--repeat', type=int, default=5, help='每组参数的计时次数')
+    run.add_argument('--quick', action='store_true', help='只使用较小的参数，快速检查')
+    run.add_argument('--output', '-o', default='-', help='JSON结果输出文件，默认标准输出')
+
+    compare = subparsers.add_parser('compare', help='对比两次测试结果')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--threshold', type=float, help='任一项中位耗时变慢超过该百分比时返回非零')
+    compare.add_argument('--output', '-o', default='-')
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'list':
+        for case in CASES.values():
+            print(f"{case.name:<24} {case.description}")
+            print(f"{'':<24} 参数: {case.grid}")
+        return 0
+
+    if args.command == 'run':
+        report = run_benchmarks(args.case or list(CASES), max(1, args.repeat), args.quick)
+        write_json(report, args.output)
+        return 1 if any('error' in item for item in report['results']) else 0
+
+    with open(args.baseline, encoding='utf-8') as f:
+        baseline = json.load(f)
+    with open(args.candidate, encoding='utf-8') as f:
+        candidate = json.load(f)
+    result = compare_results(baseline, candidate)
+    write_json(result, args.output)
+    if args.threshold is None:
+        return 0
+    regressions = [identifier for identifier, metrics in result['results'].items()
+                   if (metrics['median_ms']['change_pct'] or 0) > args.threshold]
+    if regressions:
+        print(f"中位耗时变慢超过 {args.threshold}%: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
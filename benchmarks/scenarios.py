@@ -0,0 +1,187 @@
+"""
+基准测试场景
+KioskSession 模拟展台前台的一次完整会话：验证授权码、加载主题背景/分类/图案、浏览产品并拉取图片、归档效果图；
+AdminSession 模拟后台同时进行的管理操作：查看访问日志和归档、上传图案、导出Excel
+"""
+import base64
+import random
+import time
+from io import BytesIO
+from typing import Any, Callable, Dict, List, Optional
+
+from .clients import BenchResponse
+
+# 记录函数：(标签, 耗时秒, 错误信息或None)
+RecordFunc = Callable[[str, float, Optional[str]], None]
+
+# 导出时选择的字段（不含图片字段，避免导出耗时被归档图片数量主导）
+EXPORT_FIELDS = ['access_code', 'effect_category', 'register_time', 'follow_up_person', 'register_info']
+
+
+def sample_png(width: int = 512, height: int = 512) -> bytes:
+    """生成固定内容的PNG，保证每次测试上传的数据一致"""
+    from PIL import Image
+
+    red = Image.linear_gradient('L').resize((width, height))
+    green = Image.radial_gradient('L').resize((width, height))
+    blue = red.transpose(Image.Transpose.ROTATE_90)
+    buffer = BytesIO()
+    Image.merge('RGB', (red, green, blue)).save(buffer, format='PNG')
+    return buffer.getvalue()
+
+
+def _upload_url(path: str) -> str:
+    """数据库中的文件路径转为访问URL（兼容Windows路径分隔符）"""
+    path = path.replace('\\', '/')
+    return path if path.startswith('/') else '/' + path
+
+
+def _upload_label(url: str) -> str:
+    """图片请求按上传目录归类，如 GET /uploads/patterns"""
+    parts = url.strip('/').split('/')
+    return 'GET /' + '/'.join(parts[:2]) if len(parts) > 2 else 'GET /uploads'
+
+
+class Scenario:
+    """场景基类：计时、校验响应并记录结果"""
+
+    def __init__(self, client, record: RecordFunc, rng: random.Random):
+        self.client = client
+        self.record = record
+        self.rng = rng
+
+    def call(self, label: str, method: str, path: str, expect_status: int = 200,
+             check_json: bool = True, **kwargs) -> Optional[BenchResponse]:
+        started = time.perf_counter()
+        try:
+            response = self.client.request(method, path, **kwargs)
+        except Exception as e:
+            self.record(label, time.perf_counter() - started, f'{type(e).__name__}: {e}')
+            return None
+        elapsed = time.perf_counter() - started
+
+        error = None
+        if response.status != expect_status:
+            error = f'HTTP {response.status}'
+        elif check_json:
+            payload = response.json()
+            if isinstance(payload, dict) and payload.get('success') is False:
+                error = str(payload.get('message') or payload.get('error') or 'success=false')[:120]
+        self.record(label, elapsed, error)
+        return response if error is None else None
+
+    @staticmethod
+    def data_of(response: Optional[BenchResponse]) -> List[Dict[str, Any]]:
+        payload = response.json() if response else None
+        if isinstance(payload, dict) and isinstance(payload.get('data'), list):
+            return payload['data']
+        return []
+
+
+class KioskSession(Scenario):
+    """前台一次会话，每次运行使用新的客户端（新的Cookie）"""
+
+    def __init__(self, client, record: RecordFunc, rng: random.Random, access_code: str,
+                 effect_image: bytes, browse_rounds: int = 3, archive_probability: float = 0.3,
+                 theme: str = 'default'):
+        super().__init__(client, record, rng)
+        self.access_code = access_code
+        self.effect_image_data = 'data:image/png;base64,' + base64.b64encode(effect_image).decode('ascii')
+        self.browse_rounds = browse_rounds
+        self.archive_probability = archive_probability
+        self.theme = theme
+
+    def fetch(self, url: str):
+        self.call(_upload_label(url), 'GET', url, check_json=False)
+
+    def run(self):
+        started = time.perf_counter()
+        login = self.call('POST /verify-access-code', 'POST', '/verify-access-code',
+                          form={'access_code': self.access_code, 'redirect_to': 'pattern_editor'})
+        if login is None:
+            self.record('session', time.perf_counter() - started, 'login failed')
+            return
+
+        backgrounds = self.data_of(self.call('GET /api/theme-backgrounds', 'GET',
+                                             f'/api/theme-backgrounds?theme={self.theme}'))
+        categories = self.data_of(self.call('GET /api/categories', 'GET', '/api/categories'))
+        patterns = self.data_of(self.call('GET /api/patterns', 'GET', '/api/patterns'))
+        if backgrounds:
+            self.fetch(backgrounds[0]['url'])
+
+        product = pattern = None
+        for _ in range(self.browse_rounds):
+            if categories:
+                category = self.rng.choice(categories)
+                products = self.data_of(self.call('GET /api/products', 'GET',
+                                                  f"/api/products?category_id={category['id']}"))
+                if products:
+                    product = self.rng.choice(products)
+                    if product.get('product_image_path'):
+                        self.fetch(f"/uploads/products/{product['product_image_path']}")
+                    if product.get('depth_image_path'):
+                        self.fetch(f"/uploads/depth_maps/{product['depth_image_path']}")
+            if patterns:
+                pattern = self.rng.choice(patterns)
+                if pattern.get('file_path'):
+                    self.fetch(_upload_url(pattern['file_path']))
+
+        if product and self.rng.random() < self.archive_probability:
+            self.call('POST /api/archive', 'POST', '/api/archive', json_body={
+                'registerPerson': 'benchmark',
+                'registerInfo': 'load test',
+                'effectCategory': '基础效果',
+                'productId': product['id'],
+                'patternId': pattern['id'] if pattern else None,
+                'effectImageData': self.effect_image_data,
+            })
+        self.record('session', time.perf_counter() - started, None)
+
+
+class AdminSession(Scenario):
+    """后台管理员，登录一次后按权重循环执行管理操作"""
+
+    # (操作名, 权重)
+    ACTIONS = [('view_access_logs', 4), ('view_archives', 2), ('upload_pattern', 2), ('export_archives', 1)]
+
+    def __init__(self, client, record: RecordFunc, rng: random.Random, username: str, password: str,
+                 pattern_image: bytes, worker_id: int):
+        super().__init__(client, record, rng)
+        self.username = username
+        self.password = password
+        self.pattern_image = pattern_image
+        self.worker_id = worker_id
+        self.uploads = 0
+        self.logged_in = False
+
+    def login(self) -> bool:
+        # 登录成功时重定向到首页
+        response = self.call('POST /login', 'POST', '/login', expect_status=302, check_json=False,
+                             form={'username': self.username, 'password': self.password})
+        self.logged_in = response is not None
+        return self.logged_in
+
+    def run(self):
+        if not self.logged_in and not self.login():
+            return
+        names = [name for name, _ in self.ACTIONS]
+        weights = [weight for _, weight in self.ACTIONS]
+        getattr(self, self.rng.choices(names, weights)[0])()
+
+    def view_access_logs(self):
+        self.call('GET /admin/access-logs/', 'GET', '/admin/access-logs/', check_json=False)
+
+    def view_archives(self):
+        self.call('GET /admin/product_archives/', 'GET', '/admin/product_archives/', check_json=False)
+
+    def upload_pattern(self):
+        self.uploads += 1
+        # 名称不能重复，文件名中也带上序号避免同一秒上传的文件互相覆盖
+        name = f'bench_{self.worker_id}_{self.uploads}_{self.rng.randrange(1 << 30)}'
+        self.call('POST /admin/patterns/add', 'POST', '/admin/patterns/add',
+                  form={'name': name}, files={'file': (f'{name}.png', self.pattern_image, 'image/png')})
+
+    def export_archives(self):
+        # 导出成功时返回Excel文件，失败时返回 success=false 的JSON
+        self.call('POST /admin/product_archives/export', 'POST', '/admin/product_archives/export',
+                  json_body={'fields': EXPORT_FIELDS})
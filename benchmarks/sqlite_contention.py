@@ -0,0 +1,510 @@
+"""
+多进程SQLite争用压力测试
+
+用多个进程同时对同一个数据库文件执行前台和后台的真实写入路径（backend/database.py 与批量导入的事务），
+统计事务耗时、database is locked 等忙错误和锁等待：
+    python -m benchmarks.sqlite_contention run --mix batch_upload --duration 20 --output contention.json
+    python -m benchmarks.sqlite_contention run --frontend-procs 12 --admin-procs 2 --admin-op clear_offline=1
+    python -m benchmarks.sqlite_contention compare before.json after.json
+
+流程：复制 database.db（或新建）到临时目录并预置访问记录 → 每类进程依次单独运行得到无争用基线 →
+在新的副本上所有进程同时运行。锁等待按"争用下耗时 - 单独运行的中位耗时"估算，
+因为 sqlite3 模块不暴露忙等待回调。数据库连接沿用 get_db_connection()，存储层的改动会直接体现在结果中
+"""
+import argparse
+import contextlib
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+from .stats import PROJECT_ROOT, change_pct, environment_info, percentile, summarize, write_json
+
+REPORT_VERSION = 1
+
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+BENCH_ACCESS_CODE = 'BENCH2024'
+
+# 前台进程的操作权重：每个前台请求都会检查会话并更新活动时间，是最主要的写入
+FRONTEND_OPS = {'session_check': 20, 'catalog_read': 6, 'login': 2, 'logout': 1, 'archive': 1}
+
+# 预设的后台负载
+MIXES = {
+    'kiosk_rush': {'frontend_procs': 8, 'admin_procs': 1, 'admin_ops': {'view_logs': 5, 'force_logout': 1}},
+    'batch_upload': {'frontend_procs': 6, 'admin_procs': 1, 'admin_ops': {'batch_upload': 1}},
+    'log_cleanup': {'frontend_procs': 6, 'admin_procs': 1, 'admin_ops': {'clear_offline': 1, 'view_logs': 1}},
+    'mixed': {'frontend_procs': 6, 'admin_procs': 2,
+              'admin_ops': {'batch_upload': 1, 'clear_offline': 1, 'view_logs': 3, 'force_logout': 1}},
+}
+
+
+def is_busy_error(error: Exception) -> bool:
+    message = str(error).lower()
+    return isinstance(error, sqlite3.OperationalError) and ('locked' in message or 'busy' in message)
+
+
+class WorkerContext:
+    """单个进程的状态：随机数、已登录的会话、批量上传序号"""
+
+    def __init__(self, role: str, index: int, seed: int, batch_size: int):
+        self.role = role
+        self.index = index
+        self.rng = random.Random(seed)
+        self.batch_size = batch_size
+        self.sessions: List[str] = []
+        self.batches = 0
+
+
+# ---- 前台写入路径 ----
+
+def _live_sessions():
+    """与 app.py 一样使用在线会话登记（首次使用时从数据库重建并启动同步线程），快照写在数据库副本旁边"""
+    from backend import database
+    from backend.session_registry import live_sessions
+
+    live_sessions.directory = os.path.join(os.path.dirname(database.DATABASE_PATH), 'live_sessions')
+    live_sessions.start()
+    return live_sessions
+
+
+def op_session_check(ctx: WorkerContext):
+    """与 app.py 的 before_request 一致：检查会话状态并记录活动时间（由同步线程批量写回）"""
+    registry = _live_sessions()
+    if not ctx.sessions:
+        return op_login(ctx)
+    session_id = ctx.rng.choice(ctx.sessions)
+    if registry.is_active(session_id):
+        registry.touch(session_id)
+    else:
+        ctx.sessions.remove(session_id)
+
+
+def op_login(ctx: WorkerContext):
+    """与 /verify-access-code 一致：校验授权码、递增使用次数、写入访问记录"""
+    from backend.database import DatabaseManager
+
+    DatabaseManager.execute_query('''
+        SELECT * FROM access_codes
+        WHERE code = ? AND is_active = 1
+        AND (expires_at IS NULL OR expires_at >= datetime('now', 'localtime'))
+        AND (max_uses IS NULL OR used_count < max_uses)
+    ''', (BENCH_ACCESS_CODE,))
+    DatabaseManager.execute_update("UPDATE access_codes SET used_count = used_count + 1 WHERE code = ?",
+                                   (BENCH_ACCESS_CODE,))
+    session_id = str(uuid.uuid4())
+    log_id = DatabaseManager.add_access_log(session_id, BENCH_ACCESS_CODE, '127.0.0.1', '未知地区',
+                                            'Chrome 120', 'Windows 10', 'benchmark')
+    _live_sessions().register(session_id, log_id, BENCH_ACCESS_CODE)
+    ctx.sessions.append(session_id)
+    # 控制会话池大小，模拟访客陆续离开
+    if len(ctx.sessions) > 50:
+        ctx.sessions.pop(0)
+
+
+def op_logout(ctx: WorkerContext):
+    if ctx.sessions:
+        _live_sessions().logout(ctx.sessions.pop(ctx.rng.randrange(len(ctx.sessions))))
+
+
+def op_catalog_read(ctx: WorkerContext):
+    from backend.database import DatabaseManager
+
+    DatabaseManager.get_patterns()
+    DatabaseManager.get_products()
+
+
+def op_archive(ctx: WorkerContext):
+    from backend.database import DatabaseManager
+
+    DatabaseManager.add_product_archive(
+        access_code=BENCH_ACCESS_CODE, original_product_image='bench.png', original_depth_image='bench_depth.png',
+        effect_image='effect_bench.png', effect_category='基础效果', register_info='contention benchmark',
+        follow_up_person='benchmark', original_product_path='original_product_bench.png',
+        original_depth_path='original_depth_bench.png', effect_image_path='effect_bench.png'
+    )
+
+
+# ---- 后台写入路径 ----
+
+def op_batch_upload(ctx: WorkerContext):
+    """与批量上传图案一致：一次查询重名后在单个事务中写入整批记录"""
+    from backend.database import get_db_connection
+    from backend.pattern_importer import BatchPatternImporter, PatternUploadItem, find_existing_pattern_names
+
+    ctx.batches += 1
+    items = []
+    for index in range(ctx.batch_size):
+        name = f'bench_{os.getpid()}_{ctx.batches}_{index}'
+        item = PatternUploadItem(index, f'{name}.png', b'', name)
+        item.stored_filename = f'pattern_{name}.png'
+        item.file_path = os.path.join('uploads', 'patterns', item.stored_filename)
+        item.file_size, item.image_width, item.image_height = 102400, 1024, 1024
+        item.status = 'processed'
+        items.append(item)
+
+    importer = BatchPatternImporter(upload_dir=os.path.join('uploads', 'patterns'))
+    conn = get_db_connection()
+    try:
+        existing = find_existing_pattern_names(conn.cursor(), (item.pattern_name for item in items))
+        importer._commit(conn, items, existing)
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+
+def op_clear_offline(ctx: WorkerContext):
+    """与访问记录页面的"归档离线记录"一致（分批移入归档文件），归档文件写在数据库副本旁边"""
+    from backend import database
+    from backend.access_log_archive import archive_closed_logs
+
+    archive_dir = os.path.join(os.path.dirname(database.DATABASE_PATH), 'access_log_archive')
+    archive_closed_logs(older_than_days=None, archive_dir=archive_dir)
+
+
+def op_view_logs(ctx: WorkerContext):
+    from backend.database import DatabaseManager
+
+    DatabaseManager.get_access_logs()
+
+
+def op_force_logout(ctx: WorkerContext):
+    from backend.database import DatabaseManager
+
+    rows = DatabaseManager.execute_query("SELECT MAX(id) AS max_id FROM access_logs")
+    max_id = rows[0]['max_id'] if rows and rows[0]['max_id'] else 0
+    if max_id:
+        DatabaseManager.force_logout_access_log(ctx.rng.randint(1, max_id))
+
+
+OPERATIONS: Dict[str, Callable[[WorkerContext], None]] = {
+    'session_check': op_session_check,
+    'login': op_login,
+    'logout': op_logout,
+    'catalog_read': op_catalog_read,
+    'archive': op_archive,
+    'batch_upload': op_batch_upload,
+    'clear_offline': op_clear_offline,
+    'view_logs': op_view_logs,
+    'force_logout': op_force_logout,
+}
+
+
+def prepare_database(path: str, source: Optional[str], seed_logs: int, offline_ratio: float, seed: int):
+    """准备测试数据库：复制或新建、升级结构，并预置授权码和访问记录"""
+    from backend import database
+
+    if source and os.path.exists(source):
+        shutil.copy2(source, path)
+    database.DATABASE_PATH = path
+    database.init_database()
+
+    rng = random.Random(seed)
+    started = datetime(2025, 8, 1, 9, 0, 0)
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("INSERT OR IGNORE INTO access_codes (code, description, is_active) VALUES (?, ?, 1)",
+                     (BENCH_ACCESS_CODE, '压力测试授权码'))
+        rows = []
+        for index in range(seed_logs):
+            login_time = (started + timedelta(seconds=index * 30)).strftime('%Y-%m-%d %H:%M:%S')
+            rows.append((f'seed-{index}', BENCH_ACCESS_CODE, f'192.168.1.{index % 250}', '未知地区',
+                         'Chrome 120', 'Windows 10', 'benchmark', login_time, login_time,
+                         0 if rng.random() < offline_ratio else 1))
+        conn.executemany('''
+            INSERT INTO access_logs
+            (session_id, access_code, ip_address, location, browser, operating_system, user_agent,
+             login_time, last_activity, is_active)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        ''', rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def database_settings(path: str) -> Dict[str, Any]:
+    """记录 get_db_connection() 实际使用的日志模式等设置"""
+    from backend import database
+
+    database.DATABASE_PATH = path
+    conn = database.get_db_connection()
+    try:
+        settings = {}
+        for pragma in ('journal_mode', 'busy_timeout', 'synchronous', 'locking_mode'):
+            settings[pragma] = conn.execute(f'PRAGMA {pragma}').fetchone()[0]
+        return settings
+    finally:
+        conn.close()
+
+
+def _process_main(role: str, index: int, db_path: str, ops: Dict[str, int], seed: int, batch_size: int,
+                  start_at: float, duration: float, pause: float, results):
+    """子进程入口：等到统一开始时间后循环执行操作，结束后把原始样本放入结果队列"""
+    from backend import database
+
+    database.DATABASE_PATH = db_path
+    ctx = WorkerContext(role, index, seed, batch_size)
+    names = list(ops)
+    weights = [ops[name] for name in names]
+    samples: Dict[str, Dict[str, Any]] = {name: {'latencies': [], 'busy': 0, 'errors': {}} for name in names}
+
+    delay = start_at - time.time()
+    if delay > 0:
+        time.sleep(delay)
+    deadline = time.perf_counter() + duration
+    while time.perf_counter() < deadline:
+        name = ctx.rng.choices(names, weights)[0]
+        record = samples[name]
+        started = time.perf_counter()
+        try:
+            OPERATIONS[name](ctx)
+        except Exception as e:
+            if is_busy_error(e):
+                record['busy'] += 1
+            else:
+                message = f'{type(e).__name__}: {e}'[:120]
+                record['errors'][message] = record['errors'].get(message, 0) + 1
+        record['latencies'].append(time.perf_counter() - started)
+        if pause > 0:
+            time.sleep(ctx.rng.uniform(0, pause * 2))
+    results.put({'role': role, 'index': index, 'pid': os.getpid(), 'samples': samples})
+
+
+def run_processes(db_path: str, specs: List[Dict[str, Any]], duration: float, batch_size: int,
+                  seed: int) -> List[Dict[str, Any]]:
+    """启动一组进程并收集结果，所有进程在同一时刻开始"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    # 留出子进程启动和导入模块的时间
+    start_at = time.time() + 2.0 + 0.2 * len(specs)
+    processes = []
+    for number, spec in enumerate(specs):
+        process = context.Process(target=_process_main, args=(
+            spec['role'], spec['index'], db_path, spec['ops'], seed * 1000 + number, batch_size,
+            start_at, duration, spec['pause'], results))
+        process.start()
+        processes.append(process)
+
+    collected = []
+    for _ in processes:
+        try:
+            collected.append(results.get(timeout=duration + 120))
+        except Exception:
+            break
+    for process in processes:
+        process.join(timeout=30)
+        if process.is_alive():
+            process.terminate()
+    if len(collected) < len(processes):
+        raise RuntimeError(f'只有 {len(collected)}/{len(processes)} 个进程返回结果')
+    return collected
+
+
+def merge_samples(collected: List[Dict[str, Any]]) -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """按角色合并各进程的原始样本"""
+    merged: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for result in collected:
+        role_ops = merged.setdefault(result['role'], {})
+        for name, record in result['samples'].items():
+            target = role_ops.setdefault(name, {'latencies': [], 'busy': 0, 'errors': {}})
+            target['latencies'].extend(record['latencies'])
+            target['busy'] += record['busy']
+            for message, count in record['errors'].items():
+                target['errors'][message] = target['errors'].get(message, 0) + count
+    return merged
+
+
+def summarize_role(ops: Dict[str, Dict[str, Any]], duration: float,
+                   baseline: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """汇总一个角色的各操作，提供基线时估算锁等待"""
+    summary = {}
+    for name, record in sorted(ops.items()):
+        latencies = record['latencies']
+        if not latencies:
+            continue
+        other_errors = sum(record['errors'].values())
+        stats = summarize(latencies, record['busy'] + other_errors, duration)
+        stats['busy_errors'] = record['busy']
+        if record['errors']:
+            stats['error_messages'] = record['errors']
+        solo = (baseline or {}).get(name)
+        if solo and solo.get('count'):
+            solo_median = solo['p50_ms'] / 1000.0
+            waits = sorted(max(0.0, value - solo_median) for value in latencies)
+            stats['lock_wait_est_mean_ms'] = round(sum(waits) / len(waits) * 1000, 3)
+            stats['lock_wait_est_p95_ms'] = round(percentile(waits, 95) * 1000, 3)
+            stats['lock_wait_est_total_s'] = round(sum(waits), 3)
+        summary[name] = stats
+    return summary
+
+
+def run_contention(args) -> Dict[str, Any]:
+    mix = dict(MIXES[args.mix])
+    if args.frontend_procs is not None:
+        mix['frontend_procs'] = args.frontend_procs
+    if args.admin_procs is not None:
+        mix['admin_procs'] = args.admin_procs
+    if args.admin_op:
+        mix['admin_ops'] = dict(args.admin_op)
+
+    workdir = tempfile.mkdtemp(prefix='autodecal_contention_')
+    try:
+        base_path = os.path.join(workdir, 'base.db')
+        source = None if args.fresh else args.source
+        prepare_database(base_path, source, args.seed_logs, args.offline_ratio, args.seed)
+        settings = database_settings(base_path)
+
+        frontend_spec = {'role': 'frontend', 'ops': FRONTEND_OPS, 'pause': args.frontend_pause}
+        admin_spec = {'role': 'admin', 'ops': mix['admin_ops'], 'pause': args.admin_pause}
+
+        # 无争用基线：每类进程单独运行
+        baseline: Dict[str, Dict[str, Any]] = {}
+        if args.calibration > 0:
+            for spec in (frontend_spec, admin_spec):
+                calibration_path = os.path.join(workdir, f"calibration_{spec['role']}.db")
+                shutil.copy2(base_path, calibration_path)
+                collected = run_processes(calibration_path, [{**spec, 'index': 0}], args.calibration,
+                                          args.batch_size, args.seed)
+                solo_ops = merge_samples(collected).get(spec['role'], {})
+                baseline[spec['role']] = summarize_role(solo_ops, args.calibration)
+                print(f"[基线] {spec['role']} 完成", file=sys.stderr)
+
+        contention_path = os.path.join(workdir, 'contention.db')
+        shutil.copy2(base_path, contention_path)
+        specs = ([{**frontend_spec, 'index': index} for index in range(mix['frontend_procs'])]
+                 + [{**admin_spec, 'index': index} for index in range(mix['admin_procs'])])
+        collected = run_processes(contention_path, specs, args.duration, args.batch_size, args.seed)
+        merged = merge_samples(collected)
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    contended = {role: summarize_role(ops, args.duration, baseline.get(role)) for role, ops in merged.items()}
+    all_latencies = [value for ops in merged.values() for record in ops.values() for value in record['latencies']]
+    busy = sum(record['busy'] for ops in merged.values() for record in ops.values())
+    other = sum(sum(record['errors'].values()) for ops in merged.values() for record in ops.values())
+    totals = summarize(all_latencies, busy + other, args.duration)
+    totals['busy_errors'] = busy
+
+    return {
+        'benchmark': 'sqlite_contention',
+        'version': REPORT_VERSION,
+        'started_at': datetime.now().isoformat(timespec='seconds'),
+        'config': {
+            'mix': args.mix,
+            'frontend_procs': mix['frontend_procs'],
+            'admin_procs': mix['admin_procs'],
+            'frontend_ops': FRONTEND_OPS,
+            'admin_ops': mix['admin_ops'],
+            'duration_s': args.duration,
+            'calibration_s': args.calibration,
+            'batch_size': args.batch_size,
+            'seed_logs': args.seed_logs,
+            'offline_ratio': args.offline_ratio,
+            'frontend_pause_s': args.frontend_pause,
+            'admin_pause_s': args.admin_pause,
+            'seed': args.seed,
+            'fresh': args.fresh,
+        },
+        'environment': environment_info(),
+        'database': settings,
+        'totals': totals,
+        'baseline': baseline,
+        'contended': contended,
+    }
+
+
+def compare_results(baseline: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """对比两次争用测试的总体和各操作指标"""
+    metrics = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'busy_errors', 'lock_wait_est_mean_ms')
+
+    def diff(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+        return {name: {'baseline': before.get(name), 'candidate': after.get(name),
+                       'change_pct': change_pct(before.get(name) or 0, after.get(name) or 0)}
+                for name in metrics if name in before or name in after}
+
+    operations = {}
+    for role, ops in baseline.get('contended', {}).items():
+        for name, stats in ops.items():
+            other = candidate.get('contended', {}).get(role, {}).get(name)
+            if other:
+                operations[f'{role}:{name}'] = diff(stats, other)
+    result = {'totals': diff(baseline['totals'], candidate['totals']), 'operations': operations,
+              'database': {'baseline': baseline.get('database'), 'candidate': candidate.get('database')}}
+    if baseline.get('config') != candidate.get('config'):
+        result['warning'] = '两次测试的配置不同，结果不可直接比较'
+    return result
+
+
+def _parse_weight(text: str):
+    name, _, weight = text.partition('=')
+    if name not in OPERATIONS:
+        raise argparse.ArgumentTypeError(f'未知操作 {name}，可选: {", ".join(OPERATIONS)}')
+    return name, int(weight or 1)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog='python -m benchmarks.sqlite_contention', description='多进程SQLite争用压力测试')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run = subparsers.add_parser('run', help='执行压力测试')
+    run.add_argument('--mix', choices=sorted(MIXES), default='mixed', help='预设负载')
+    run.add_argument('--frontend-procs', type=int, help='前台进程数（覆盖预设）')
+    run.add_argument('--admin-procs', type=int, help='后台进程数（覆盖预设）')
+    run.add_argument('--admin-op', action='append', type=_parse_weight, metavar='OP=WEIGHT',
+                     help='后台操作及权重（覆盖预设），可重复')
+    run.add_argument('--duration', type=float, default=20.0, help='争用阶段时长（秒）')
+    run.add_argument('--calibration', type=float, default=3.0, help='每类进程单独运行的基线时长（秒），0为跳过')
+    run.add_argument('--batch-size', type=int, default=200, help='批量上传每批的记录数')
+    run.add_argument('--seed-logs', type=int, default=20000, help='预置的访问记录数')
+    run.add_argument('--offline-ratio', type=float, default=0.7, help='预置访问记录中已离线的比例')
+    run.add_argument('--frontend-pause', type=float, default=0.0, help='前台操作间的平均间隔（秒）')
+    run.add_argument('--admin-pause', type=float, default=0.2, help='后台操作间的平均间隔（秒）')
+    run.add_argument('--source', default=os.path.join(PROJECT_ROOT, 'database.db'), help='复制的源数据库')
+    run.add_argument('--fresh', action='store_true', help='不复制源数据库，新建空库')
+    run.add_argument('--seed', type=int, default=42)
+    run.add_argument('--output', '-o', default='-', help='JSON结果输出文件，默认标准输出')
+
+    compare = subparsers.add_parser('compare', help='对比两次测试结果')
+    compare.add_argument('baseline')
+    compare.add_argument('candidate')
+    compare.add_argument('--output', '-o', default='-')
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    if args.command == 'compare':
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+        with open(args.candidate, encoding='utf-8') as f:
+            candidate = json.load(f)
+        write_json(compare_results(baseline, candidate), args.output)
+        return 0
+
+    # 数据库初始化的打印输出转到标准错误，避免混入标准输出的JSON结果
+    with contextlib.redirect_stdout(sys.stderr):
+        report = run_contention(args)
+    totals = report['totals']
+    print(f"{totals['count']} 次操作, {totals['throughput_rps']} ops/s, p95 {totals['p95_ms']}ms, "
+          f"忙错误 {totals['busy_errors']}", file=sys.stderr)
+    for role, ops in report['contended'].items():
+        for name, stats in ops.items():
+            print(f"    {role}:{name:<16} n={stats['count']:<7} p50={stats['p50_ms']:<9} p99={stats['p99_ms']:<10} "
+                  f"busy={stats['busy_errors']:<5} wait~{stats.get('lock_wait_est_mean_ms', '-')}ms", file=sys.stderr)
+    write_json(report, args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
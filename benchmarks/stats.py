@@ -0,0 +1,181 @@
+"""
+基准测试统计
+线程安全地收集每个接口的耗时样本，汇总为 p50/p95/p99、吞吐量和错误率，并支持两份报告对比；
+以及各基准测试共用的运行环境信息和JSON输出
+"""
+import json
+import math
+import os
+import platform
+import subprocess
+import threading
+import time
+from typing import Any, Dict, List, Optional
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=PROJECT_ROOT,
+                              capture_output=True, text=True, timeout=10).stdout.strip()
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def environment_info() -> Dict[str, Any]:
+    """记录运行环境，便于判断两份结果是否可比"""
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'git_commit': git_commit(),
+    }
+
+
+def write_json(data: Dict[str, Any], output: str):
+    """写入JSON文件，output 为空或 - 时输出到标准输出"""
+    text = json.dumps(data, ensure_ascii=False, indent=2)
+    if output and output != '-':
+        with open(output, 'w', encoding='utf-8') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+
+
+def change_pct(before: float, after: float) -> Optional[float]:
+    """变化百分比，基准值为0时无法计算"""
+    if not before:
+        return None
+    return round((after - before) / before * 100.0, 2)
+
+
+def percentile(sorted_values: List[float], q: float) -> float:
+    """线性插值分位数，sorted_values 需已升序排列"""
+    if not sorted_values:
+        return 0.0
+    if len(sorted_values) == 1:
+        return sorted_values[0]
+    position = (len(sorted_values) - 1) * q / 100.0
+    lower = math.floor(position)
+    upper = math.ceil(position)
+    if lower == upper:
+        return sorted_values[lower]
+    return sorted_values[lower] + (sorted_values[upper] - sorted_values[lower]) * (position - lower)
+
+
+def summarize(samples: List[float], errors: int, duration: float) -> Dict[str, Any]:
+    """汇总一组耗时样本（秒），输出毫秒"""
+    values = sorted(samples)
+    count = len(values)
+    return {
+        'count': count,
+        'errors': errors,
+        'error_rate': round(errors / count, 4) if count else 0.0,
+        'throughput_rps': round(count / duration, 3) if duration > 0 else 0.0,
+        'min_ms': round(values[0] * 1000, 3) if values else 0.0,
+        'mean_ms': round(sum(values) / count * 1000, 3) if values else 0.0,
+        'p50_ms': round(percentile(values, 50) * 1000, 3),
+        'p95_ms': round(percentile(values, 95) * 1000, 3),
+        'p99_ms': round(percentile(values, 99) * 1000, 3),
+        'max_ms': round(values[-1] * 1000, 3) if values else 0.0,
+    }
+
+
+class LatencyRecorder:
+    """按标签收集耗时样本，预热阶段的样本不计入"""
+
+    # 整段会话等非单个请求的标签，不计入总体请求统计
+    AGGREGATE_LABELS = frozenset({'session'})
+
+    def __init__(self):
+        self._samples: Dict[str, List[float]] = {}
+        self._errors: Dict[str, int] = {}
+        self._error_messages: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+        self.measure_started: Optional[float] = None
+        self.measure_stopped: Optional[float] = None
+
+    def start_measuring(self):
+        """结束预热，清空已有样本并开始计时"""
+        with self._lock:
+            self._samples.clear()
+            self._errors.clear()
+            self._error_messages.clear()
+            self.measure_started = time.perf_counter()
+
+    def stop_measuring(self):
+        with self._lock:
+            self.measure_stopped = time.perf_counter()
+
+    @property
+    def duration(self) -> float:
+        if self.measure_started is None:
+            return 0.0
+        stopped = self.measure_stopped or time.perf_counter()
+        return stopped - self.measure_started
+
+    def record(self, label: str, elapsed: float, error: Optional[str] = None):
+        with self._lock:
+            if self.measure_started is None or self.measure_stopped is not None:
+                return
+            self._samples.setdefault(label, []).append(elapsed)
+            if error:
+                self._errors[label] = self._errors.get(label, 0) + 1
+                messages = self._error_messages.setdefault(label, {})
+                messages[error] = messages.get(error, 0) + 1
+
+    def report(self) -> Dict[str, Any]:
+        """按标签和总体汇总"""
+        duration = self.duration
+        with self._lock:
+            endpoints = {}
+            all_samples = []
+            total_errors = 0
+            for label in sorted(self._samples):
+                samples = self._samples[label]
+                errors = self._errors.get(label, 0)
+                endpoints[label] = summarize(samples, errors, duration)
+                if errors:
+                    # 只保留出现最多的几种错误，便于定位
+                    messages = sorted(self._error_messages[label].items(), key=lambda item: -item[1])
+                    endpoints[label]['error_messages'] = dict(messages[:5])
+                if label in self.AGGREGATE_LABELS:
+                    continue
+                all_samples.extend(samples)
+                total_errors += errors
+        return {
+            'duration_s': round(duration, 3),
+            'totals': summarize(all_samples, total_errors, duration),
+            'endpoints': endpoints,
+        }
+
+
+def compare_reports(baseline: Dict[str, Any], candidate: Dict[str, Any]) -> Dict[str, Any]:
+    """对比两份报告，输出各指标的变化百分比（延迟为正表示变慢，吞吐量为正表示变快）"""
+    metrics = ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps', 'error_rate')
+
+    def diff(before: Dict[str, Any], after: Dict[str, Any]) -> Dict[str, Any]:
+        return {
+            name: {'baseline': before.get(name), 'candidate': after.get(name),
+                   'change_pct': change_pct(before.get(name) or 0.0, after.get(name) or 0.0)}
+            for name in metrics
+        }
+
+    result = {'totals': {}, 'endpoints': {}, 'missing': [], 'added': []}
+    for section in ('kiosk', 'admin', 'combined'):
+        before = baseline.get(section)
+        after = candidate.get(section)
+        if not before or not after:
+            continue
+        result['totals'][section] = diff(before['totals'], after['totals'])
+        for label, stats in before['endpoints'].items():
+            key = f'{section}:{label}'
+            if label in after['endpoints']:
+                result['endpoints'][key] = diff(stats, after['endpoints'][label])
+            else:
+                result['missing'].append(key)
+        for label in after['endpoints']:
+            if label not in before['endpoints']:
+                result['added'].append(f'{section}:{label}')
+    return result
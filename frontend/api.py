@@ -2,15 +2,22 @@
 前台API接口
 提供前台界面所需的数据接口
 """
-from flask import Blueprint, jsonify, request, session
+from flask import Blueprint, Response, jsonify, request, session
 from backend.database import DatabaseManager
 from backend.auth import AccessCodeManager, access_code_required
+from backend.catalog_snapshot import catalog
+import json
+import os
 import time
 
 def create_api_blueprint():
     """创建API蓝图"""
     api = Blueprint('api', __name__)
     
+    def _snapshot_response(body):
+        """返回目录快照中预序列化的响应体"""
+        return Response(body, mimetype='application/json')
+    
     @api.route('/validate_access', methods=['POST'])
     def validate_access():
         """验证访问授权码"""
@@ -30,9 +37,19 @@ def create_api_blueprint():
     @api.route('/patterns')
     @access_code_required
     def get_patterns():
-        """获取印花图案列表"""
+        """获取印花图案列表，color 参数（颜色名称或十六进制）按主色筛选并按色差排序"""
         try:
-            patterns = DatabaseManager.get_patterns()
+            snapshot = catalog.current()
+            color = request.args.get('color', '').strip()
+            if not color:
+                return _snapshot_response(snapshot.view('patterns'))
+            
+            from backend.pattern_colors import parse_color, filter_by_color, DEFAULT_COLOR_DISTANCE
+            rgb = parse_color(color)
+            if rgb is None:
+                return jsonify({'success': False, 'message': f'无法识别的颜色: {color}'})
+            max_distance = request.args.get('color_distance', DEFAULT_COLOR_DISTANCE, type=float)
+            patterns = filter_by_color(snapshot.patterns, rgb, max_distance)
             return jsonify({
                 'success': True,
                 'data': patterns
@@ -48,11 +65,7 @@ def create_api_blueprint():
     def get_categories():
         """获取产品分类列表"""
         try:
-            categories = DatabaseManager.get_categories()
-            return jsonify({
-                'success': True,
-                'data': categories
-            })
+            return _snapshot_response(catalog.current().view('categories'))
         except Exception as e:
             return jsonify({
                 'success': False,
@@ -65,27 +78,52 @@ def create_api_blueprint():
         """获取产品列表"""
         try:
             category_id = request.args.get('category_id', type=int)
-            products = DatabaseManager.get_products(category_id)
-            return jsonify({
-                'success': True,
-                'data': products
-            })
+            return _snapshot_response(catalog.current().view('products', category_id))
         except Exception as e:
             return jsonify({
                 'success': False,
                 'message': f'获取产品列表失败: {str(e)}'
             })
     
+    @api.route('/search')
+    @access_code_required
+    def search_catalog():
+        """全文搜索印花、产品及分类（q 为关键词，type 为逗号分隔的类型，page/per_page 分页）"""
+        from backend.search import search_request, FRONTEND_KINDS
+        return jsonify(search_request(request.args, FRONTEND_KINDS))
+    
+    @api.route('/bootstrap')
+    @access_code_required
+    def bootstrap():
+        """
+        编辑器首屏数据：印花、产品分类、默认分类（或 category_id 指定分类，all 为全部）的产品、
+        theme 主题的背景图；响应带版本标记ETag，数据未变化时返回304
+        """
+        from backend.bootstrap import bootstrap_cache, ALL_PRODUCTS
+        try:
+            theme = request.args.get('theme', 'default').strip() or 'default'
+            category_id = request.args.get('category_id', '').strip()
+            if category_id != ALL_PRODUCTS:
+                category_id = int(category_id) if category_id.isdigit() else None
+            
+            revision, body = bootstrap_cache.get(theme, category_id)
+            if revision in request.if_none_match:
+                response = Response(status=304)
+            else:
+                response = Response(body, mimetype='application/json')
+            response.set_etag(revision)
+            # 授权码保护的数据只允许浏览器缓存，每次使用前向服务器确认
+            response.headers['Cache-Control'] = 'private, no-cache'
+            return response
+        except Exception as e:
+            return jsonify({'success': False, 'message': f'获取启动数据失败: {str(e)}'})
+    
     @api.route('/default_category')
     @access_code_required
     def get_default_category():
         """获取默认分类"""
         try:
-            category = DatabaseManager.get_default_category()
-            return jsonify({
-                'success': True,
-                'data': category
-            })
+            return _snapshot_response(catalog.current().view('default_category'))
         except Exception as e:
             return jsonify({
                 'success': False,
@@ -142,23 +180,19 @@ def create_api_blueprint():
         """按主题列出可用背景图"""
         try:
             theme = request.args.get('theme', default='default', type=str)
-            # 从数据库获取主题背景图
-            backgrounds = DatabaseManager.get_theme_backgrounds(theme_name=theme)
-            
-            results = []
-            for bg in backgrounds:
-                results.append({
-                    'id': bg['id'],
-                    'name': bg['background_name'],
-                    'url': bg['file_path'],
-                    'theme': bg['theme_name'],
-                    'file_size': bg['file_size']
-                })
-            
-            return jsonify({'success': True, 'data': results})
+            return _snapshot_response(catalog.current().view('theme_backgrounds', theme))
         except Exception as e:
             return jsonify({'success': False, 'message': f'获取背景图失败: {str(e)}'})
     
+    def _load_render_sources(pattern_id, product_id):
+        """查询渲染所需的图案和产品记录"""
+        product_results = DatabaseManager.execute_query("SELECT * FROM products WHERE id = ?", (product_id,))
+        pattern_results = DatabaseManager.execute_query(
+            "SELECT * FROM patterns WHERE id = ?", (pattern_id,)
+        ) if pattern_id else []
+        return (pattern_results[0] if pattern_results else None,
+                product_results[0] if product_results else None)
+    
     @api.route('/archive', methods=['POST'])
     @access_code_required
     def archive_product():
@@ -173,6 +207,7 @@ def create_api_blueprint():
             product_id = data.get('productId')
             pattern_id = data.get('patternId')
             effect_image_data = data.get('effectImageData')
+            render_params = data.get('renderParams')
             
             if not register_person:
                 return jsonify({'success': False, 'message': '请填写登记人'})
@@ -180,22 +215,50 @@ def create_api_blueprint():
             if not product_id:
                 return jsonify({'success': False, 'message': '请先选择产品图'})
             
-            if not effect_image_data:
+            if not effect_image_data and not render_params:
                 return jsonify({'success': False, 'message': '请先生成效果图'})
             
             # 获取当前授权码
             access_code = session.get('access_code', '')
             
-            # 获取产品信息
-            product_query = "SELECT * FROM products WHERE id = ?"
-            product_results = DatabaseManager.execute_query(product_query, (product_id,))
-            if not product_results:
+            # 获取图案和产品信息
+            pattern, product = _load_render_sources(pattern_id, product_id)
+            if not product:
                 return jsonify({'success': False, 'message': '产品不存在'})
             
-            product = product_results[0]
+            # 默认保存访客画布上的效果图，渲染配方一并记录以便日后重绘；
+            # 只提交配方或指定 serverRender 时按配方在服务端渲染（相同素材和参数复用缓存）
+            from backend.render_cache import render_cache, build_render_key, pattern_asset_path, product_asset_paths
+            from backend.server_renderer import RenderError, build_recipe, limit_visitor_params, render_recipe
+            from backend.metrics import track_job
+            wants_server_render = bool(data.get('serverRender')) or not effect_image_data
+            try:
+                # 访客提交的画布尺寸限制在编辑器范围内，大尺寸重绘在后台进行
+                render_params = limit_visitor_params(render_params) if render_params else None
+                recipe = build_recipe(pattern, product, render_params) if render_params else None
+            except ValueError as e:
+                # 配方只是附加信息，有画布图片时照常归档
+                print(f"渲染参数无效: {e}")
+                if wants_server_render:
+                    return jsonify({'success': False, 'message': '渲染参数无效'})
+                render_params = recipe = None
+            server_render = bool(recipe) and wants_server_render
+            render_key = build_render_key(pattern, product, render_params) if server_render else None
+            effect_data = render_cache.get(render_key) if render_key else None
+            rendered = False
+            if server_render and effect_data is None:
+                product_path, depth_path = product_asset_paths(product)
+                try:
+                    with track_job('render'):
+                        effect_data = render_recipe(recipe, product_path, depth_path,
+                                                    pattern_asset_path(pattern) if pattern else None)
+                    rendered = True
+                except RenderError as e:
+                    # 有画布图片时退回保存画布图片
+                    if not effect_image_data:
+                        return jsonify({'success': False, 'message': f'服务端渲染失败: {e}'})
             
             # 创建归档目录
-            import os
             from datetime import datetime
             import base64
             
@@ -226,11 +289,18 @@ def create_api_blueprint():
             effect_filename = f"effect_{timestamp}.png"
             effect_path = os.path.join(archive_dir, effect_filename)
             
-            # 解码base64图片数据
-            if effect_image_data.startswith('data:image/png;base64,'):
-                image_data = effect_image_data.split(',')[1]
+            # 解码base64图片数据，或使用缓存/服务端渲染的效果图
+            if effect_data is None and effect_image_data.startswith('data:image/png;base64,'):
+                effect_data = base64.b64decode(effect_image_data.split(',')[1])
+            if effect_data is not None:
                 with open(effect_path, 'wb') as f:
-                    f.write(base64.b64decode(image_data))
+                    f.write(effect_data)
+                # 只缓存服务端渲染的结果，访客上传的图片不能进入共享缓存
+                if rendered and render_key:
+                    render_cache.put(render_key, effect_data, {
+                        'pattern_id': int(pattern_id) if pattern_id else None,
+                        'product_id': int(product_id)
+                    })
             
             # 保存归档记录到数据库
             # 保存归档记录到数据库
@@ -244,7 +314,8 @@ def create_api_blueprint():
                 follow_up_person=register_person,
                 original_product_path=archive_product_filename,
                 original_depth_path=archive_depth_filename,
-                effect_image_path=effect_filename
+                effect_image_path=effect_filename,
+                render_recipe=json.dumps(recipe, ensure_ascii=False) if recipe else None
             )
             
             return jsonify({
@@ -1,5 +1,10 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for
+import queue
+from datetime import datetime, timedelta
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, current_app, Response, stream_with_context
 from backend.database import DatabaseManager
+from backend.access_events import ensure_event_relay, format_sse, publish_access_event
+from backend.access_log_archive import (DEFAULT_RETENTION_DAYS, archive_closed_logs, archive_stats,
+                                        query_archived_logs)
 
 access_logs_bp = Blueprint('admin_access_logs', __name__, url_prefix='/admin/access-logs')
 
@@ -21,7 +26,12 @@ def access_logs():
     except Exception as e:
         print(f"获取访问记录失败: {e}")
         access_logs = []
-    return render_template('admin/access_logs.html', access_logs=access_logs)
+    try:
+        archive_info = archive_stats()
+    except Exception as e:
+        print(f"获取访问记录归档信息失败: {e}")
+        archive_info = None
+    return render_template('admin/access_logs.html', access_logs=access_logs, archive_info=archive_info)
 
 @access_logs_bp.route('/force-logout', methods=['POST'])
 @login_required
@@ -37,6 +47,7 @@ def force_logout_access():
         result = DatabaseManager.force_logout_access_log(log_id)
         
         if result > 0:
+            publish_access_event('force_logout', {'id': log_id})
             return jsonify({'success': True, 'message': '强制登出成功！'})
         else:
             return jsonify({'success': False, 'message': '访问记录不存在或已登出'})
@@ -60,15 +71,115 @@ def get_access_logs_by_code():
 @access_logs_bp.route('/clear-offline', methods=['POST'])
 @login_required
 def clear_offline_access_logs():
-    """清空已离线的访问记录"""
+    """归档已离线的访问记录（分批移入压缩归档文件，不再直接删除）"""
     try:
-        # 删除状态为已离线的访问记录（is_active = 0 表示已离线）
-        query = "DELETE FROM access_logs WHERE is_active = 0"
-        result = DatabaseManager.execute_update(query)
+        result = archive_closed_logs(older_than_days=None)
+        if result is None:
+            return jsonify({'success': False, 'message': '归档任务正在执行，请稍后再试'})
         
         return jsonify({
             'success': True,
-            'message': f'已清空 {result} 条离线访问记录'
+            'message': f"已归档 {result['archived']} 条离线访问记录"
         })
     except Exception as e:
-        return jsonify({'success': False, 'message': f'清空失败: {str(e)}'})
\ No newline at end of file
+        return jsonify({'success': False, 'message': f'归档失败: {str(e)}'})
+
+@access_logs_bp.route('/retention/run', methods=['POST'])
+@login_required
+def run_access_log_retention():
+    """立即按保留天数归档过期的离线访问记录"""
+    try:
+        days = current_app.config.get('ACCESS_LOG_RETENTION_DAYS')
+        result = archive_closed_logs(older_than_days=DEFAULT_RETENTION_DAYS if days is None else days)
+        if result is None:
+            return jsonify({'success': False, 'message': '归档任务正在执行，请稍后再试'})
+        
+        return jsonify({'success': True, 'message': f"已归档 {result['archived']} 条过期访问记录", 'data': result})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'归档失败: {str(e)}'})
+
+@access_logs_bp.route('/archived')
+@login_required
+def get_archived_access_logs():
+    """查询已归档的访问记录，支持授权码和登录时间范围筛选"""
+    try:
+        limit = min(max(request.args.get('limit', 200, type=int), 1), 1000)
+        logs = query_archived_logs(
+            access_code=request.args.get('code') or None,
+            start=request.args.get('start') or None,
+            end=request.args.get('end') or None,
+            limit=limit
+        )
+        return jsonify({'success': True, 'data': logs})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'查询失败: {str(e)}'})
+
+@access_logs_bp.route('/analytics')
+@login_required
+def access_analytics():
+    """授权码使用统计（读取按小时/天的汇总表），默认天粒度最近14天、小时粒度最近48小时"""
+    try:
+        granularity = 'hour' if request.args.get('granularity') == 'hour' else 'day'
+        now = datetime.now()
+        if granularity == 'hour':
+            default_start = (now - timedelta(hours=47)).strftime('%Y-%m-%d %H')
+        else:
+            default_start = (now - timedelta(days=13)).strftime('%Y-%m-%d')
+        start = request.args.get('start') or default_start
+        end = request.args.get('end') or None
+        rows = DatabaseManager.get_access_rollups(granularity, request.args.get('code') or None, start, end)
+        
+        # 按时间和按授权码合计
+        series = {}
+        by_code = {}
+        for row in rows:
+            for key, totals in ((row['bucket'], series), (row['access_code'], by_code)):
+                item = totals.setdefault(key, {'logins': 0, 'sessions_closed': 0, 'duration_seconds': 0.0, 'devices': 0})
+                item['logins'] += row['logins']
+                item['sessions_closed'] += row['sessions_closed']
+                item['duration_seconds'] += row['duration_seconds']
+                item['devices'] += row['devices'] or 0
+        
+        def summarize(key_name, totals):
+            return [{key_name: key, **item, 'duration_seconds': round(item['duration_seconds'], 1),
+                     'avg_duration_seconds': round(item['duration_seconds'] / item['sessions_closed'], 1)
+                     if item['sessions_closed'] else 0.0}
+                    for key, item in totals.items()]
+        
+        return jsonify({'success': True, 'data': {
+            'granularity': granularity,
+            'start': start,
+            'end': end,
+            'series': summarize('bucket', series),
+            'by_code': sorted(summarize('access_code', by_code), key=lambda item: -item['logins']),
+        }})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取统计失败: {str(e)}'})
+
+@access_logs_bp.route('/events')
+@login_required
+def access_log_events():
+    """访问记录实时事件（SSE）：login、logout、activity、force_logout"""
+    event_bus = ensure_event_relay()
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    subscriber = event_bus.subscribe(last_event_id)
+    
+    def generate():
+        try:
+            # 告知浏览器断线后的重连间隔
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = subscriber.get(timeout=15)
+                except queue.Empty:
+                    # 心跳，避免代理断开空闲连接
+                    yield ": keepalive\n\n"
+                    continue
+                yield format_sse(event)
+        finally:
+            event_bus.unsubscribe(subscriber)
+    
+    return Response(stream_with_context(generate()), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
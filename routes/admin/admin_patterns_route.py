@@ -1,9 +1,19 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash
+from flask import Response, stream_with_context
 from werkzeug.utils import secure_filename
 import os
+import json
 from datetime import datetime
-from PIL import Image
 from backend.database import DatabaseManager
+from backend.permissions import PermissionManager
+from backend.image_normalizer import ImageNormalizationError, normalize_image, store_normalized
+from backend.storage_reaper import schedule_delete, upload_path as stored_upload_path
+from backend.render_cache import clear_render_cache, invalidate_render_cache
+from backend.search import search_request
+from backend.pattern_colors import register_pattern_palette
+from backend.pattern_hash import (
+    DEFAULT_MAX_DISTANCE, get_pattern_hashes, pattern_index, register_pattern_image, similar_message
+)
 
 patterns_bp = Blueprint('admin_patterns', __name__, url_prefix='/admin/patterns')
 
@@ -54,23 +64,18 @@ def add_pattern():
         if existing_pattern:
             return jsonify({'success': False, 'message': f'图案名称"{name}"已存在，请使用其他名称'})
         
-        # 保存文件
+        # 规范化后保存文件（限制尺寸、去除元数据）
         original_filename = file.filename
         file_ext = os.path.splitext(original_filename)[1].lower()
         safe_name = secure_filename(os.path.splitext(original_filename)[0])
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         filename = f"pattern_{timestamp}_{safe_name}{file_ext}"
         
-        upload_path = os.path.join('uploads', 'patterns')
-        os.makedirs(upload_path, exist_ok=True)
-        file_path = os.path.join(upload_path, filename)
-        file.save(file_path)
-        
-        # 获取图片信息
-        with Image.open(file_path) as img:
-            width, height = img.size
-        
-        file_size = os.path.getsize(file_path)
+        data = file.read()
+        normalized = normalize_image(data, 'pattern')
+        filename, file_path = store_normalized(normalized, data, 'pattern', os.path.join('uploads', 'patterns'), filename)
+        width, height = normalized.width, normalized.height
+        file_size = len(normalized.data)
         
         # 创建图案记录
         query = '''
@@ -81,102 +86,79 @@ def add_pattern():
             name, filename, file_path, category_id, file_size, width, height, datetime.now()
         ))
         
+        # 计算感知哈希并检查近似图案（只提示）
+        similar = register_pattern_image(pattern_id, file_path)
+        register_pattern_palette(pattern_id, file_path)
+        
         return jsonify({
             'success': True, 
-            'message': f'印花图案"{name}"添加成功！',
-            'pattern_id': pattern_id
+            'message': f'印花图案"{name}"添加成功！{similar_message(similar)}',
+            'pattern_id': pattern_id,
+            'similar': similar
         })
         
+    except ImageNormalizationError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         return jsonify({'success': False, 'message': f'添加失败: {str(e)}'})
 
+def _batch_importer_items():
+    """读取批量上传的文件和分类，返回 (导入器, 待处理项)；没有文件时返回 None"""
+    from backend.pattern_importer import BatchPatternImporter
+    
+    files = [f for f in request.files.getlist('files') if f.filename]
+    if not files:
+        return None
+    try:
+        upload_data = json.loads(request.form.get('upload_data') or '{}')
+    except ValueError:
+        upload_data = {}
+    category_id = request.form.get('category_id', type=int) or 1
+    
+    # 在请求上下文内读取全部文件内容，后续处理在线程池中进行
+    payloads = [(f.filename, f.read()) for f in files]
+    importer = BatchPatternImporter(category_id=category_id)
+    return importer, importer.build_items(payloads, upload_data)
+
+@patterns_bp.route('/batch-import', methods=['POST'])
+@login_required
+def batch_import_patterns():
+    """批量导入印花图案，以NDJSON逐行返回进度和最终结果"""
+    from backend.pattern_importer import stream_ndjson
+    from backend.metrics import track_stream
+    
+    if not PermissionManager.has_action_permission('create'):
+        return jsonify({'success': False, 'message': '权限不足'}), 403
+    
+    prepared = _batch_importer_items()
+    if prepared is None:
+        return jsonify({'success': False, 'message': '请选择图片文件'})
+    importer, items = prepared
+    
+    return Response(
+        stream_with_context(stream_ndjson(track_stream('pattern_import', importer.run(items)))),
+        mimetype='application/x-ndjson'
+    )
+
 @patterns_bp.route('/batch-upload', methods=['POST'])
 @login_required
 def batch_upload_patterns():
-    """批量上传印花图案"""
+    """批量上传印花图案（旧接口，与 /batch-import 共用导入流程，全部处理完成后一次返回结果）"""
+    from backend.metrics import track_job
+    
+    if not PermissionManager.has_action_permission('create'):
+        return jsonify({'success': False, 'message': '权限不足'}), 403
+    
     try:
-        if 'files' not in request.files:
-            return jsonify({'success': False, 'message': '请选择图片文件'})
-        
-        files = request.files.getlist('files')
-        if not files or all(f.filename == '' for f in files):
+        prepared = _batch_importer_items()
+        if prepared is None:
             return jsonify({'success': False, 'message': '请选择图片文件'})
+        importer, items = prepared
         
-        # 获取分类ID
-        category_id = request.form.get('category_id', type=int) or 1
-        
-        results = []
-        success_count = 0
-        error_count = 0
-        
-        for file in files:
-            if file.filename == '':
-                continue
-                
-            try:
-                # 使用文件名作为图案名称（去掉扩展名）
-                original_filename = file.filename
-                pattern_name = os.path.splitext(original_filename)[0]
-                file_ext = os.path.splitext(original_filename)[1].lower()
-                
-                # 检查重名
-                existing_pattern = DatabaseManager.execute_query("SELECT id FROM patterns WHERE name = ?", (pattern_name,))
-                if existing_pattern:
-                    results.append({
-                        'filename': original_filename,
-                        'status': 'duplicate',
-                        'message': f'图案名称"{pattern_name}"已存在'
-                    })
-                    continue
-                
-                # 保存文件
-                safe_name = secure_filename(os.path.splitext(original_filename)[0])
-                timestamp = datetime.now().strftime('%Y%m%d_%H%M%S_%f')[:-3]
-                filename = f"pattern_{timestamp}_{safe_name}{file_ext}"
-                
-                upload_path = os.path.join('uploads', 'patterns')
-                os.makedirs(upload_path, exist_ok=True)
-                file_path = os.path.join(upload_path, filename)
-                file.save(file_path)
-                
-                # 获取图片信息
-                with Image.open(file_path) as img:
-                    width, height = img.size
-                
-                file_size = os.path.getsize(file_path)
-                
-                # 创建图案记录（使用指定的分类ID）
-                query = '''
-                    INSERT INTO patterns (name, filename, file_path, category_id, file_size, image_width, image_height, upload_time)
-                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
-                '''
-                pattern_id = DatabaseManager.execute_insert(query, (
-                    pattern_name, filename, file_path, category_id, file_size, width, height, datetime.now()
-                ))
-                
-                results.append({
-                    'filename': original_filename,
-                    'status': 'success',
-                    'message': f'上传成功',
-                    'pattern_id': pattern_id
-                })
-                success_count += 1
-                
-            except Exception as e:
-                results.append({
-                    'filename': file.filename,
-                    'status': 'error',
-                    'message': f'上传失败: {str(e)}'
-                })
-                error_count += 1
-        
-        return jsonify({
-            'success': True,
-            'message': f'批量上传完成！成功: {success_count} 个，失败: {error_count} 个',
-            'results': results,
-            'success_count': success_count,
-            'error_count': error_count
-        })
+        with track_job('pattern_import'):
+            summary = list(importer.run(items))[-1]
+        summary.pop('type', None)
+        return jsonify(summary)
         
     except Exception as e:
         return jsonify({'success': False, 'message': f'批量上传失败: {str(e)}'})
@@ -193,6 +175,38 @@ def get_existing_pattern_names():
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取失败: {str(e)}'})
 
+@patterns_bp.route('/search')
+@login_required
+def search_patterns():
+    """全文搜索印花图案和印花分类（q 为关键词，type 为逗号分隔的类型，page/per_page 分页），包含已停用的记录"""
+    return jsonify(search_request(request.args, ('pattern', 'pattern_category'), active_only=False))
+
+@patterns_bp.route('/similar')
+@login_required
+def similar_patterns():
+    """查找与指定图案近似的图案（max_distance 为pHash汉明距离上限，0~64）"""
+    try:
+        pattern_id = request.args.get('id', type=int)
+        if not pattern_id:
+            return jsonify({'success': False, 'message': '缺少图案ID'})
+        
+        max_distance = max(0, min(request.args.get('max_distance', DEFAULT_MAX_DISTANCE, type=int), 64))
+        hashes = get_pattern_hashes(pattern_id)
+        if hashes is None:
+            # 尚未补算哈希的图案现场计算
+            results = DatabaseManager.execute_query("SELECT filename FROM patterns WHERE id = ?", (pattern_id,))
+            if not results:
+                return jsonify({'success': False, 'message': '图案不存在'})
+            register_pattern_image(pattern_id, stored_upload_path('patterns', results[0]['filename']))
+            hashes = get_pattern_hashes(pattern_id)
+            if hashes is None:
+                return jsonify({'success': False, 'message': '无法读取图案图片'})
+        
+        similar = pattern_index.find_similar(hashes[0], hashes[1], max_distance, exclude=[pattern_id], limit=24)
+        return jsonify({'success': True, 'data': similar})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'查找近似图案失败: {str(e)}'})
+
 @patterns_bp.route('/get')
 @login_required
 def get_pattern():
@@ -228,6 +242,7 @@ def update_pattern():
         # 构建更新字段和参数
         update_fields = ["name = ?", "category_id = ?"]
         params = [name, category_id]
+        replaced_files = []
         
         # 处理文件上传
         if 'file' in request.files and request.files['file'].filename != '':
@@ -237,29 +252,22 @@ def update_pattern():
             query = "SELECT filename, file_path FROM patterns WHERE id = ?"
             old_pattern = DatabaseManager.execute_query(query, (pattern_id,))
             
-            # 保存新文件
+            # 规范化后保存新文件
             original_filename = file.filename
             file_ext = os.path.splitext(original_filename)[1].lower()
             safe_name = secure_filename(os.path.splitext(original_filename)[0])
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             filename = f"pattern_{timestamp}_{safe_name}{file_ext}"
             
-            upload_path = os.path.join('uploads', 'patterns')
-            os.makedirs(upload_path, exist_ok=True)
-            file_path = os.path.join(upload_path, filename)
-            file.save(file_path)
-            
-            # 获取新图片信息
-            with Image.open(file_path) as img:
-                width, height = img.size
+            data = file.read()
+            normalized = normalize_image(data, 'pattern')
+            filename, file_path = store_normalized(normalized, data, 'pattern', os.path.join('uploads', 'patterns'), filename)
+            width, height = normalized.width, normalized.height
+            file_size = len(normalized.data)
             
-            file_size = os.path.getsize(file_path)
-            
-            # 删除旧文件
+            # 旧文件在更新成功后删除
             if old_pattern:
-                old_file_path = old_pattern[0]['file_path']
-                if os.path.exists(old_file_path):
-                    os.remove(old_file_path)
+                replaced_files.append(old_pattern[0]['file_path'])
             
             # 添加文件相关字段到更新列表
             update_fields.extend([
@@ -280,9 +288,19 @@ def update_pattern():
         result = DatabaseManager.execute_update(query, tuple(params))
         
         if result > 0:
-            return jsonify({'success': True, 'message': '印花图案更新成功！'})
+            schedule_delete('patterns', replaced_files)
+            similar = []
+            if replaced_files:
+                # 图案文件已替换，使用旧图的效果图缓存失效
+                invalidate_render_cache(pattern_id=pattern_id)
+                similar = register_pattern_image(pattern_id, file_path)
+                register_pattern_palette(pattern_id, file_path)
+            return jsonify({'success': True, 'message': f'印花图案更新成功！{similar_message(similar)}',
+                            'similar': similar})
         else:
             return jsonify({'success': False, 'message': '图案不存在或更新失败'})
+    except ImageNormalizationError as e:
+        return jsonify({'success': False, 'message': str(e)})
     except Exception as e:
         return jsonify({'success': False, 'message': f'更新失败: {str(e)}'})
 
@@ -297,20 +315,18 @@ def delete_pattern():
         if not pattern_id:
             return jsonify({'success': False, 'message': '缺少图案ID'})
         
-        # 获取文件路径并删除文件
+        # 获取文件路径
         query = "SELECT file_path FROM patterns WHERE id = ?"
         results = DatabaseManager.execute_query(query, (pattern_id,))
         
-        if results:
-            file_path = results[0]['file_path']
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        
         # 删除数据库记录
         query = "DELETE FROM patterns WHERE id = ?"
         result = DatabaseManager.execute_update(query, (pattern_id,))
         
         if result > 0:
+            # 文件由后台线程删除
+            schedule_delete('patterns', [row['file_path'] for row in results])
+            invalidate_render_cache(pattern_id=pattern_id)
             return jsonify({'success': True, 'message': '印花图案删除成功！'})
         else:
             return jsonify({'success': False, 'message': '图案不存在或已删除'})
@@ -326,16 +342,14 @@ def clear_patterns():
         query = "SELECT file_path FROM patterns"
         results = DatabaseManager.execute_query(query)
         
-        # 删除文件
-        for row in results:
-            file_path = row['file_path']
-            if os.path.exists(file_path):
-                os.remove(file_path)
-        
         # 清空数据库记录
         query = "DELETE FROM patterns"
         result = DatabaseManager.execute_update(query)
         
+        # 文件由后台线程删除
+        schedule_delete('patterns', [row['file_path'] for row in results])
+        clear_render_cache()
+        
         return jsonify({'success': True, 'message': f'已清空所有印花图案，共 {result} 个'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'清空失败: {str(e)}'})
\ No newline at end of file
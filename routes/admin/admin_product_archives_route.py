@@ -1,13 +1,12 @@
 from flask import Blueprint, render_template, request, jsonify, redirect, url_for, flash, send_file
 from datetime import datetime
 from backend.database import DatabaseManager
-import pandas as pd
+from backend.archive_export import build_archive_workbook
+from backend.storage_reaper import schedule_delete
+from backend.search import search_request
+from backend.metrics import track_job, tracked_job
 import io
 import os
-from openpyxl import Workbook
-from openpyxl.drawing.image import Image
-from openpyxl.utils.dataframe import dataframe_to_rows
-from PIL import Image as PILImage
 
 product_archives_bp = Blueprint('admin_product_archives', __name__, url_prefix='/admin/product_archives')
 
@@ -68,6 +67,12 @@ def add_product_archive():
     except Exception as e:
         return jsonify({'success': False, 'message': f'添加失败: {str(e)}'})
 
+@product_archives_bp.route('/search')
+@login_required
+def search_product_archives():
+    """全文搜索产品效果归档（登记信息、跟进人、授权码）（q 为关键词，page/per_page 分页），包含已删除的归档"""
+    return jsonify(search_request(request.args, ('archive',), active_only=False))
+
 @product_archives_bp.route('/get')
 @login_required
 def get_product_archive():
@@ -106,36 +111,17 @@ def delete_product_archive():
         result = DatabaseManager.delete_product_archive(archive_id)
         
         if result > 0:
-            # 删除对应的图片文件
-            image_files = [
+            # 对应的图片文件由后台线程删除
+            queued = schedule_delete('archives', [
                 archive.get('original_product_path'),
-                archive.get('original_depth_path'), 
+                archive.get('original_depth_path'),
                 archive.get('effect_image_path')
-            ]
-            
-            deleted_files = []
-            failed_files = []
-            
-            for image_file in image_files:
-                if image_file:
-                    # 构建完整的文件路径
-                    file_path = os.path.join('uploads', 'archives', image_file)
-                    try:
-                        if os.path.exists(file_path):
-                            os.remove(file_path)
-                            deleted_files.append(image_file)
-                        else:
-                            # 文件不存在，记录但不报错
-                            pass
-                    except Exception as e:
-                        failed_files.append(f"{image_file}: {str(e)}")
+            ])
             
             # 构建返回消息
             message = '产品效果归档删除成功！'
-            if deleted_files:
-                message += f' 已删除 {len(deleted_files)} 个图片文件。'
-            if failed_files:
-                message += f' 但有 {len(failed_files)} 个图片文件删除失败。'
+            if queued:
+                message += f' {queued} 个图片文件将在后台删除。'
             
             return jsonify({'success': True, 'message': message})
         else:
@@ -143,8 +129,62 @@ def delete_product_archive():
     except Exception as e:
         return jsonify({'success': False, 'message': f'删除失败: {str(e)}'})
 
+@product_archives_bp.route('/render')
+@login_required
+def render_product_archive():
+    """按归档保存的渲染配方在服务端重绘效果图并以PNG下载（默认按产品原图分辨率裁剪输出）"""
+    from backend.render_cache import render_cache
+    from backend.server_renderer import (
+        MAX_RENDER_PIXELS, RenderError, parse_recipe, recipe_render_key, render_recipe
+    )
+    
+    archive_id = request.args.get('id', type=int)
+    if not archive_id:
+        return jsonify({'success': False, 'message': '缺少归档ID'})
+    
+    archive = DatabaseManager.get_product_archive_by_id(archive_id)
+    if not archive or not archive['is_active']:
+        return jsonify({'success': False, 'message': '归档不存在'})
+    recipe = parse_recipe(archive.get('render_recipe'))
+    if not recipe:
+        return jsonify({'success': False, 'message': '该归档没有保存渲染配方，无法重绘'})
+    
+    long_edge = request.args.get('long_edge', type=int)
+    if long_edge is not None and not 0 < long_edge * long_edge <= MAX_RENDER_PIXELS:
+        return jsonify({'success': False, 'message': '输出尺寸无效'})
+    crop_to_product = request.args.get('crop', '1') != '0'
+    
+    # 产品图和深度图使用归档时复制的原图，图案优先使用归档时的文件
+    product_path = os.path.join('uploads', 'archives', archive['original_product_path'])
+    depth_path = os.path.join('uploads', 'archives', archive['original_depth_path'])
+    pattern_path = None
+    if recipe.get('pattern_id'):
+        pattern_path = os.path.join('uploads', 'patterns', recipe.get('pattern_file') or '')
+        if not os.path.isfile(pattern_path):
+            patterns = DatabaseManager.execute_query("SELECT filename FROM patterns WHERE id = ?",
+                                                     (recipe['pattern_id'],))
+            if not patterns:
+                return jsonify({'success': False, 'message': '归档使用的印花图案已不存在'})
+            pattern_path = os.path.join('uploads', 'patterns', patterns[0]['filename'])
+    
+    key = recipe_render_key(recipe, (product_path, depth_path, pattern_path), long_edge, crop_to_product)
+    data = render_cache.get(key) if key else None
+    if data is None:
+        try:
+            with track_job('render'):
+                data = render_recipe(recipe, product_path, depth_path, pattern_path,
+                                     long_edge=long_edge, crop_to_product=crop_to_product)
+        except RenderError as e:
+            return jsonify({'success': False, 'message': f'重绘失败: {str(e)}'})
+        if key:
+            render_cache.put(key, data, {'pattern_id': recipe.get('pattern_id'), 'archive_id': archive_id})
+    
+    return send_file(io.BytesIO(data), mimetype='image/png', as_attachment=True,
+                     download_name=f"effect_{archive_id}_print.png")
+
 @product_archives_bp.route('/export', methods=['POST'])
 @login_required
+@tracked_job('archive_export')
 def export_excel():
     """导出产品效果归档为Excel，支持图片插入"""
     try:
@@ -160,127 +200,7 @@ def export_excel():
         if not archives:
             return jsonify({'success': False, 'message': '没有数据可导出'})
         
-        # 字段映射
-        field_mapping = {
-            'access_code': '授权码',
-            'original_product_path': '原产品图',
-            'original_depth_path': '原深度图', 
-            'effect_image_path': '产品效果图',
-            'effect_category': '效果类型',
-            'register_time': '登记时间',
-            'follow_up_person': '登记人',
-            'register_info': '登记信息'
-        }
-        
-        # 图片字段
-        image_fields = ['original_product_path', 'original_depth_path', 'effect_image_path']
-        
-        # 创建工作簿
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "产品效果归档"
-        
-        # 写入表头
-        headers = [field_mapping[field] for field in selected_fields if field in field_mapping]
-        for col, header in enumerate(headers, 1):
-            ws.cell(row=1, column=col, value=header)
-        
-        # 设置行高（为图片预留空间）
-        # 设置样式
-        from openpyxl.styles import Alignment, Font
-        
-        # 设置表头样式
-        header_font = Font(name='微软雅黑', size=12, bold=True)
-        header_alignment = Alignment(horizontal='center', vertical='center')
-        
-        for col in range(1, len(headers) + 1):
-            cell = ws.cell(row=1, column=col)
-            cell.font = header_font
-            cell.alignment = header_alignment
-        
-        # 设置数据行样式
-        data_font = Font(name='微软雅黑', size=11)
-        data_alignment = Alignment(horizontal='center', vertical='center')
-        
-        # 写入数据
-        for row_idx, archive in enumerate(archives, 2):
-            # 检查当前行是否包含图片字段
-            has_image = any(field in image_fields for field in selected_fields)
-            
-            # 根据是否有图片设置不同的行高
-            if has_image:
-                ws.row_dimensions[row_idx].height = 60  # 图片行高度
-            else:
-                ws.row_dimensions[row_idx].height = 20  # 普通行高度
-            
-            for col_idx, field in enumerate(selected_fields, 1):
-                if field not in field_mapping:
-                    continue
-                
-                cell = ws.cell(row=row_idx, column=col_idx)
-                cell.font = data_font
-                cell.alignment = data_alignment
-                    
-                if field in image_fields:
-                    # 处理图片字段
-                    image_filename = archive.get(field, '')
-                    if image_filename:
-                        # 数据库中存储的是文件名，需要构建完整路径
-                        full_image_path = os.path.join('uploads', 'archives', image_filename)
-                        if os.path.exists(full_image_path):
-                            try:
-                                # 直接插入原图片到Excel
-                                excel_img = Image(full_image_path)
-                                
-                                # 调整图片大小，让图片占满单元格的大部分空间
-                                excel_img.width = 80   # 减小图片宽度
-                                excel_img.height = 50  # 减小图片高度
-                                
-                                # 计算单元格位置，让图片居中
-                                excel_img.anchor = cell.coordinate
-                                ws.add_image(excel_img)
-                                        
-                            except Exception as e:
-                                # 如果图片处理失败，显示文件名
-                                cell.value = image_filename
-                        else:
-                            cell.value = "图片不存在"
-                    else:
-                        cell.value = "无图片"
-                else:
-                    # 处理非图片字段
-                    value = archive.get(field, '') or ''
-                    # 处理时间格式
-                    if field == 'register_time' and value:
-                        value = str(value)[:16] if len(str(value)) > 16 else str(value)
-                    cell.value = value
-        
-        # 调整列宽
-        for col_idx, field in enumerate(selected_fields, 1):
-            column_letter = ws.cell(row=1, column=col_idx).column_letter
-            
-            if field in image_fields:
-                # 图片列设置固定宽度
-                ws.column_dimensions[column_letter].width = 12
-            else:
-                # 非图片列根据内容调整宽度
-                max_length = 0
-                for row in range(1, len(archives) + 2):
-                    cell_value = ws.cell(row=row, column=col_idx).value
-                    if cell_value:
-                        # 中文字符按2个字符计算宽度
-                        length = sum(2 if ord(char) > 127 else 1 for char in str(cell_value))
-                        if length > max_length:
-                            max_length = length
-                
-                # 设置合适的列宽，最小8，最大30
-                adjusted_width = max(min(max_length + 2, 30), 8)
-                ws.column_dimensions[column_letter].width = adjusted_width
-        
-        # 保存到内存
-        output = io.BytesIO()
-        wb.save(output)
-        output.seek(0)
+        output = build_archive_workbook(archives, selected_fields)
         
         # 生成文件名
         filename = f"产品效果归档_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
@@ -1,9 +1,13 @@
-from flask import Blueprint, render_template, request, jsonify, redirect, url_for
+from flask import Blueprint, render_template, request, jsonify, redirect, url_for, current_app
 from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
-from PIL import Image
 from backend.database import DatabaseManager
+from backend.permissions import PermissionManager
+from backend.image_normalizer import ImageNormalizationError, normalize_image, store_normalized
+from backend.storage_reaper import schedule_delete
+from backend.render_cache import clear_render_cache, invalidate_render_cache
+from backend.search import search_request
 
 products_bp = Blueprint('admin_products', __name__, url_prefix='/admin/products')
 
@@ -27,7 +31,49 @@ def products():
         print(f"获取产品数据失败: {e}")
         products = []
         categories = []
-    return render_template('admin/products.html', products=products, categories=categories)
+    return render_template('admin/products.html', products=products, categories=categories,
+                           import_root=_product_import_root())
+
+def _product_import_root():
+    from backend.product_importer import DEFAULT_IMPORT_ROOT
+    return current_app.config.get('PRODUCT_IMPORT_ROOT', DEFAULT_IMPORT_ROOT)
+
+@products_bp.route('/bulk-import', methods=['POST'])
+@login_required
+def bulk_import_products():
+    """从ZIP压缩包或导入目录下的文件夹批量导入产品（产品图与深度图按命名规则自动配对）"""
+    from backend.product_importer import (
+        BulkProductImporter, ProductImportError, open_zip_source, open_directory_source
+    )
+    from backend.metrics import track_job
+    
+    if not PermissionManager.has_action_permission('import'):
+        return jsonify({'success': False, 'message': '权限不足'}), 403
+    
+    archive = request.files.get('archive')
+    directory = request.form.get('directory', '').strip()
+    category_id = request.form.get('category_id', type=int)
+    
+    try:
+        if archive and archive.filename:
+            entries, close_source = open_zip_source(archive.stream)
+        elif directory:
+            entries, close_source = open_directory_source(directory, _product_import_root())
+        else:
+            return jsonify({'success': False, 'message': '请上传ZIP压缩包或填写导入目录'})
+    except ProductImportError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    
+    try:
+        with track_job('product_import'):
+            report = BulkProductImporter(category_id=category_id).run(entries)
+    except Exception as e:
+        print(f"产品批量导入失败: {e}")
+        return jsonify({'success': False, 'message': f'产品批量导入失败: {e}'})
+    finally:
+        close_source()
+    
+    return jsonify(report)
 
 @products_bp.route('/add', methods=['POST'])
 @login_required
@@ -54,18 +100,23 @@ def add_product():
         product_filename = f"product_{timestamp}_{secure_filename(product_file.filename)}"
         depth_filename = f"depth_{timestamp}_{secure_filename(depth_file.filename)}"
         
-        product_path = os.path.join('uploads', 'products', product_filename)
-        depth_path = os.path.join('uploads', 'depth_maps', depth_filename)
-        
-        os.makedirs(os.path.dirname(product_path), exist_ok=True)
-        os.makedirs(os.path.dirname(depth_path), exist_ok=True)
-        
-        product_file.save(product_path)
-        depth_file.save(depth_path)
+        # 两张图都通过规范化检查后再写入磁盘（深度图存为单通道灰度）
+        product_data = product_file.read()
+        depth_data = depth_file.read()
+        try:
+            product = normalize_image(product_data, 'product')
+        except ImageNormalizationError as e:
+            return jsonify({'success': False, 'message': f'产品图: {e}'})
+        try:
+            depth = normalize_image(depth_data, 'depth')
+        except ImageNormalizationError as e:
+            return jsonify({'success': False, 'message': f'深度图: {e}'})
         
-        # 获取图片尺寸
-        with Image.open(product_path) as img:
-            width, height = img.size
+        product_filename, _ = store_normalized(product, product_data, 'product',
+                                               os.path.join('uploads', 'products'), product_filename)
+        depth_filename, _ = store_normalized(depth, depth_data, 'depth',
+                                             os.path.join('uploads', 'depth_maps'), depth_filename)
+        width, height = product.width, product.height
         
         # 创建产品记录
         query = '''
@@ -85,6 +136,12 @@ def add_product():
     except Exception as e:
         return jsonify({'success': False, 'message': f'添加失败: {str(e)}'})
 
+@products_bp.route('/search')
+@login_required
+def search_products():
+    """全文搜索产品和产品分类（q 为关键词，type 为逗号分隔的类型，page/per_page 分页），包含已停用的记录"""
+    return jsonify(search_request(request.args, ('product', 'product_category'), active_only=False))
+
 @products_bp.route('/get')
 @login_required
 def get_product():
@@ -121,19 +178,35 @@ def update_product():
         update_fields = ["title = ?", "category_id = ?"]
         params = [name, category_id]
         
+        # 原图片文件，替换成功后删除
+        old_product = DatabaseManager.execute_query(
+            "SELECT product_image_path, depth_image_path FROM products WHERE id = ?", (product_id,))
+        replaced_images = []
+        replaced_depths = []
+        
+        # 新上传的图片全部通过规范化检查后再写入磁盘（深度图存为单通道灰度）
+        product_file = request.files.get('image')
+        depth_file = request.files.get('depth_map')
+        product = depth = None
+        if product_file and product_file.filename != '':
+            product_data = product_file.read()
+            try:
+                product = normalize_image(product_data, 'product')
+            except ImageNormalizationError as e:
+                return jsonify({'success': False, 'message': f'产品图: {e}'})
+        if depth_file and depth_file.filename != '':
+            depth_data = depth_file.read()
+            try:
+                depth = normalize_image(depth_data, 'depth')
+            except ImageNormalizationError as e:
+                return jsonify({'success': False, 'message': f'深度图: {e}'})
+        
         # 处理产品图片上传
-        if 'image' in request.files and request.files['image'].filename != '':
-            product_file = request.files['image']
+        if product is not None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             product_filename = f"product_{timestamp}_{secure_filename(product_file.filename)}"
-            product_path = os.path.join('uploads', 'products', product_filename)
-            
-            os.makedirs(os.path.dirname(product_path), exist_ok=True)
-            product_file.save(product_path)
-            
-            # 获取图片尺寸
-            with Image.open(product_path) as img:
-                width, height = img.size
+            product_filename, _ = store_normalized(product, product_data, 'product',
+                                                   os.path.join('uploads', 'products'), product_filename)
             
             update_fields.extend([
                 "product_image = ?", 
@@ -141,23 +214,24 @@ def update_product():
                 "image_width = ?",
                 "image_height = ?"
             ])
-            params.extend([product_filename, product_filename, width, height])
+            params.extend([product_filename, product_filename, product.width, product.height])
+            if old_product:
+                replaced_images.append(old_product[0]['product_image_path'])
         
         # 处理深度图上传
-        if 'depth_map' in request.files and request.files['depth_map'].filename != '':
-            depth_file = request.files['depth_map']
+        if depth is not None:
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             depth_filename = f"depth_{timestamp}_{secure_filename(depth_file.filename)}"
-            depth_path = os.path.join('uploads', 'depth_maps', depth_filename)
-            
-            os.makedirs(os.path.dirname(depth_path), exist_ok=True)
-            depth_file.save(depth_path)
+            depth_filename, _ = store_normalized(depth, depth_data, 'depth',
+                                                 os.path.join('uploads', 'depth_maps'), depth_filename)
             
             update_fields.extend([
                 "depth_image = ?",
                 "depth_image_path = ?"
             ])
             params.extend([depth_filename, depth_filename])
+            if old_product:
+                replaced_depths.append(old_product[0]['depth_image_path'])
         
         # 添加产品ID到参数末尾
         params.append(product_id)
@@ -168,6 +242,11 @@ def update_product():
         result = DatabaseManager.execute_update(query, tuple(params))
         
         if result > 0:
+            schedule_delete('products', replaced_images)
+            schedule_delete('depth_maps', replaced_depths)
+            if product is not None or depth is not None:
+                # 产品图或深度图已替换，使用旧图的效果图缓存失效
+                invalidate_render_cache(product_id=product_id)
             return jsonify({'success': True, 'message': '产品更新成功！'})
         else:
             return jsonify({'success': False, 'message': '产品不存在或更新失败'})
@@ -185,25 +264,19 @@ def delete_product():
         if not product_id:
             return jsonify({'success': False, 'message': '缺少产品ID'})
         
-        # 获取文件路径并删除文件
+        # 获取文件路径
         query = "SELECT product_image_path, depth_image_path FROM products WHERE id = ?"
         results = DatabaseManager.execute_query(query, (product_id,))
         
-        if results:
-            product = results[0]
-            image_path = os.path.join('uploads', 'products', product['product_image_path'])
-            depth_path = os.path.join('uploads', 'depth_maps', product['depth_image_path'])
-            
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            if os.path.exists(depth_path):
-                os.remove(depth_path)
-        
         # 删除数据库记录
         query = "DELETE FROM products WHERE id = ?"
         result = DatabaseManager.execute_update(query, (product_id,))
         
         if result > 0:
+            # 文件由后台线程删除
+            schedule_delete('products', [row['product_image_path'] for row in results])
+            schedule_delete('depth_maps', [row['depth_image_path'] for row in results])
+            invalidate_render_cache(product_id=product_id)
             return jsonify({'success': True, 'message': '产品删除成功！'})
         else:
             return jsonify({'success': False, 'message': '产品不存在或已删除'})
@@ -219,20 +292,15 @@ def clear_products():
         query = "SELECT product_image_path, depth_image_path FROM products"
         results = DatabaseManager.execute_query(query)
         
-        # 删除文件
-        for row in results:
-            image_path = os.path.join('uploads', 'products', row['product_image_path'])
-            depth_path = os.path.join('uploads', 'depth_maps', row['depth_image_path'])
-            
-            if os.path.exists(image_path):
-                os.remove(image_path)
-            if os.path.exists(depth_path):
-                os.remove(depth_path)
-        
         # 清空数据库记录
         query = "DELETE FROM products"
         result = DatabaseManager.execute_update(query)
         
+        # 文件由后台线程删除
+        schedule_delete('products', [row['product_image_path'] for row in results])
+        schedule_delete('depth_maps', [row['depth_image_path'] for row in results])
+        clear_render_cache()
+        
         return jsonify({'success': True, 'message': f'已清空所有产品，共 {result} 个'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'清空失败: {str(e)}'})
\ No newline at end of file
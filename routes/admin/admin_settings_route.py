@@ -3,9 +3,13 @@ import os
 import shutil
 from datetime import datetime
 from backend.database import DatabaseManager
+from backend.storage_reaper import last_scan_report, reaper_stats, scan_orphans
 
 settings_bp = Blueprint('admin_settings', __name__, url_prefix='/admin/settings')
 
+# 后台进程启动时间，显示在系统信息中
+STARTED_AT = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+
 def admin_required(f):
     def decorated_function(*args, **kwargs):
         from flask import session
@@ -65,7 +69,7 @@ def settings():
             'total_size_mb': 0
         }
     
-    return render_template('admin/settings.html', system_info=system_info)
+    return render_template('admin/settings.html', system_info=system_info, started_at=STARTED_AT)
 
 @settings_bp.route('/backup-database', methods=['POST'])
 @admin_required
@@ -118,6 +122,33 @@ def clear_uploads():
     except Exception as e:
         return jsonify({'success': False, 'message': f'清理失败: {str(e)}'})
 
+@settings_bp.route('/storage-orphans')
+@admin_required
+def storage_orphans():
+    """扫描没有数据库记录引用的上传文件（只统计不删除），cached=1 时返回最近一次扫描结果"""
+    try:
+        if request.args.get('cached'):
+            report = last_scan_report()
+        else:
+            report = scan_orphans(reclaim=False)
+        return jsonify({'success': True, 'data': report, 'reaper': reaper_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'扫描失败: {str(e)}'})
+
+@settings_bp.route('/storage-orphans/reclaim', methods=['POST'])
+@admin_required
+def reclaim_storage_orphans():
+    """删除没有数据库记录引用的上传文件"""
+    try:
+        report = scan_orphans(reclaim=True)
+        return jsonify({
+            'success': True,
+            'message': f"已删除 {report['reclaimed_files']} 个孤儿文件，释放 {round(report['reclaimed_bytes'] / (1024 * 1024), 2)} MB",
+            'data': report
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'清理失败: {str(e)}'})
+
 @settings_bp.route('/reset-database', methods=['POST'])
 @admin_required
 def reset_database():
@@ -144,4 +175,39 @@ def reset_database():
         })
         
     except Exception as e:
-        return jsonify({'success': False, 'message': f'重置失败: {str(e)}'})
\ No newline at end of file
+        return jsonify({'success': False, 'message': f'重置失败: {str(e)}'})
+
+@settings_bp.route('/query-profile')
+@admin_required
+def query_profile():
+    """SQL语句性能分析页面"""
+    from backend.query_profiler import install_query_profiler
+    
+    top_n = request.args.get('top', 20, type=int)
+    report = install_query_profiler('admin').report(top_n=top_n)
+    return render_template('admin/query_profile.html', report=report, top_n=top_n)
+
+@settings_bp.route('/query-profile/config', methods=['POST'])
+@admin_required
+def update_query_profile_config():
+    """修改SQL分析开关和慢查询阈值（对前台和后台进程同时生效）"""
+    from backend.query_profiler import install_query_profiler
+    
+    try:
+        data = request.get_json() or {}
+        changes = {key: data[key] for key in ('enabled', 'slow_threshold_ms', 'explain') if key in data}
+        config = install_query_profiler('admin').set_config(**changes)
+        return jsonify({'success': True, 'message': 'SQL分析设置已保存', 'config': config})
+    except (TypeError, ValueError) as e:
+        return jsonify({'success': False, 'message': f'参数无效: {str(e)}'})
+    except OSError as e:
+        return jsonify({'success': False, 'message': f'保存失败: {str(e)}'})
+
+@settings_bp.route('/query-profile/reset', methods=['POST'])
+@admin_required
+def reset_query_profile():
+    """清空SQL统计和慢查询日志"""
+    from backend.query_profiler import install_query_profiler
+    
+    install_query_profiler('admin').reset()
+    return jsonify({'success': True, 'message': 'SQL统计已清空'})
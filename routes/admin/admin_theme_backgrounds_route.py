@@ -3,6 +3,7 @@ from werkzeug.utils import secure_filename
 import os
 from datetime import datetime
 from backend.database import DatabaseManager
+from backend.storage_reaper import schedule_delete
 
 theme_backgrounds_bp = Blueprint('admin_theme_backgrounds', __name__, url_prefix='/admin/theme-backgrounds')
 
@@ -150,11 +151,6 @@ def update_theme_background():
             if file_ext not in allowed_extensions:
                 return jsonify({'success': False, 'message': '只支持 PNG、JPG、JPEG、WEBP 格式'})
             
-            # 删除旧文件
-            old_file_path = original_bg['file_path'].replace('/uploads/', 'uploads/')
-            if os.path.exists(old_file_path):
-                os.remove(old_file_path)
-            
             # 保存新文件
             timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
             safe_name = secure_filename(background_name or original_bg['background_name'])
@@ -178,6 +174,9 @@ def update_theme_background():
         )
         
         if result > 0:
+            # 替换了图片时删除旧文件
+            if new_file_path:
+                schedule_delete('themes_bgs', [original_bg['file_path']])
             return jsonify({'success': True, 'message': '背景图更新成功！'})
         else:
             return jsonify({'success': False, 'message': '背景图不存在或更新失败'})
@@ -197,16 +196,14 @@ def delete_theme_background():
         
         # 获取文件路径
         background = DatabaseManager.get_theme_background_by_id(bg_id)
-        if background:
-            # 删除物理文件
-            file_path = background['file_path'].replace('/uploads/', 'uploads/')
-            if os.path.exists(file_path):
-                os.remove(file_path)
         
         # 从数据库删除记录
         result = DatabaseManager.delete_theme_background(bg_id)
         
         if result > 0:
+            # 文件由后台线程删除
+            if background:
+                schedule_delete('themes_bgs', [background['file_path']])
             return jsonify({'success': True, 'message': '背景图删除成功！'})
         else:
             return jsonify({'success': False, 'message': '背景图不存在或已删除'})
@@ -219,19 +216,16 @@ def delete_theme_background():
 def clear_all_theme_backgrounds():
     """清空所有主题背景图"""
     try:
-        # 获取所有背景图
-        backgrounds = DatabaseManager.get_theme_backgrounds()
-        
-        # 删除物理文件
-        for bg in backgrounds:
-            file_path = bg['file_path'].replace('/uploads/', 'uploads/')
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        # 获取所有背景图（包含已停用的）
+        backgrounds = DatabaseManager.get_theme_backgrounds(active_only=False)
         
         # 从数据库删除所有记录
         query = "DELETE FROM theme_backgrounds"
         deleted_count = DatabaseManager.execute_update(query)
         
+        # 文件由后台线程删除
+        schedule_delete('themes_bgs', [bg['file_path'] for bg in backgrounds])
+        
         return jsonify({
             'success': True,
             'message': f'已清空所有背景图，共删除 {deleted_count} 张'
@@ -252,17 +246,14 @@ def clear_theme_backgrounds():
             return jsonify({'success': False, 'message': '缺少主题名称'})
         
         # 获取该主题的所有背景图
-        backgrounds = DatabaseManager.get_theme_backgrounds(theme_name)
-        
-        # 删除物理文件
-        for bg in backgrounds:
-            file_path = bg['file_path'].replace('/uploads/', 'uploads/')
-            if os.path.exists(file_path):
-                os.remove(file_path)
+        backgrounds = DatabaseManager.get_theme_backgrounds(theme_name, active_only=False)
         
         # 从数据库删除记录
         deleted_count = DatabaseManager.clear_theme_backgrounds(theme_name)
         
+        # 文件由后台线程删除
+        schedule_delete('themes_bgs', [bg['file_path'] for bg in backgrounds])
+        
         return jsonify({
             'success': True,
             'message': f'已清空主题 "{theme_name}" 的 {deleted_count} 张背景图'
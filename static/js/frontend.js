@@ -237,18 +237,17 @@ class FrontendApp {
         showLoading('加载数据...');
         
         try {
-            // 并行加载所有数据
-            const [patternsRes, productsRes, categoriesRes, themesRes] = await Promise.all([
-                fetch('/api/patterns'),
-                fetch('/api/products'),
-                fetch('/api/categories'),
-                fetch('/api/themes')
-            ]);
+            // 首屏数据一次请求取得（全部产品）
+            const response = await fetch(`/api/bootstrap?theme=${encodeURIComponent(this.currentTheme)}&category_id=all`);
+            const result = await response.json();
+            if (!result.success) {
+                throw new Error(result.message);
+            }
             
-            this.patterns = await patternsRes.json();
-            this.products = await productsRes.json();
-            this.categories = await categoriesRes.json();
-            const themes = await themesRes.json();
+            this.patterns = result.data.patterns;
+            this.products = result.data.products;
+            this.categories = result.data.categories;
+            const themes = result.data.themes;
             
             this.renderPatterns();
             this.renderProducts();
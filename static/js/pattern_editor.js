@@ -48,8 +48,44 @@ class DataManager {
         return await this.fetchAPI('/api/categories');
     }
     
-    static async loadThemes() {
-        return await this.fetchAPI('/api/themes');
+    // 首屏数据（印花、分类、默认分类产品、当前主题背景图）一次请求取得，多处调用共用同一个请求
+    static loadBootstrap() {
+        if (!this._bootstrapPromise) {
+            let theme = 'default';
+            try { theme = localStorage.getItem('selectedTheme') || 'default'; } catch (_) {}
+            this._bootstrapPromise = fetch(`/api/bootstrap?theme=${encodeURIComponent(theme)}`)
+                .then(async response => {
+                    if (response.status === 401) {
+                        const result = await response.json();
+                        if (result.redirect) {
+                            alert(result.message || '会话已失效，请重新登录');
+                            window.location.href = result.redirect;
+                        }
+                        return null;
+                    }
+                    const result = await response.json();
+                    if (!result.success) {
+                        console.error('API /api/bootstrap 失败:', result.message);
+                        return null;
+                    }
+                    return result.data;
+                })
+                .catch(error => {
+                    console.error('API /api/bootstrap 请求失败:', error);
+                    return null;
+                });
+        }
+        return this._bootstrapPromise;
+    }
+    
+    // 首屏数据中的背景图只在初次加载该主题时使用，之后切换主题按需请求
+    static async takeBootstrapBackgrounds(themeKey) {
+        const data = await this.loadBootstrap();
+        if (!data || this._bootstrapBackgroundsUsed || data.theme !== themeKey) {
+            return null;
+        }
+        this._bootstrapBackgroundsUsed = true;
+        return data.backgrounds;
     }
 }
 
@@ -455,6 +491,10 @@ window.addEventListener('load', () => {
     let bgOverlayOpacityTop = parseFloat(localStorage.getItem('bgOpacityTop') || '0.3');
     let bgOverlayOpacityBottom = parseFloat(localStorage.getItem('bgOpacityBottom') || '0.3');
     async function fetchBackgrounds(themeKey) {
+        const preloaded = await DataManager.takeBootstrapBackgrounds(themeKey);
+        if (preloaded) {
+            return preloaded;
+        }
         try {
             const resp = await fetch(`/api/theme-backgrounds?theme=${encodeURIComponent(themeKey)}`);
             const json = await resp.json();
@@ -1260,10 +1300,8 @@ window.addEventListener('load', () => {
                     return;
                 }
                 
-                // 获取当前画布的图片数据
-                const effectImageData = renderer.domElement.toDataURL('image/png');
-                
                 try {
+                    // 归档访客看到的画布效果图，同时提交渲染配方供后台按打印分辨率重绘
                     const response = await fetch('/api/archive', {
                         method: 'POST',
                         headers: {
@@ -1275,7 +1313,8 @@ window.addEventListener('load', () => {
                             effectCategory: effectCategory,
                             productId: state.productId,
                             patternId: state.patternId,
-                            effectImageData: effectImageData
+                            effectImageData: renderer.domElement.toDataURL('image/png'),
+                            renderParams: getRenderParams()
                         })
                     });
                     
@@ -1296,6 +1335,18 @@ window.addEventListener('load', () => {
         }
     }
     
+    // 渲染参数（与服务端 backend/render_cache.py 的 DEFAULT_RENDER_PARAMS 对应）
+    function getRenderParams() {
+        return {
+            tx: state.tx, ty: state.ty, scale: state.scale,
+            skewX: state.skewX, skewY: state.skewY,
+            distortion: state.distortion, perspective: state.perspective,
+            depthThreshold: state.depthThreshold, blendMode: state.blendMode, opacity: state.opacity,
+            width: renderer.domElement.width, height: renderer.domElement.height,
+            pixelRatio: renderer.getPixelRatio()
+        };
+    }
+    
     function centerPattern() {
         // 将图案定位到画布的绝对中心
         // 在着色器坐标系统中，(0,0)对应画布中心
@@ -1325,7 +1376,19 @@ window.addEventListener('load', () => {
     // --- Part 8: 数据加载和UI渲染 ---
     async function loadAllData() {
         try {
-            // 并行加载所有数据
+            // 首屏数据一次请求取得，失败时回退为分别请求
+            const bootstrap = await DataManager.loadBootstrap();
+            if (bootstrap) {
+                patterns = bootstrap.patterns;
+                categories = bootstrap.categories;
+                products = bootstrap.products;
+                renderPatterns(patterns);
+                renderCategories(categories);
+                renderProducts(products);
+                console.log('所有数据加载完成');
+                return;
+            }
+            
             const [patternsData, categoriesData] = await Promise.all([
                 DataManager.loadPatterns(),
                 DataManager.loadCategories()